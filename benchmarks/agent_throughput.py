@@ -0,0 +1,268 @@
+"""Measure throughput, step latency, memory and checkpoint size of a CodeAct agent.
+
+A deterministic fake model replays scripts like the ones of the math and cipher
+examples, so that results only depend on the graph, the eval function and the
+checkpointer. Starting from a baseline configuration, each of these is increased
+in turn:
+
+- threads: runs executed concurrently, each on its own thread
+- turns: sandbox round trips per run
+- context: number of items in a list the first script adds to the context
+- tools: number of tools given to the agent
+
+For every configuration the script reports steps per second across all threads,
+p50 and p99 latency of a graph step, peak and retained memory (measured in a
+second run, with tracemalloc), and the checkpoint bytes stored per thread.
+
+Results can be written as JSON and compared with the results of another commit:
+
+    python benchmarks/agent_throughput.py --output before.json
+    git checkout my-branch
+    python benchmarks/agent_throughput.py --compare before.json
+"""
+
+import argparse
+import asyncio
+import builtins
+import io
+import json
+import math
+import platform
+import subprocess
+import time
+import tracemalloc
+from typing import Any, Callable, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langgraph.checkpoint.memory import InMemorySaver
+
+from langgraph_codeact import create_codeact
+
+BASELINE = {"threads": 4, "turns": 5, "context": 100, "tools": 10}
+SWEEPS = {
+    "threads": [1, 16, 64],
+    "turns": [20, 50],
+    "context": [10_000, 100_000],
+    "tools": [50, 200],
+}
+
+
+def eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+    original_keys = set(_locals.keys())
+    # Scripts of concurrent threads run at the same time, so print is redirected per
+    # script instead of with contextlib.redirect_stdout, which replaces sys.stdout
+    output = io.StringIO()
+
+    def print_(*args: Any, **kwargs: Any) -> None:
+        print(*args, **{**kwargs, "file": output})
+
+    try:
+        exec(code, {"__builtins__": builtins, "print": print_}, _locals)
+        result = output.getvalue() or "<code ran, no output printed to stdout>"
+    except Exception as e:
+        result = f"Error during execution: {repr(e)}"
+    new_keys = set(_locals.keys()) - original_keys
+    return result, {key: _locals[key] for key in new_keys}
+
+
+def add(a: float, b: float) -> float:
+    """Add two numbers together."""
+    return a + b
+
+
+def multiply(a: float, b: float) -> float:
+    """Multiply two numbers together."""
+    return a * b
+
+
+def sqrt(a: float) -> float:
+    """Take the square root of a number."""
+    return math.sqrt(a)
+
+
+def caesar_shift_decode(text: str, shift: int) -> str:
+    """Decode text that was encoded using Caesar shift."""
+    return "".join(
+        chr(
+            (ord(c) - ord("a" if c.islower() else "A") - shift) % 26
+            + ord("a" if c.islower() else "A")
+        )
+        if c.isalpha()
+        else c
+        for c in text
+    )
+
+
+def make_filler_tool(i: int) -> Callable[[float, float], float]:
+    def tool(a: float, b: float) -> float:
+        return a * i + b
+
+    tool.__name__ = f"lookup_metric_{i}"
+    tool.__doc__ = f"Look up metric number {i} for an item, scaled by a weight."
+    return tool
+
+
+def make_tools(count: int) -> list[Callable]:
+    tools: list[Callable] = [add, multiply, sqrt, caesar_shift_decode]
+    return tools + [make_filler_tool(i) for i in range(max(0, count - len(tools)))]
+
+
+def make_script(turn: int, context: int) -> str:
+    if turn == 0:
+        return f"```python\ndata = list(range({context}))\nprint(len(data))\n```"
+    if turn % 2:
+        return f"```python\nx{turn} = add(multiply({turn}, 2), sqrt(16))\nprint(x{turn})\n```"
+    return f"```python\nmsg{turn} = caesar_shift_decode('Khoor', 3)\nprint(msg{turn})\n```"
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Fake chat model answering with the script of the current turn of the thread.
+
+    The turn is the number of AI messages in the input, so concurrent threads get the
+    same responses regardless of how their calls interleave.
+    """
+
+    turns: int
+    context: int
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _respond(self, messages: list[BaseMessage]) -> ChatResult:
+        turn = sum(isinstance(m, AIMessage) for m in messages)
+        content = make_script(turn, self.context) if turn < self.turns else "Done."
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _generate(self, messages: list[BaseMessage], *args: Any, **kwargs: Any) -> ChatResult:
+        return self._respond(messages)
+
+    async def _agenerate(
+        self, messages: list[BaseMessage], *args: Any, **kwargs: Any
+    ) -> ChatResult:
+        return self._respond(messages)
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def checkpoint_bytes(checkpointer: InMemorySaver) -> int:
+    blobs = sum(len(value[1]) for value in checkpointer.blobs.values())
+    writes = sum(
+        len(value[1])
+        for task_writes in checkpointer.writes.values()
+        for _, _, value, _ in task_writes.values()
+    )
+    return blobs + writes
+
+
+async def run(threads: int, turns: int, context: int, tools: int) -> dict[str, Any]:
+    model = ScriptedChatModel(turns=turns, context=context)
+    checkpointer = InMemorySaver()
+    agent = create_codeact(model, make_tools(tools), eval_fn).compile(checkpointer=checkpointer)
+    latencies: list[float] = []
+
+    async def run_thread(i: int) -> None:
+        config = {"configurable": {"thread_id": str(i)}, "recursion_limit": 3 * turns + 10}
+        last = time.perf_counter()
+        async for _ in agent.astream(
+            {"messages": [{"role": "user", "content": "Solve the task."}]},
+            config,
+            stream_mode="updates",
+        ):
+            now = time.perf_counter()
+            latencies.append(now - last)
+            last = now
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_thread(i) for i in range(threads)))
+    elapsed = time.perf_counter() - start
+    return {
+        "steps_per_second": len(latencies) / elapsed,
+        "p50_ms": 1000 * percentile(latencies, 0.5),
+        "p99_ms": 1000 * percentile(latencies, 0.99),
+        "checkpoint_bytes_per_thread": checkpoint_bytes(checkpointer) // threads,
+    }
+
+
+def measure(params: dict[str, int], repeat: int = 1) -> dict[str, Any]:
+    # Keep the run with the median throughput, to reduce the noise between runs
+    runs = sorted(
+        (asyncio.run(run(**params)) for _ in range(repeat)), key=lambda r: r["steps_per_second"]
+    )
+    result = runs[len(runs) // 2]
+    # Memory is measured in a separate run, as tracemalloc slows everything down
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    asyncio.run(run(**params))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result["peak_memory_mb"] = (peak - before) / 1024**2
+    result["retained_memory_mb"] = (current - before) / 1024**2
+    return {"params": params, **result}
+
+
+def configurations() -> list[dict[str, int]]:
+    configs = [dict(BASELINE)]
+    for name, values in SWEEPS.items():
+        configs.extend({**BASELINE, name: value} for value in values)
+    return configs
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {json.dumps(r["params"], sort_keys=True): r for r in json.load(f)["results"]}
+
+    # Warm up imports and caches
+    asyncio.run(run(threads=1, turns=2, context=10, tools=5))
+
+    results = []
+    header = f"{'threads':>7} {'turns':>5} {'context':>7} {'tools':>5} {'steps/s':>9} {'p50 ms':>7} {'p99 ms':>7} {'peak MB':>8} {'kept MB':>8} {'ckpt KB':>8}"
+    print(header)
+    for params in configurations():
+        result = measure(params, args.repeat)
+        results.append(result)
+        row = "{threads:>7} {turns:>5} {context:>7} {tools:>5}".format(**params)
+        row += " {steps_per_second:>9.1f} {p50_ms:>7.2f} {p99_ms:>7.2f} {peak_memory_mb:>8.2f} {retained_memory_mb:>8.2f} {:>8.1f}".format(
+            result["checkpoint_bytes_per_thread"] / 1024, **result
+        )
+        previous = baseline.get(json.dumps(params, sort_keys=True))
+        if previous:
+            row += "  ({:+.0%} steps/s, {:+.0%} p99)".format(
+                result["steps_per_second"] / previous["steps_per_second"] - 1,
+                result["p99_ms"] / previous["p99_ms"] - 1,
+            )
+        print(row)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"commit": get_commit(), "python": platform.python_version(), "results": results},
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compare codeblock extraction with the previous regex against `CodeBlockParser`.
+
+The regex scans ahead from every opening fence for a closing one, so text with many
+fences that are never closed takes quadratic time. For each input the script reports
+the time taken by:
+
+- regex: the `re.findall` based extraction used before `CodeBlockParser`
+- parser: `extract_codeblocks`, which feeds the whole text to `CodeBlockParser`
+- streamed: `CodeBlockParser` fed in chunks of 16 characters, as when streaming
+
+Run with: python benchmarks/codeblock_parser.py [size]
+"""
+
+import re
+import sys
+import time
+from typing import Callable
+
+from langgraph_codeact.utils import CodeBlockParser, extract_codeblocks
+
+BACKTICK_PATTERN = r"(?:^|\n)```(.*?)(?:```(?:\n|$))"
+
+
+def regex_extract(text: str) -> list[str]:
+    blocks = []
+    for block in re.findall(BACKTICK_PATTERN, text, re.DOTALL):
+        block = block.strip()
+        lines = block.split("\n")
+        if lines and (not lines[0].strip() or " " not in lines[0].strip()):
+            block = "\n".join(lines[1:])
+        blocks.append(block)
+    return blocks
+
+
+def streamed_extract(text: str) -> list[str]:
+    parser = CodeBlockParser()
+    blocks = []
+    for i in range(0, len(text), 16):
+        blocks.extend(parser.feed(text[i : i + 16]))
+    return blocks + parser.finish()
+
+
+def make_inputs(size: int) -> dict[str, str]:
+    block = "```python\nfor i in range(10):\n    print(i)\n```\nSome text between blocks.\n"
+    return {
+        "many blocks": block * (size // len(block)),
+        "one large block": "```python\n" + "x = 1\n" * (size // 6) + "```\n",
+        "unclosed fences": "\n```x" * (size // 5),
+        "inline backticks": "Use ```code``` and `more` inline ``` text.\n" * (size // 44),
+    }
+
+
+def timeit(func: Callable[[str], list[str]], text: str) -> float:
+    start = time.perf_counter()
+    func(text)
+    return time.perf_counter() - start
+
+
+def main(size: int = 50_000) -> None:
+    print(f"{'input':>18} {'regex':>10} {'parser':>10} {'streamed':>10}")
+    for name, text in make_inputs(size).items():
+        times = [
+            timeit(func, text) for func in (regex_extract, extract_codeblocks, streamed_extract)
+        ]
+        print("{:>18} {:>9.4f}s {:>9.4f}s {:>9.4f}s".format(name, *times))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
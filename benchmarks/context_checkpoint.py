@@ -0,0 +1,102 @@
+"""Measure checkpoint bytes written per sandbox step as the context grows.
+
+Each turn the fake model defines one new variable, so the namespace grows linearly
+with the number of turns. For every sandbox step the script reports:
+
+- delta: bytes of the sandbox node's context write (what is stored with the step's writes)
+- full copy: bytes the same write took when the whole namespace was copied every step
+- snapshot: bytes of the context channel stored with the checkpoint
+- blob snapshot: the same, with a `ContextSerializer` storing each value in a blob store
+
+Only the writes stay flat. The checkpoint still stores the whole context channel
+whenever it changes, so the snapshot grows with the namespace, as much as the full
+copy. Storing the values in a blob store, or in an object store with
+`create_codeact(..., object_store=...)`, makes each variable cost a reference
+instead of its value, but the snapshot still grows linearly with the number of
+variables.
+
+Run with: python benchmarks/context_checkpoint.py [turns]
+"""
+
+import sys
+from typing import Any
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+from langgraph_codeact import ContextSerializer, create_codeact
+from langgraph_codeact.cache import InMemoryCacheBackend
+from langgraph_codeact.context import merge_context
+
+
+def eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+    original_keys = set(_locals.keys())
+    exec(code, {}, _locals)
+    new_keys = set(_locals.keys()) - original_keys
+    return "<code ran, no output printed to stdout>", {key: _locals[key] for key in new_keys}
+
+
+def run(checkpointer: InMemorySaver, turns: int) -> None:
+    responses = [
+        AIMessage(content=f"```python\nv{i} = list(range({i}, {i} + 100))\n```")
+        for i in range(turns)
+    ]
+    responses.append(AIMessage(content="Done."))
+    model = GenericFakeChatModel(messages=iter(responses))
+    agent = create_codeact(model, [], eval_fn).compile(checkpointer=checkpointer)
+    agent.invoke(
+        {"messages": [{"role": "user", "content": "go"}]},
+        {"configurable": {"thread_id": "bench"}, "recursion_limit": 3 * turns + 10},
+    )
+
+
+def context_snapshots(checkpointer: InMemorySaver) -> list[tuple[str, bytes]]:
+    return [
+        value
+        for _, value in sorted(
+            (version, value)
+            for (_, _, channel, version), value in checkpointer.blobs.items()
+            if channel == "context"
+        )
+    ]
+
+
+def main(turns: int = 200) -> None:
+    checkpointer = InMemorySaver()
+    run(checkpointer, turns)
+    serde = checkpointer.serde
+    blob_checkpointer = InMemorySaver(
+        serde=ContextSerializer(blob_store=InMemoryCacheBackend(), dedupe_threshold=0)
+    )
+    run(blob_checkpointer, turns)
+
+    deltas = [
+        (checkpoint_id, value)
+        for (_, _, checkpoint_id), writes in checkpointer.writes.items()
+        for _, channel, value, _ in writes.values()
+        if channel == "context"
+    ]
+    rows = []
+    context: dict[str, Any] = {}
+    for (_, delta), snapshot, blob_snapshot in zip(
+        sorted(deltas),
+        context_snapshots(checkpointer),
+        context_snapshots(blob_checkpointer),
+        strict=True,
+    ):
+        context = merge_context(context, serde.loads_typed(delta))
+        full_copy = len(serde.dumps_typed(context)[1])
+        rows.append(
+            (len(context), len(delta[1]), full_copy, len(snapshot[1]), len(blob_snapshot[1]))
+        )
+
+    print(
+        f"{'variables':>10} {'delta':>10} {'full copy':>10} {'snapshot':>10} {'blob snapshot':>14}"
+    )
+    for i in sorted({0, len(rows) // 4, len(rows) // 2, 3 * len(rows) // 4, len(rows) - 1}):
+        print("{:>10} {:>10} {:>10} {:>10} {:>14}".format(*rows[i]))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,77 @@
+"""Compare checkpoint serialization of the context with `JsonPlusSerializer` and `ContextSerializer`.
+
+A context is grown over a number of sandbox steps, each adding one value of the given
+kind while the earlier values stay unchanged, and the whole context is serialized at
+every step, as when the context channel is checkpointed. For each kind of value the
+script reports the total bytes written and the time taken to serialize and to load
+every checkpoint with:
+
+- jsonplus: `JsonPlusSerializer`, with the pickle fallback for values msgpack can't encode
+- compact: `ContextSerializer`, with blobs and compression
+- dedupe: `ContextSerializer` with a blob store, so unchanged blobs are only hashed
+
+Run with: python benchmarks/context_serializer.py [steps]
+"""
+
+import array
+import os
+import sys
+import time
+from typing import Any, Callable
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from langgraph_codeact.cache import InMemoryCacheBackend
+from langgraph_codeact.serde import ContextSerializer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def make_values() -> dict[str, Callable[[int], Any]]:
+    values: dict[str, Callable[[int], Any]] = {
+        "random bytes": lambda i: os.urandom(256 * 1024),
+        "text bytes": lambda i: f"line {i} of a log file\n".encode() * 10_000,
+        "float array": lambda i: array.array("d", (i * 0.5 + j for j in range(50_000))),
+        "float list": lambda i: [i * 0.5 + j for j in range(50_000)],
+        "small values": lambda i: i,
+    }
+    if numpy is not None:
+        values["numpy array"] = lambda i: numpy.arange(50_000, dtype="float64") * i
+    return values
+
+
+def run(serde: Any, value: Callable[[int], Any], steps: int) -> tuple[int, float, float]:
+    context: dict[str, Any] = {}
+    checkpoints = []
+    start = time.perf_counter()
+    for i in range(steps):
+        context[f"v{i}"] = value(i)
+        checkpoints.append(serde.dumps_typed(context))
+    dumps = time.perf_counter() - start
+    start = time.perf_counter()
+    for checkpoint in checkpoints:
+        serde.loads_typed(checkpoint)
+    loads = time.perf_counter() - start
+    return sum(len(data) for _, data in checkpoints), dumps, loads
+
+
+def main(steps: int = 20) -> None:
+    serializers = {
+        "jsonplus": lambda: JsonPlusSerializer(pickle_fallback=True),
+        "compact": ContextSerializer,
+        "dedupe": lambda: ContextSerializer(blob_store=InMemoryCacheBackend()),
+    }
+    print(f"{'value':>14} {'serializer':>10} {'MB':>9} {'dumps':>9} {'loads':>9}")
+    for name, value in make_values().items():
+        for serializer, make_serde in serializers.items():
+            size, dumps, loads = run(make_serde(), value, steps)
+            print(
+                f"{name:>14} {serializer:>10} {size / 1024**2:>9.2f} {dumps:>8.3f}s {loads:>8.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
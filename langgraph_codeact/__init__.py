@@ -1,16 +1,105 @@
+import asyncio
+import functools
 import inspect
-from typing import Any, Awaitable, Callable, Optional, Sequence, Type, TypeVar, Union
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from typing import (
+    Annotated,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+)
 
 from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AnyMessage,
+    BaseMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    convert_to_messages,
+    message_chunk_to_message,
+)
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.tools import StructuredTool
 from langchain_core.tools import tool as create_tool
-from langgraph.graph import END, START, MessagesState, StateGraph
+from langgraph.config import get_stream_writer
+from langgraph.graph import END, START, MessagesState, StateGraph, add_messages
 from langgraph.types import Command
 
-from langgraph_codeact.utils import extract_and_combine_codeblocks
+from langgraph_codeact.analysis import get_referenced_names, plan_parallel_blocks
+from langgraph_codeact.batching import MicroBatcher
+from langgraph_codeact.cache import CachePolicy, ExecutionCache, ToolCache
+from langgraph_codeact.context import (
+    DELETE_VARIABLE,
+    SharedContext,
+    get_shared_context,
+    merge_context,
+)
+from langgraph_codeact.instrumentation import (
+    CodeActEvent,
+    EventHandler,
+    EventRecorder,
+    InstrumentedCheckpointer,
+    OpenTelemetryExporter,
+    context_size,
+)
+from langgraph_codeact.object_store import (
+    InMemoryObjectStore,
+    ObjectStore,
+    offload_values,
+    release_values,
+    resolve_values,
+)
+from langgraph_codeact.pool import SandboxPool
+from langgraph_codeact.serde import ContextSerializer
+from langgraph_codeact.session import InProcessSessionEvaluator, SessionEvaluator
+from langgraph_codeact.tool_index import ToolIndex
+from langgraph_codeact.utils import (
+    CodeBlockParser,
+    compile_code,
+    extract_and_combine_codeblocks,
+    extract_codeblocks,
+)
+
+__all__ = [
+    "CachePolicy",
+    "CodeActEvent",
+    "CodeActState",
+    "ContextSerializer",
+    "DELETE_VARIABLE",
+    "EvalCoroutine",
+    "EvalFunction",
+    "EvalStream",
+    "EventRecorder",
+    "ExecutionCache",
+    "InMemoryObjectStore",
+    "InProcessSessionEvaluator",
+    "InstrumentedCheckpointer",
+    "MicroBatcher",
+    "ObjectStore",
+    "OpenTelemetryExporter",
+    "SandboxPool",
+    "SessionEvaluator",
+    "ToolCache",
+    "create_codeact",
+    "create_default_prompt",
+    "summarize_messages",
+]
 
 EvalFunction = Callable[[str, dict[str, Any]], tuple[str, dict[str, Any]]]
 EvalCoroutine = Callable[[str, dict[str, Any]], Awaitable[tuple[str, dict[str, Any]]]]
+EvalStream = Callable[[str, dict[str, Any]], AsyncIterator[Union[str, dict[str, Any]]]]
 
 
 class CodeActState(MessagesState):
@@ -18,14 +107,256 @@ class CodeActState(MessagesState):
 
     script: Optional[str]
     """The Python code script to be executed."""
-    context: dict[str, Any]
-    """Dictionary containing the execution context with available tools and variables."""
+    context: Annotated[dict[str, Any], merge_context]
+    """Dictionary containing the execution context with available tools and variables.
+    Updates are merged into the existing context, so nodes only need to write the
+    variables that changed."""
+    iterations: int
+    """Number of scripts in the current run, including those with syntax errors, tracked
+    when budgets are set."""
+    consecutive_errors: int
+    """Number of scripts in a row that failed in the current run, tracked when budgets are
+    set."""
+    run_started_at: Optional[float]
+    """Unix time at which the current run started, tracked when `deadline` is set."""
 
 
 StateSchema = TypeVar("StateSchema", bound=CodeActState)
 StateSchemaType = Type[StateSchema]
 
 
+async def _collect_eval_stream(
+    eval_fn: EvalStream, code: str, context: dict[str, Any]
+) -> tuple[str, dict[str, Any]]:
+    """Run a streaming eval function, writing each output chunk to the graph's custom stream."""
+    write = get_stream_writer()
+    chunks: list[str] = []
+    new_vars: dict[str, Any] = {}
+    async for item in eval_fn(code, context):
+        if isinstance(item, dict):
+            new_vars = item
+        else:
+            chunks.append(item)
+            write({"sandbox_output": item})
+    return "".join(chunks) or "<code ran, no output printed to stdout>", new_vars
+
+
+_MAX_PENDING_TASKS = 1000
+"""Maximum number of streamed executions or speculative model calls kept for steps that
+haven't run yet. Beyond it, the oldest ones are cancelled."""
+
+
+def _store_task(tasks: dict[str, tuple], key: str, entry: tuple) -> None:
+    """Store an entry ending with a task, cancelling the one it replaces and the oldest ones."""
+    _discard_task(tasks, key)
+    tasks[key] = entry
+    while len(tasks) > _MAX_PENDING_TASKS:
+        tasks.pop(next(iter(tasks)))[-1].cancel()
+
+
+def _discard_task(tasks: dict[str, tuple], key: str) -> None:
+    entry = tasks.pop(key, None)
+    if entry is not None:
+        entry[-1].cancel()
+
+
+def _ignore_task_error(task: asyncio.Task) -> None:
+    """Mark the exception of a task as retrieved, so that asyncio doesn't log it."""
+    if not task.cancelled():
+        task.exception()
+
+
+_SPECULATION_TTL = 300.0
+"""Seconds a speculative model call is kept for a thread that doesn't resume, e.g. one
+interrupted before `call_model` and never continued."""
+
+
+def _speculation_config(config: RunnableConfig) -> RunnableConfig:
+    """Get the config of a model call started by the sandbox node for the next step."""
+    # Callbacks, and tokens streamed with stream_mode="messages", get the metadata of the
+    # call_model step that uses the response
+    metadata = dict(config.get("metadata") or {})
+    metadata["langgraph_node"] = "call_model"
+    metadata["langgraph_triggers"] = ("branch:to:call_model",)
+    if "langgraph_step" in metadata:
+        metadata["langgraph_step"] += 1
+    if "langgraph_path" in metadata:
+        metadata["langgraph_path"] = (*metadata["langgraph_path"][:-1], "call_model")
+    return {**config, "metadata": metadata}
+
+
+def _is_async_eval(eval_fn: Any) -> bool:
+    return inspect.iscoroutinefunction(eval_fn) or inspect.isasyncgenfunction(eval_fn)
+
+
+def _get_thread_id(config: RunnableConfig) -> Optional[str]:
+    thread_id = config.get("configurable", {}).get("thread_id")
+    return None if thread_id is None else str(thread_id)
+
+
+def _content_text(content: Union[str, list]) -> str:
+    """Get the text of message content given as a string or a list of content blocks."""
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in content
+        if isinstance(block, str) or block.get("type") == "text"
+    )
+
+
+def _get_tool_callable(tool: StructuredTool) -> Callable:
+    """Get the function generated code calls for a tool.
+
+    Tools that only have a coroutine are bridged: called from code running in an
+    event loop (scripts using top-level `await`) they return an awaitable, and
+    otherwise the coroutine is run to completion in a new event loop.
+    """
+    if tool.func is not None:
+        return tool.func
+    coroutine = tool.coroutine
+
+    @functools.wraps(coroutine)
+    def call_async_tool(*args: Any, **kwargs: Any) -> Any:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine(*args, **kwargs))
+        return coroutine(*args, **kwargs)
+
+    return call_async_tool
+
+
+def _render_tool(tool: StructuredTool) -> str:
+    func, keyword = (tool.coroutine, "async def") if tool.func is None else (tool.func, "def")
+    try:
+        return _render_function(tool.name, tool.description, func, keyword)
+    except TypeError:
+        # Unhashable callable, render it without caching
+        return _render_function.__wrapped__(tool.name, tool.description, func, keyword)
+
+
+@functools.lru_cache(maxsize=1024)
+def _render_function(name: str, description: str, func: Callable, keyword: str) -> str:
+    # inspect.signature is slow, so stubs are cached for prompts that are rendered repeatedly
+    return f'''
+{keyword} {name}{str(inspect.signature(func))}:
+    """{description}"""
+    ...
+'''
+
+
+def _add_cache_control(message: BaseMessage) -> BaseMessage:
+    """Mark the end of a message as a prompt cache breakpoint."""
+    content = message.content
+    if isinstance(content, str):
+        if not content:
+            return message
+        content = [{"type": "text", "text": content}]
+    if not content:
+        return message
+    last = content[-1]
+    last = {"type": "text", "text": last} if isinstance(last, str) else dict(last)
+    last["cache_control"] = {"type": "ephemeral"}
+    return message.model_copy(update={"content": [*content[:-1], last]})
+
+
+_SUMMARY_PREFIX = "Summary of earlier messages:\n"
+
+
+def _is_summary(message: BaseMessage) -> bool:
+    return isinstance(message.content, str) and message.content.startswith(_SUMMARY_PREFIX)
+
+
+def summarize_messages(messages: Sequence[BaseMessage]) -> str:
+    """Summarize messages for history compaction, with one shortened line per message."""
+    lines = []
+    for message in messages:
+        if _is_summary(message):
+            lines.append(message.content[len(_SUMMARY_PREFIX) :])
+            continue
+        role = "assistant" if isinstance(message, AIMessage) else "user"
+        text = " ".join(_content_text(message.content).split())
+        if len(text) > 200:
+            text = text[:200] + "..."
+        lines.append(f"- {role}: {text}")
+    return "\n".join(lines)
+
+
+def _truncate_output(output: str, max_chars: int) -> str:
+    """Keep the beginning and the end of an output that is longer than `max_chars`."""
+    if len(output) <= max_chars:
+        return output
+    head = max_chars // 2
+    tail = max_chars - head
+    return (
+        f"{output[:head]}\n... [{len(output) - max_chars} characters truncated] ...\n"
+        f"{output[-tail:] if tail else ''}"
+    )
+
+
+def _run_timed(func: Callable[..., Any], *args: Any) -> tuple[Any, float]:
+    """Call a function, returning its result and the `perf_counter` time it started at."""
+    started = time.perf_counter()
+    return func(*args), started
+
+
+def _token_usage(message: BaseMessage) -> dict[str, Any]:
+    """Get the token counts reported by the model for a response, if any."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    return {"input_tokens": usage.get("input_tokens"), "output_tokens": usage.get("output_tokens")}
+
+
+_SYNTAX_ERROR_PREFIX = "The code was not run, it has a syntax error"
+_ERROR_PREFIXES = (
+    "Error during execution",
+    _SYNTAX_ERROR_PREFIX,
+    "Traceback (most recent call last)",
+)
+
+
+def _is_error_output(output: str) -> bool:
+    """Check whether a sandbox output reports that a script failed."""
+    # The outputs of several blocks are joined by lines, so any line can report the error
+    return any(line.startswith(_ERROR_PREFIXES) for line in output.splitlines())
+
+
+# Ids of the user messages written by the graph, i.e. script outputs and syntax errors
+_OUTPUT_ID_PREFIX = "codeact-output-"
+
+
+def _output_message(content: str) -> dict[str, Any]:
+    """Create the message sending the output of a script (or its syntax error) to the model."""
+    return {"role": "user", "content": content, "id": f"{_OUTPUT_ID_PREFIX}{uuid.uuid4()}"}
+
+
+def _latest_request(messages: Sequence[BaseMessage]) -> Optional[BaseMessage]:
+    """Get the latest user message that isn't the output of a script."""
+    for message in reversed(messages):
+        if not isinstance(message, HumanMessage) or _is_summary(message):
+            continue
+        if (message.id or "").startswith(_OUTPUT_ID_PREFIX):
+            continue
+        return message
+    return None
+
+
+def _starts_run(messages: Sequence[BaseMessage]) -> bool:
+    """Check whether the last message is a new request from the user, starting a run."""
+    return bool(messages) and _latest_request(messages) is messages[-1]
+
+
+def _check_syntax(code: str) -> Optional[str]:
+    """Compile a script, returning a description of its syntax error if it has one."""
+    try:
+        # Cached, so the sandbox reuses the compiled code if it calls compile_code too
+        compile_code(code)
+    except (SyntaxError, ValueError) as e:
+        error = "".join(traceback.format_exception_only(type(e), e)).rstrip()
+        return f"{_SYNTAX_ERROR_PREFIX}:\n{error}"
+    return None
+
+
 def create_default_prompt(tools: list[StructuredTool], base_prompt: Optional[str] = None):
     """Create default prompt for the CodeAct agent."""
     tools = [t if isinstance(t, StructuredTool) else create_tool(t) for t in tools]
@@ -38,11 +369,11 @@ In addition to the Python Standard Library, you can use the following functions:
 """
 
     for tool in tools:
-        prompt += f'''
-def {tool.name}{str(inspect.signature(tool.func))}:
-    """{tool.description}"""
-    ...
-'''
+        prompt += _render_tool(tool)
+
+    if any(tool.func is None for tool in tools):
+        prompt += """
+Functions defined with `async def` must be awaited, top-level `await` is allowed. To call several of them concurrently, use `asyncio.gather`."""
 
     prompt += """
 
@@ -53,76 +384,869 @@ Reminder: use Python code snippets to call tools"""
 
 
 def create_codeact(
-    model: BaseChatModel,
+    model: Union[BaseChatModel, MicroBatcher],
     tools: Sequence[Union[StructuredTool, Callable]],
-    eval_fn: Union[EvalFunction, EvalCoroutine],
+    eval_fn: Union[EvalFunction, EvalCoroutine, EvalStream, SessionEvaluator],
     *,
     prompt: Optional[str] = None,
     state_schema: StateSchemaType = CodeActState,
+    stream_code: bool = False,
+    object_store: Optional[ObjectStore] = None,
+    parallel_blocks: bool = False,
+    tool_cache: Optional[ToolCache] = None,
+    prompt_caching: bool = False,
+    tool_retrieval_k: Optional[int] = None,
+    max_output_chars: Optional[int] = None,
+    history_window: Optional[int] = None,
+    compact_history: bool = False,
+    summarize_history: Callable[[Sequence[BaseMessage]], str] = summarize_messages,
+    check_syntax: bool = True,
+    on_event: Optional[EventHandler] = None,
+    prune_context: bool = False,
+    speculative: bool = False,
+    max_iterations: Optional[int] = None,
+    max_consecutive_errors: Optional[int] = None,
+    deadline: Optional[float] = None,
+    compact_error_repair: bool = False,
+    is_error: Callable[[str], bool] = _is_error_output,
+    shared_context: Optional[SharedContext] = None,
+    execution_cache: Optional[ExecutionCache] = None,
 ) -> StateGraph:
     """Create a CodeAct agent.
 
     Args:
         model: The language model to use for generating code
         tools: List of tools available to the agent. Can be passed as python functions or StructuredTool instances.
+            Async tools (coroutine functions, or StructuredTools with only a `coroutine`) are
+            awaitable from scripts using top-level `await` when `eval_fn` supports it (e.g.
+            `InProcessSessionEvaluator`, or `arun_code` from `langgraph_codeact.utils`), and
+            run to completion when called without `await` outside an event loop.
         eval_fn: Function or coroutine that executes code in a sandbox. Takes code string and locals dict,
-            returns a tuple of (stdout output, new variables dict)
+            returns a tuple of (stdout output, new variables dict). The new variables dict should
+            contain the variables created or changed by the code, and may map a name to
+            `DELETE_VARIABLE` to remove it from the context.
+            Can also be an async generator function (`EvalStream`) that yields the output as
+            string chunks while the code runs, and may yield the new variables dict last. Each
+            chunk is written to the graph's custom stream as `{"sandbox_output": chunk}`
+            (`stream_mode="custom"`), and the chunks are joined into the output message. Like a
+            coroutine, it requires running the graph asynchronously. Cancelling the run closes
+            the generator, which can stop the execution.
+            Can also be a `SessionEvaluator`, which keeps a namespace per thread between turns
+            so that only the new script is sent to it. Sessions are opened with the current
+            context on the first sandbox step of a run, and closed when the run ends or a
+            script raises. A session stays open while its run is interrupted. If the run is
+            never resumed, or is aborted (e.g. by the recursion limit), the session is closed
+            when the thread's next run starts, and a `SandboxPool` reclaims its worker once
+            it has been idle for `idle_timeout` seconds while other sessions are waiting.
         prompt: Optional custom system prompt. If None, uses default prompt.
             To customize default prompt you can use `create_default_prompt` helper:
             `create_default_prompt(tools, "You are a helpful assistant.")`
         state_schema: The state schema to use for the agent.
+        stream_code: If True, the model response is streamed and each code block is sent to
+            `eval_fn` as soon as its closing fence arrives, while the model is still generating.
+            Blocks run one after another, each with the variables created by the previous ones,
+            and their outputs are joined with newlines. Only applies when the graph is run
+            asynchronously (ainvoke/astream), otherwise the full response is awaited as usual.
+            Scripts then run inside the `call_model` step, before it is checkpointed, so they
+            can't be reviewed with `interrupt_before=["sandbox"]`: don't use `stream_code`
+            when scripts need approval. If the script in the state is changed before the
+            sandbox step (e.g. with `update_state`), the new script is run again.
+        object_store: Optional store for variables created by the sandbox, e.g. an
+            `InMemoryObjectStore`. Values other than small scalars and strings are kept in the
+            store and the state only holds references to them, so large or non-serializable
+            objects don't go through the checkpointer. Values are fetched from the store when
+            a script that uses them runs, and deleted from it when a script overwrites or deletes their
+            variable.
+        parallel_blocks: If True, the code blocks of a response are run as separate scripts
+            instead of being combined, and blocks that don't share any variables are run
+            concurrently (in threads for a sync `eval_fn`), with their outputs joined in order.
+            `eval_fn` must be safe to call concurrently. Blocks that use the same variable run
+            in order. Has no effect with a `SessionEvaluator` or with `stream_code`.
+        tool_cache: Optional `ToolCache` that memoizes the results of tool calls made by
+            generated code, per tool, across turns and threads.
+        prompt_caching: If True, the system prompt and the newest message are marked as
+            prompt cache breakpoints (`cache_control` content blocks, as used by Anthropic
+            models), so that each turn reuses the cached prefix of the previous one.
+        tool_retrieval_k: If set, the default prompt only describes the `k` tools most relevant
+            to the task and the latest script and output, selected with a local BM25 index
+            over tool names and descriptions. All tools remain callable from generated code.
+            Can't be combined with a custom `prompt`.
+        max_output_chars: If set, sandbox outputs longer than this are truncated to their
+            beginning and end before being added to the messages.
+        history_window: If set, only the most recent `history_window` messages are sent to the
+            model on each turn. The full history is kept in the state unless `compact_history`
+            is set.
+        compact_history: If True (requires `history_window`), once the history reaches twice
+            `history_window` messages, the messages before the window are removed from the
+            state and replaced with a summary message, which is sent to the model ahead of
+            the window.
+        summarize_history: Function that summarizes the messages being compacted. The default
+            lists each message shortened to a line, keeping previous summaries whole.
+        check_syntax: If True, scripts are compiled before they are sent to the sandbox, and a
+            script with a syntax error is returned to the model with the error, without running
+            it. The compiled code is cached, an `eval_fn` can get it with
+            `langgraph_codeact.utils.compile_code`. Disable this if the sandbox supports syntax
+            that the Python version running the graph doesn't.
+        on_event: Function called with a `CodeActEvent` for each model call, code extraction,
+            sandbox execution and sandbox step, with their latency and sizes. Use
+            `EventRecorder` to keep them, `OpenTelemetryExporter` to export them as spans,
+            and `InstrumentedCheckpointer` to also record the size of checkpoint writes.
+        prune_context: If True, only the variables and tools a script references are passed
+            to `eval_fn`, which saves serializing the rest for a remote sandbox. A script that
+            accesses its namespace dynamically, e.g. with `globals()` or `eval`, gets the whole
+            context. Has no effect with a `SessionEvaluator`, which gets the whole context
+            when its session is opened.
+        speculative: If True, when the graph is run asynchronously, the next model call is
+            started as soon as the sandbox returns, while its result is being checkpointed,
+            and the session of a `SessionEvaluator` is opened while the model is generating.
+            The speculative response is discarded if the state changes in between (e.g. with
+            `update_state`), and dropped if the thread isn't resumed within 5 minutes (e.g.
+            after an interrupt). Has no effect with `stream_code`.
+        max_iterations: If set, a run executes at most this many scripts, counting the
+            scripts with syntax errors that are sent back to the model. If the model
+            responds with code after that, the code isn't run and the run ends.
+        max_consecutive_errors: If set, the run ends without calling the model again once
+            this many scripts in a row have failed (including scripts with syntax errors).
+        deadline: If set, the run ends without calling the model again once it has been
+            running for this many seconds.
+        compact_error_repair: If True, after a script fails, the model is only sent the
+            latest user request, the failing script and its error, instead of the whole
+            history, to fix the script.
+        is_error: Function that checks whether a sandbox output reports a failed script. The
+            default looks for the `Error during execution` prefix used by the built-in
+            sandboxes, or a traceback.
+
+            When a budget is exhausted, the run ends with an AI message saying why. The
+            budget counters are stored in the state, and reset when a run ends or starts.
+        shared_context: Variables available to every script of every thread, e.g. large
+            reference data, given as a dict or as a function building it, which is called once
+            per process. They are not stored in the state. A script that assigns one of these
+            names writes the new value to its thread's context, which takes precedence, but
+            the shared values themselves must not be modified in place.
+        execution_cache: Optional `ExecutionCache` that reuses the output and new variables of
+            a script that already ran with the same referenced values and tools, in any
+            thread, instead of running it again. Only deterministic scripts should be cached,
+            see `ExecutionCache`. Has no effect with a `SessionEvaluator`.
 
     Returns:
         A StateGraph implementing the CodeAct architecture
     """
+    if compact_history and history_window is None:
+        raise ValueError("compact_history requires history_window")
+    track_budget = (
+        max_iterations is not None
+        or max_consecutive_errors is not None
+        or deadline is not None
+        or compact_error_repair
+    )
+
     tools = [t if isinstance(t, StructuredTool) else create_tool(t) for t in tools]
 
-    if prompt is None:
-        prompt = create_default_prompt(tools)
+    def make_system_message(prompt: str) -> SystemMessage:
+        if prompt_caching:
+            return SystemMessage(
+                content=[{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+            )
+        return SystemMessage(content=prompt)
+
+    if tool_retrieval_k is not None:
+        if prompt is not None:
+            raise ValueError("tool_retrieval_k can only be used with the default prompt")
+        tool_index = ToolIndex(tools)
+
+        # The prompt is rendered once per selection of tools
+        @functools.lru_cache(maxsize=128)
+        def get_system_message(tool_names: tuple[str, ...]) -> SystemMessage:
+            selected = [tool for tool in tools if tool.name in tool_names]
+            return make_system_message(create_default_prompt(selected))
+    else:
+        if prompt is None:
+            prompt = create_default_prompt(tools)
+        # Rendered once per graph, and reused on every turn
+        system_message = make_system_message(prompt)
 
     # Make tools available to the code sandbox
-    tools_context = {tool.name: tool.func for tool in tools}
+    tools_context = {tool.name: _get_tool_callable(tool) for tool in tools}
+    if tool_cache is not None:
+        tools_context = {name: tool_cache.wrap(name, func) for name, func in tools_context.items()}
+
+    # Executions started while the model was still streaming, keyed by thread (or by the
+    # AI message they were extracted from without a thread), with that message's id and
+    # the script
+    pending_executions: dict[str, tuple[str, str, asyncio.Task]] = {}
+    # Speculative model calls, keyed by thread (or by the last message without a thread),
+    # with the model input they were started with
+    speculations: dict[str, tuple[list[BaseMessage], asyncio.Task]] = {}
+    # Sessions being opened while the model is generating, keyed by session id
+    warming_sessions: dict[str, asyncio.Task] = {}
+
+    def get_sandbox_context(
+        state: StateSchema, new_vars: Optional[dict[str, Any]] = None, code: Optional[str] = None
+    ) -> dict[str, Any]:
+        context = merge_context(state.get("context", {}), new_vars)
+        shared = get_shared_context(shared_context) if shared_context is not None else {}
+        tools = tools_context
+        names = get_referenced_names(code) if prune_context and code is not None else None
+        if names is not None:
+            # Pruned before resolving, so unused values aren't loaded from the object store
+            context = {key: value for key, value in context.items() if key in names}
+            shared = {key: value for key, value in shared.items() if key in names}
+            tools = {name: tool for name, tool in tools_context.items() if name in names}
+        if object_store is not None:
+            if names is None and code is not None:
+                names = get_referenced_names(code)
+            # Only the values the script uses are fetched from the store
+            context = resolve_values(object_store, context, names)
+        # The thread's own variables are an overlay on the shared ones
+        return {**shared, **context, **tools}
+
+    def get_execution_key(
+        code: str, state: StateSchema, new_vars: Optional[dict[str, Any]] = None
+    ) -> Optional[str]:
+        """Get the execution cache key of a script, or None if it isn't cached."""
+        if execution_cache is None or isinstance(eval_fn, SessionEvaluator):
+            return None
+        names = get_referenced_names(code)
+        if names is None:
+            return None
+        context = merge_context(state.get("context", {}), new_vars)
+        shared = get_shared_context(shared_context) if shared_context is not None else {}
+        values = {
+            name: context[name] if name in context else shared[name]
+            for name in names
+            if name not in tools_context and (name in context or name in shared)
+        }
+        if object_store is not None:
+            # Keyed by the stored values, as references differ between threads
+            values = resolve_values(object_store, values)
+        tools = {name: tools_context[name] for name in names if name in tools_context}
+        return execution_cache.key(code, values, tools)
+
+    def emit(
+        name: str,
+        config: RunnableConfig,
+        started: float,
+        duration: Optional[float] = None,
+        **attributes: Any,
+    ) -> None:
+        """Record an event for an operation that started at the `perf_counter` time `started`."""
+        if duration is None:
+            duration = time.perf_counter() - started
+        on_event(
+            CodeActEvent(
+                name=name,
+                start_time=time.time() - duration,
+                duration=duration,
+                thread_id=_get_thread_id(config),
+                step=config.get("metadata", {}).get("langgraph_step"),
+                attributes=attributes,
+            )
+        )
+
+    def execute(
+        code: str,
+        state: StateSchema,
+        config: RunnableConfig,
+        new_vars: Optional[dict[str, Any]] = None,
+        queued: Optional[float] = None,
+    ) -> tuple[str, dict[str, Any]]:
+        started = time.perf_counter()
+        key = get_execution_key(code, state, new_vars)
+        cached = execution_cache.get(key) if key is not None else None
+        if cached is not None:
+            output, new_vars = cached
+        else:
+            output, new_vars = run_eval(code, state, config, new_vars)
+            if key is not None and not is_error(output):
+                execution_cache.set(key, output, new_vars)
+        if on_event is not None:
+            emit(
+                "sandbox",
+                config,
+                started,
+                queue_seconds=started - (queued or started),
+                output_chars=len(output),
+                **({"cached": cached is not None} if execution_cache is not None else {}),
+            )
+        return output, new_vars
+
+    def run_eval(
+        code: str,
+        state: StateSchema,
+        config: RunnableConfig,
+        new_vars: Optional[dict[str, Any]] = None,
+    ) -> tuple[str, dict[str, Any]]:
+        if not isinstance(eval_fn, SessionEvaluator):
+            return eval_fn(code, get_sandbox_context(state, new_vars, code))
+        session_id = _get_thread_id(config)
+        if session_id is None:
+            # Without a thread there is nothing to keep the session for
+            session_id = str(uuid.uuid4())
+            eval_fn.open(session_id, get_sandbox_context(state, new_vars))
+            try:
+                return eval_fn.execute(session_id, code)
+            finally:
+                eval_fn.close(session_id)
+        if not eval_fn.is_open(session_id):
+            eval_fn.open(session_id, get_sandbox_context(state, new_vars))
+        try:
+            return eval_fn.execute(session_id, code)
+        except BaseException:
+            # The run fails, so it won't reach the end where its session is closed
+            eval_fn.close(session_id)
+            raise
+
+    async def aexecute(
+        code: str,
+        state: StateSchema,
+        config: RunnableConfig,
+        new_vars: Optional[dict[str, Any]] = None,
+        queued: Optional[float] = None,
+    ) -> tuple[str, dict[str, Any]]:
+        if queued is None:
+            queued = time.perf_counter()
+        key = get_execution_key(code, state, new_vars)
+        cached = execution_cache.get(key) if key is not None else None
+        if cached is not None:
+            started = time.perf_counter()
+            output, new_vars = cached
+            if inspect.isasyncgenfunction(eval_fn):
+                get_stream_writer()({"sandbox_output": output})
+        elif _is_async_eval(eval_fn) or isinstance(eval_fn, SessionEvaluator):
+            started = time.perf_counter()
+            output, new_vars = await arun_eval(code, state, config, new_vars)
+        else:
+            (output, new_vars), started = await asyncio.get_running_loop().run_in_executor(
+                None, _run_timed, eval_fn, code, get_sandbox_context(state, new_vars, code)
+            )
+        if cached is None and key is not None and not is_error(output):
+            execution_cache.set(key, output, new_vars)
+        if on_event is not None:
+            emit(
+                "sandbox",
+                config,
+                started,
+                queue_seconds=started - queued,
+                output_chars=len(output),
+                **({"cached": cached is not None} if execution_cache is not None else {}),
+            )
+        return output, new_vars
+
+    async def arun_eval(
+        code: str,
+        state: StateSchema,
+        config: RunnableConfig,
+        new_vars: Optional[dict[str, Any]] = None,
+    ) -> tuple[str, dict[str, Any]]:
+        if inspect.iscoroutinefunction(eval_fn):
+            return await eval_fn(code, get_sandbox_context(state, new_vars, code))
+        if inspect.isasyncgenfunction(eval_fn):
+            context = get_sandbox_context(state, new_vars, code)
+            return await _collect_eval_stream(eval_fn, code, context)
+        session_id = _get_thread_id(config)
+        if session_id is None:
+            # Without a thread there is nothing to keep the session for
+            session_id = str(uuid.uuid4())
+            await eval_fn.aopen(session_id, get_sandbox_context(state, new_vars))
+            try:
+                return await eval_fn.aexecute(session_id, code)
+            finally:
+                await eval_fn.aclose(session_id)
+        warming = warming_sessions.pop(session_id, None)
+        if warming is not None:
+            # If the speculative open failed, the session is opened again below, which
+            # reports the error
+            await asyncio.wait({warming})
+        if not eval_fn.is_open(session_id):
+            await eval_fn.aopen(session_id, get_sandbox_context(state, new_vars))
+        try:
+            return await eval_fn.aexecute(session_id, code)
+        except BaseException:
+            # The run fails, so it won't reach the end where its session is closed
+            await asyncio.shield(eval_fn.aclose(session_id))
+            raise
+
+    def get_model_input(state: StateSchema) -> tuple[list[BaseMessage], list[AnyMessage]]:
+        """Get the messages to send to the model, and the updates compacting the history."""
+        messages = history = convert_to_messages(state["messages"])
+        history_updates: list[AnyMessage] = []
+        request = (
+            _latest_request(messages)
+            if compact_error_repair and state.get("consecutive_errors") and state.get("script")
+            else None
+        )
+        if request is not None:
+            # Only the request, the failing script and its error are needed to fix it
+            script = AIMessage(content=f"```python\n{state['script']}\n```")
+            messages = [request, script, messages[-1]]
+        elif history_window is not None and len(messages) > history_window:
+            start = len(messages) - history_window
+            # The window has to start with a user message
+            while start < len(messages) - 1 and isinstance(messages[start], AIMessage):
+                start += 1
+            # Compaction waits until the history is twice the window, so that the summary,
+            # and the prompt cache, don't change on every turn
+            has_summary = compact_history and _is_summary(messages[0])
+            if compact_history and len(messages) - has_summary >= 2 * history_window:
+                summary = HumanMessage(
+                    content=_SUMMARY_PREFIX + summarize_history(messages[:start]),
+                    id=messages[0].id,
+                )
+                history_updates = [summary, *(RemoveMessage(id=m.id) for m in messages[1:start])]
+                messages = [summary, *messages[start:]]
+            elif has_summary:
+                # Keep sending the summary of the compacted messages
+                messages = [messages[0], *messages[start:]]
+            else:
+                messages = messages[start:]
+        if prompt_caching and messages:
+            # The breakpoint moves to the newest message on every turn, so the next turn
+            # reads everything up to here from the cache
+            messages[-1] = _add_cache_control(messages[-1])
+        if tool_retrieval_k is None:
+            return [system_message, *messages], history_updates
+        # Select the tools relevant to the task, and to the most recent code and output.
+        # The task can be many messages back once the model has run a few scripts.
+        task = _latest_request(history)
+        recent = [m for m in history[-2:] if m is not task]
+        query_messages = [task, *recent] if task is not None else recent
+        query = " ".join(_content_text(m.content) for m in query_messages)
+        selected = tool_index.search(query, tool_retrieval_k)
+        system = get_system_message(tuple(tool.name for tool in selected))
+        return [system, *messages], history_updates
 
-    def call_model(state: StateSchema) -> Command:
-        messages = [{"role": "system", "content": prompt}] + state["messages"]
-        response = model.invoke(messages)
-        # Extract and combine all code blocks
-        code = extract_and_combine_codeblocks(response.content)
+    def route_response(
+        response: BaseMessage, history_updates: list[AnyMessage], code: Optional[str] = None
+    ) -> Command:
+        if code is None:
+            # Extract and combine all code blocks. Blocks streamed with stream_code are
+            # checked one by one as they are dispatched instead.
+            code = extract_and_combine_codeblocks(response.content)
+            error = _check_syntax(code) if code and check_syntax else None
+            if error is not None:
+                # Ask the model to fix the script, without a round trip to the sandbox
+                return Command(
+                    goto="call_model",
+                    update={
+                        "messages": [
+                            *history_updates,
+                            response,
+                            _output_message(error),
+                        ],
+                        "script": code,
+                    },
+                )
         if code:
-            return Command(goto="sandbox", update={"messages": [response], "script": code})
+            return Command(
+                goto="sandbox", update={"messages": [*history_updates, response], "script": code}
+            )
         else:
             # no code block, end the loop and respond to the user
-            return Command(update={"messages": [response], "script": None})
+            return Command(update={"messages": [*history_updates, response], "script": None})
 
-    # If eval_fn is a async, we define async node function.
-    if inspect.iscoroutinefunction(eval_fn):
+    def stop_run(reason: str, messages: Sequence[Any] = ()) -> Command:
+        """End the run with a message saying why, resetting the budget counters."""
+        notice = AIMessage(content=f"Stopped before finishing the task: {reason}.")
+        update = {"messages": [*messages, notice], "script": None}
+        return Command(update={**update, **reset_budget()})
 
-        async def sandbox(state: StateSchema):
-            existing_context = state.get("context", {})
-            context = {**existing_context, **tools_context}
-            # Execute the script in the sandbox
-            output, new_vars = await eval_fn(state["script"], context)
-            new_context = {**existing_context, **new_vars}
-            return {
-                "messages": [{"role": "user", "content": output}],
-                "context": new_context,
+    def reset_budget() -> dict[str, Any]:
+        if not track_budget:
+            return {}
+        return {"iterations": 0, "consecutive_errors": 0, "run_started_at": None}
+
+    def start_budget(state: StateSchema) -> StateSchema:
+        """Reset the budget counters at the start of a run.
+
+        They are also reset when a run ends, but not if it was aborted, e.g. by the
+        recursion limit or an interrupt that was never resumed.
+        """
+        return {**state, **reset_budget()}  # type: ignore[return-value]
+
+    def check_budget(state: StateSchema) -> Optional[Command]:
+        """Get the command ending the run if a budget is exhausted before calling the model."""
+        errors = state.get("consecutive_errors") or 0
+        if max_consecutive_errors is not None and errors >= max_consecutive_errors:
+            return stop_run(f"{errors} scripts in a row failed")
+        started_at = state.get("run_started_at")
+        if deadline is not None and started_at is not None and time.time() - started_at > deadline:
+            return stop_run(f"the run exceeded its deadline of {deadline} seconds")
+        return None
+
+    def apply_budget(state: StateSchema, command: Command) -> Command:
+        """Update the budget counters for the command routing a model response."""
+        if not track_budget:
+            return command
+        if not command.goto:
+            return Command(update={**command.update, **reset_budget()})
+        iterations = state.get("iterations") or 0
+        # Scripts with syntax errors are sent back to the model without running them,
+        # but they count as iterations too, or a model that keeps writing them never stops
+        if max_iterations is not None and iterations >= max_iterations:
+            return stop_run(
+                f"the run reached its limit of {max_iterations} iterations",
+                command.update["messages"],
+            )
+        update = dict(command.update)
+        if _starts_run(state["messages"]):
+            # Overwrites the counters that start_budget reset in the state
+            update.update(reset_budget())
+        if command.goto == "call_model":
+            # The script had a syntax error
+            update["iterations"] = iterations + 1
+            update["consecutive_errors"] = (state.get("consecutive_errors") or 0) + 1
+        if deadline is not None and state.get("run_started_at") is None:
+            update["run_started_at"] = time.time()
+        return Command(goto=command.goto, update=update)
+
+    def close_session(session_id: Optional[str]) -> None:
+        if session_id is not None and eval_fn.is_open(session_id):
+            eval_fn.close(session_id)
+
+    async def aclose_session(session_id: Optional[str]) -> None:
+        warming = warming_sessions.pop(session_id, None)
+        if warming is not None:
+            # The run doesn't need the session, so the speculative open isn't waited for.
+            # A session it opens after all is closed when the thread's next run starts.
+            warming.cancel()
+        if session_id is not None and eval_fn.is_open(session_id):
+            await eval_fn.aclose(session_id)
+
+    def call_model(state: StateSchema, config: RunnableConfig) -> Command:
+        if isinstance(eval_fn, SessionEvaluator) and _starts_run(state["messages"]):
+            # Left open by a previous run that failed or was never resumed, it's reopened
+            # from the state
+            close_session(_get_thread_id(config))
+        if track_budget and _starts_run(state["messages"]):
+            state = start_budget(state)
+        command = check_budget(state) if track_budget else None
+        if command is None:
+            messages, history_updates = get_model_input(state)
+            started = time.perf_counter()
+            response = model.invoke(messages)
+            if on_event is not None:
+                emit("model", config, started, **_token_usage(response))
+            started = time.perf_counter()
+            command = apply_budget(state, route_response(response, history_updates))
+            if on_event is not None:
+                emit("extraction", config, started, code_chars=len(command.update["script"] or ""))
+        if not command.goto and isinstance(eval_fn, SessionEvaluator):
+            # The run is over, the next one reopens the session from the state
+            close_session(_get_thread_id(config))
+        return command
+
+    # Used when the graph is run with ainvoke/astream, so that model calls
+    # don't hold an executor thread while waiting on the provider.
+    async def acall_model(state: StateSchema, config: RunnableConfig) -> Command:
+        session_id = _get_thread_id(config)
+        if isinstance(eval_fn, SessionEvaluator) and _starts_run(state["messages"]):
+            # Left open by a previous run that failed or was never resumed, it's reopened
+            # from the state
+            await aclose_session(session_id)
+        if track_budget and _starts_run(state["messages"]):
+            state = start_budget(state)
+        if (
+            speculative
+            and isinstance(eval_fn, SessionEvaluator)
+            and session_id is not None
+            and session_id not in warming_sessions
+            and not eval_fn.is_open(session_id)
+        ):
+            # Open the session for the next script while the model is generating it
+            warming = asyncio.create_task(eval_fn.aopen(session_id, get_sandbox_context(state)))
+            # Its errors are only reported if the session is needed, by opening it again
+            warming.add_done_callback(_ignore_task_error)
+            warming_sessions[session_id] = warming
+        if session_id is not None:
+            # Left over from a step that never reached the sandbox, e.g. an aborted run
+            _discard_task(pending_executions, session_id)
+        command = check_budget(state) if track_budget else None
+        if command is None:
+            command = await agenerate(state, config)
+        if not command.goto and isinstance(eval_fn, SessionEvaluator):
+            # The run is over, the next one reopens the session from the state
+            await aclose_session(session_id)
+        return command
+
+    def speculate(state: StateSchema, config: RunnableConfig, update: dict[str, Any]) -> None:
+        """Start the model call that follows a sandbox step, before the step is checkpointed."""
+        next_state = {
+            **state,
+            **update,
+            "messages": add_messages(state["messages"], update["messages"]),
+        }
+        if track_budget and check_budget(next_state) is not None:
+            return
+        messages, _ = get_model_input(next_state)
+        key = _get_thread_id(config) or next_state["messages"][-1].id
+        task = asyncio.create_task(model.ainvoke(messages, _speculation_config(config)))
+        _store_task(speculations, key, (messages, task))
+        asyncio.get_running_loop().call_later(_SPECULATION_TTL, expire_speculation, key, task)
+
+    def expire_speculation(key: str, task: asyncio.Task) -> None:
+        entry = speculations.get(key)
+        if entry is not None and entry[-1] is task:
+            _discard_task(speculations, key)
+
+    def take_speculation(
+        state: StateSchema, config: RunnableConfig, messages: list[BaseMessage]
+    ) -> Optional[asyncio.Task]:
+        """Get the speculative model call for this model input, if there is one."""
+        key = _get_thread_id(config) or state["messages"][-1].id
+        speculation = speculations.pop(key, None)
+        if speculation is None:
+            return None
+        predicted, task = speculation
+        if predicted != messages:
+            # The state has changed since the sandbox step
+            task.cancel()
+            return None
+        if task.get_loop() is not asyncio.get_running_loop() or task.cancelled():
+            # Started by a run on another event loop, e.g. of an earlier asyncio.run
+            return None
+        return task
+
+    async def agenerate(state: StateSchema, config: RunnableConfig) -> Command:
+        messages, history_updates = get_model_input(state)
+        # Code isn't streamed to the sandbox if it can't be run within the budget
+        out_of_iterations = max_iterations is not None and (
+            (state.get("iterations") or 0) >= max_iterations
+        )
+        if not stream_code or out_of_iterations:
+            started = time.perf_counter()
+            speculation = take_speculation(state, config, messages) if speculative else None
+            if speculation is not None:
+                response = await speculation
+            else:
+                response = await model.ainvoke(messages)
+            if on_event is not None:
+                attributes = {"speculative": speculation is not None} if speculative else {}
+                emit("model", config, started, **attributes, **_token_usage(response))
+            started = time.perf_counter()
+            command = apply_budget(state, route_response(response, history_updates))
+            if on_event is not None:
+                emit("extraction", config, started, code_chars=len(command.update["script"] or ""))
+            return command
+
+        parser = CodeBlockParser()
+        blocks: list[str] = []
+        execution: Optional[asyncio.Task] = None
+
+        async def execute_block(
+            previous: Optional[asyncio.Task], block: str
+        ) -> tuple[list[str], dict[str, Any]]:
+            queued = time.perf_counter()
+            outputs, new_vars = await previous if previous else ([], {})
+            if outputs and is_error(outputs[-1]):
+                # The script stops at the first failing block, as when it's run as a whole
+                return outputs, new_vars
+            output, block_vars = await aexecute(block, state, config, new_vars, queued)
+            return [*outputs, output], {**new_vars, **block_vars}
+
+        async def skip_block(
+            previous: Optional[asyncio.Task], error: str
+        ) -> tuple[list[str], dict[str, Any]]:
+            outputs, new_vars = await previous if previous else ([], {})
+            return [*outputs, error], new_vars
+
+        syntax_error: Optional[str] = None
+
+        def dispatch(completed: list[str]) -> None:
+            nonlocal execution, syntax_error
+            for block in completed:
+                blocks.append(block)
+                if syntax_error is not None:
+                    # The blocks after one with a syntax error are not run
+                    continue
+                syntax_error = _check_syntax(block) if check_syntax else None
+                if syntax_error is not None:
+                    execution = asyncio.create_task(skip_block(execution, syntax_error))
+                    continue
+                # Blocks run one after another, each seeing the variables of the previous ones
+                execution = asyncio.create_task(execute_block(execution, block))
+
+        response_chunk = None
+        started = time.perf_counter()
+        time_to_first_token = None
+        # Extraction is interleaved with the stream, so its time is added up per chunk
+        extraction_seconds = 0.0
+        try:
+            async for chunk in model.astream(messages):
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started
+                response_chunk = chunk if response_chunk is None else response_chunk + chunk
+                extraction_started = time.perf_counter()
+                dispatch(parser.feed(_content_text(chunk.content)))
+                extraction_seconds += time.perf_counter() - extraction_started
+            extraction_started = time.perf_counter()
+            dispatch(parser.finish())
+            extraction_seconds += time.perf_counter() - extraction_started
+        except BaseException:
+            if execution is not None:
+                execution.cancel()
+            raise
+        response = message_chunk_to_message(response_chunk)
+        if on_event is not None:
+            emit(
+                "model",
+                config,
+                started,
+                time_to_first_token=time_to_first_token,
+                **_token_usage(response),
+            )
+            emit(
+                "extraction",
+                config,
+                extraction_started,
+                extraction_seconds,
+                code_chars=sum(len(block) for block in blocks),
+            )
+        script = "\n\n".join(blocks)
+        if blocks and response.id is None:
+            response.id = str(uuid.uuid4())
+        command = apply_budget(state, route_response(response, history_updates, script))
+        if execution is not None:
+            if command.goto == "sandbox":
+                key = _get_thread_id(config) or response.id
+                _store_task(pending_executions, key, (response.id, script, execution))
+            else:
+                execution.cancel()
+        return command
+
+    def sandbox_update(
+        output: str,
+        new_vars: dict[str, Any],
+        state: StateSchema,
+        config: RunnableConfig,
+        started: float,
+    ) -> dict[str, Any]:
+        if on_event is not None:
+            context = merge_context(state.get("context", {}), new_vars)
+            emit(
+                "sandbox_step",
+                config,
+                started,
+                variables=len(context),
+                context_bytes=context_size(context),
+            )
+        budget_update = {}
+        if track_budget:
+            errors = (state.get("consecutive_errors") or 0) + 1 if is_error(output) else 0
+            budget_update = {
+                "iterations": (state.get("iterations") or 0) + 1,
+                "consecutive_errors": errors,
             }
-    else:
+        if max_output_chars is not None:
+            output = _truncate_output(output, max_output_chars)
+        # The id is set here, so that a speculative model call sees the same message
+        update: dict[str, Any] = {"messages": [_output_message(output)]}
+        # Only the changed variables are written, and nothing at all if there are none,
+        # so the checkpointer doesn't store the whole namespace again every step
+        if new_vars:
+            if object_store is not None:
+                new_vars = offload_values(object_store, new_vars)
+                release_values(object_store, state.get("context", {}), new_vars)
+            update["context"] = new_vars
+        return {**update, **budget_update}
+
+    def plan_blocks(state: StateSchema) -> Optional[tuple[list[str], list[list[int]]]]:
+        # A session has a single namespace, so its blocks can't run concurrently
+        if not parallel_blocks or isinstance(eval_fn, SessionEvaluator):
+            return None
+        blocks = extract_codeblocks(_content_text(state["messages"][-1].content))
+        # Run the script as is if it doesn't come from the blocks of the last message
+        if len(blocks) < 2 or "\n\n".join(blocks) != state["script"]:
+            return None
+        waves = plan_parallel_blocks(blocks, tools_context)
+        if waves is None or len(waves) == len(blocks):
+            return None
+        return blocks, waves
 
-        def sandbox(state: StateSchema):
-            existing_context = state.get("context", {})
-            context = {**existing_context, **tools_context}
+    def sandbox(state: StateSchema, config: RunnableConfig):
+        started = time.perf_counter()
+        plan = plan_blocks(state)
+        if plan is None:
             # Execute the script in the sandbox
-            output, new_vars = eval_fn(state["script"], context)
-            new_context = {**existing_context, **new_vars}
-            return {
-                "messages": [{"role": "user", "content": output}],
-                "context": new_context,
-            }
+            output, new_vars = execute(state["script"], state, config)
+            return sandbox_update(output, new_vars, state, config, started)
+        blocks, waves = plan
+        outputs: dict[int, str] = {}
+        new_vars = {}
+        with ThreadPoolExecutor() as executor:
+            for wave in waves:
+                results = executor.map(
+                    execute,
+                    [blocks[i] for i in wave],
+                    repeat(state),
+                    repeat(config),
+                    repeat(new_vars),
+                    repeat(time.perf_counter()),
+                )
+                for i, (output, block_vars) in zip(wave, results, strict=True):
+                    outputs[i] = output
+                    new_vars = {**new_vars, **block_vars}
+        return sandbox_update(
+            "\n".join(outputs[i] for i in sorted(outputs)), new_vars, state, config, started
+        )
+
+    async def asandbox(state: StateSchema, config: RunnableConfig):
+        update = await arun_sandbox(state, config)
+        if speculative and not stream_code:
+            speculate(state, config, update)
+        return update
+
+    async def arun_sandbox(state: StateSchema, config: RunnableConfig):
+        started = time.perf_counter()
+        message_id = state["messages"][-1].id
+        pending = pending_executions.pop(_get_thread_id(config) or message_id, None)
+        if pending is not None:
+            pending_message_id, script, execution = pending
+            if pending_message_id == message_id and script == state["script"]:
+                # The script was already dispatched while the model was streaming
+                outputs, new_vars = await execution
+                return sandbox_update("\n".join(outputs), new_vars, state, config, started)
+            # The script was changed since, so it is run again
+            execution.cancel()
+            session_id = _get_thread_id(config)
+            if isinstance(eval_fn, SessionEvaluator) and session_id is not None:
+                # The session ran the dispatched blocks, it's reopened from the state
+                await eval_fn.aclose(session_id)
+        plan = plan_blocks(state)
+        if plan is None:
+            # Execute the script in the sandbox
+            output, new_vars = await aexecute(state["script"], state, config)
+            return sandbox_update(output, new_vars, state, config, started)
+        blocks, waves = plan
+        block_outputs: dict[int, str] = {}
+        new_vars = {}
+        for wave in waves:
+            results = await asyncio.gather(
+                *(aexecute(blocks[i], state, config, new_vars) for i in wave)
+            )
+            for i, (output, block_vars) in zip(wave, results, strict=True):
+                block_outputs[i] = output
+                new_vars = {**new_vars, **block_vars}
+        return sandbox_update(
+            "\n".join(block_outputs[i] for i in sorted(block_outputs)),
+            new_vars,
+            state,
+            config,
+            started,
+        )
 
     agent = StateGraph(state_schema)
-    agent.add_node(call_model, destinations=(END, "sandbox"))
-    agent.add_node(sandbox)
+    agent.add_node(
+        "call_model",
+        RunnableLambda(call_model, afunc=acall_model),
+        destinations=(END, "sandbox", "call_model"),
+    )
+    # If eval_fn is async, the sandbox node can only be run asynchronously.
+    agent.add_node(
+        "sandbox",
+        RunnableLambda(asandbox)
+        if _is_async_eval(eval_fn)
+        else RunnableLambda(sandbox, afunc=asandbox),
+    )
     agent.add_edge(START, "call_model")
     agent.add_edge("sandbox", "call_model")
     return agent
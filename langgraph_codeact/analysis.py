@@ -0,0 +1,110 @@
+import ast
+import builtins
+import functools
+from typing import Iterable, Optional
+
+_BUILTIN_NAMES = frozenset(dir(builtins))
+# Builtins that give a script access to names it doesn't reference directly
+_DYNAMIC_ACCESS_NAMES = frozenset({"globals", "locals", "vars", "eval", "exec", "dir"})
+
+
+def get_names(code: str) -> tuple[set[str], set[str]]:
+    """Get the names a script reads and the names it writes.
+
+    Names are collected from the whole script, including function bodies, so the
+    result over-approximates what the script actually uses at the top level.
+
+    Args:
+        code: Python source code.
+
+    Returns:
+        A tuple of (names read, names written).
+
+    Raises:
+        SyntaxError: If the code can't be parsed.
+    """
+    reads: set[str] = set()
+    writes: set[str] = set()
+    for node in ast.walk(ast.parse(code)):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                reads.add(node.id)
+            else:
+                writes.add(node.id)
+        elif isinstance(node, ast.AugAssign) and isinstance(node.target, ast.Name):
+            reads.add(node.target.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            writes.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                writes.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            writes.update(node.names)
+    return reads, writes
+
+
+@functools.lru_cache(maxsize=256)
+def get_referenced_names(code: str) -> Optional[frozenset[str]]:
+    """Get the names a script may look up in the namespace it runs in.
+
+    This includes the names it writes, as it may also delete or modify them.
+
+    Args:
+        code: Python source code.
+
+    Returns:
+        The referenced names, or None if the script can't be parsed or accesses its
+        namespace dynamically (e.g. with `globals()` or `eval`), in which case it may use
+        any name.
+    """
+    try:
+        reads, writes = get_names(code)
+    except SyntaxError:
+        return None
+    if reads & _DYNAMIC_ACCESS_NAMES:
+        return None
+    return frozenset(reads | writes)
+
+
+def plan_parallel_blocks(
+    blocks: list[str], shared_names: Iterable[str] = ()
+) -> Optional[list[list[int]]]:
+    """Group codeblocks into waves of blocks that can run at the same time.
+
+    A block depends on an earlier block if one of them writes a name the other
+    uses, or if both use the same name, since either could mutate the object in
+    place. Names in `shared_names` (e.g. tools) and builtins don't create a
+    dependency unless a block writes them. Each block is placed in the wave after
+    the last block it depends on, so running the waves in order, and the blocks of
+    a wave concurrently, gives the same result as running all blocks in order.
+
+    Args:
+        blocks: The code of each block, in the order they appear in the response.
+        shared_names: Names that blocks can use concurrently.
+
+    Returns:
+        A list of waves, each a list of block indices in their original order, or
+        None if a block can't be parsed.
+    """
+    ignored = _BUILTIN_NAMES.union(shared_names)
+    names = []
+    for block in blocks:
+        try:
+            reads, writes = get_names(block)
+        except SyntaxError:
+            return None
+        names.append((reads | writes, writes))
+
+    levels: list[int] = []
+    for i, (used, writes) in enumerate(names):
+        level = 0
+        for j in range(i):
+            other_used, other_writes = names[j]
+            if (writes & other_used) or (used & other_writes) or ((used & other_used) - ignored):
+                level = max(level, levels[j] + 1)
+        levels.append(level)
+
+    waves: list[list[int]] = [[] for _ in range(max(levels, default=-1) + 1)]
+    for i, level in enumerate(levels):
+        waves[level].append(i)
+    return waves
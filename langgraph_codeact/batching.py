@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Optional
+
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig, ensure_config
+
+BatchFunction = Callable[[list[LanguageModelInput], list[RunnableConfig]], list[Any]]
+"""Sends a batch of inputs to the model, returning a response (or an exception) per input."""
+
+AsyncBatchFunction = Callable[
+    [list[LanguageModelInput], list[RunnableConfig]], Awaitable[list[Any]]
+]
+
+
+class MicroBatcher(Runnable[LanguageModelInput, BaseMessage]):
+    """Model wrapper that sends concurrent calls to the model in batches.
+
+    Calls made within `window` seconds of the first call of a batch are gathered and
+    sent together with the model's `batch`/`abatch`, or with `batch_fn`/`abatch_fn`,
+    and each caller gets the response to its own input. A batch is sent as soon as it
+    has `max_batch_size` calls. This helps with inference servers that process
+    batches more efficiently than single requests, when many CodeAct threads call the
+    model at the same time.
+
+    Calls with keyword arguments are not batched. With `stream_code`, the response
+    arrives as a single chunk, so blocks can't be executed before it is complete.
+
+    Example:
+        model = MicroBatcher(init_chat_model(...), window=0.02, max_batch_size=64)
+        code_act = create_codeact(model, tools, eval_fn)
+    """
+
+    def __init__(
+        self,
+        model: BaseChatModel,
+        *,
+        window: float = 0.01,
+        max_batch_size: int = 32,
+        batch_fn: Optional[BatchFunction] = None,
+        abatch_fn: Optional[AsyncBatchFunction] = None,
+    ) -> None:
+        """Create a batcher.
+
+        Args:
+            model: The model to call.
+            window: Seconds to wait for more calls after the first call of a batch.
+            max_batch_size: Maximum number of calls sent in a batch.
+            batch_fn: Function sending a batch of inputs, with the config of each call.
+                It returns a response, or an exception, per input. Defaults to calling
+                `model.batch`.
+            abatch_fn: Async version of `batch_fn`, defaults to calling `model.abatch`.
+        """
+        self.model = model
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.batch_fn = batch_fn or self._batch
+        self.abatch_fn = abatch_fn or self._abatch
+        self._lock = threading.Lock()
+        self._pending: list[tuple[LanguageModelInput, RunnableConfig, Future]] = []
+        self._timer: Optional[threading.Timer] = None
+        # Calls waiting in each event loop
+        self._apending: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, list[tuple[LanguageModelInput, RunnableConfig, Any]]
+        ] = weakref.WeakKeyDictionary()
+        self._tasks: set[asyncio.Task] = set()
+
+    def _batch(self, inputs: list[LanguageModelInput], configs: list[RunnableConfig]) -> list:
+        return self.model.batch(inputs, configs, return_exceptions=True)
+
+    async def _abatch(
+        self, inputs: list[LanguageModelInput], configs: list[RunnableConfig]
+    ) -> list:
+        return await self.model.abatch(inputs, configs, return_exceptions=True)
+
+    def invoke(
+        self, input: LanguageModelInput, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> BaseMessage:
+        if kwargs:
+            return self.model.invoke(input, config, **kwargs)
+        future: Future = Future()
+        batch = None
+        with self._lock:
+            # The config is resolved here, as the batch may be sent from another thread
+            self._pending.append((input, ensure_config(config), future))
+            if len(self._pending) >= self.max_batch_size:
+                batch = self._take()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            self._send(batch)
+        return future.result()
+
+    def _take(self) -> list[tuple[LanguageModelInput, RunnableConfig, Future]]:
+        """Take the pending calls, must be called holding the lock."""
+        batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self) -> None:
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def _send(self, batch: list[tuple[LanguageModelInput, RunnableConfig, Future]]) -> None:
+        try:
+            results = self.batch_fn([item[0] for item in batch], [item[1] for item in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        _resolve(batch, results)
+
+    async def ainvoke(
+        self, input: LanguageModelInput, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> BaseMessage:
+        if kwargs:
+            return await self.model.ainvoke(input, config, **kwargs)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._apending.setdefault(loop, [])
+        pending.append((input, ensure_config(config), future))
+        if len(pending) >= self.max_batch_size:
+            self._apending[loop] = []
+            self._start(loop, pending)
+        elif len(pending) == 1:
+            loop.call_later(self.window, self._aflush, loop, pending)
+        return await future
+
+    def _start(self, loop: asyncio.AbstractEventLoop, batch: list) -> None:
+        # Keep a reference to the task until it's done, so it isn't garbage collected
+        task = loop.create_task(self._asend(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _aflush(self, loop: asyncio.AbstractEventLoop, pending: list) -> None:
+        # The batch may have been sent already, because it became full
+        if self._apending.get(loop) is pending:
+            self._apending[loop] = []
+            self._start(loop, pending)
+
+    async def _asend(self, batch: list[tuple[LanguageModelInput, RunnableConfig, Any]]) -> None:
+        try:
+            results = await self.abatch_fn([item[0] for item in batch], [item[1] for item in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        _resolve(batch, results)
+
+
+def _resolve(batch: list[tuple[Any, Any, Any]], results: list[Any]) -> None:
+    """Set the result of the future of each call of a batch."""
+    if len(results) != len(batch):
+        error = ValueError(f"Got {len(results)} results for a batch of {len(batch)} inputs")
+        results = [error] * len(batch)
+    for (_, _, future), result in zip(batch, results, strict=True):
+        # Async calls may have been cancelled while waiting
+        if future.done():
+            continue
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
@@ -0,0 +1,387 @@
+import asyncio
+import dataclasses
+import functools
+import hashlib
+import inspect
+import marshal
+import pickle
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Collection, Optional
+
+from langgraph_codeact.analysis import get_referenced_names
+
+MISSING = object()
+"""Returned by `CacheBackend.get` when there is no cached value."""
+
+
+@dataclasses.dataclass(frozen=True)
+class CachePolicy:
+    """How long, and how many, results of a function are cached."""
+
+    ttl: Optional[float] = None
+    """Seconds after which a cached result expires. None means results don't expire."""
+    maxsize: Optional[int] = None
+    """Maximum number of cached results, least recently used results are evicted first.
+    None means no limit."""
+
+
+@dataclasses.dataclass
+class CacheStats:
+    """Hit and miss counters of a cached function."""
+
+    hits: int = 0
+    misses: int = 0
+
+
+class CacheBackend(ABC):
+    """Storage for cached values, grouped in namespaces."""
+
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Any:
+        """Get a cached value, or `MISSING` if there is no unexpired value for the key."""
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: Any, policy: CachePolicy) -> None:
+        """Cache a value, evicting values of the namespace as required by the policy."""
+
+    @abstractmethod
+    def clear(self, namespace: Optional[str] = None) -> None:
+        """Delete the cached values of a namespace, or all cached values."""
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """Cache backend keeping values in a dict per namespace."""
+
+    def __init__(self) -> None:
+        self._values: dict[str, OrderedDict[str, tuple[Any, Optional[float]]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Any:
+        with self._lock:
+            values = self._values.get(namespace)
+            if values is None or key not in values:
+                return MISSING
+            value, expires_at = values[key]
+            if expires_at is not None and expires_at <= time.time():
+                del values[key]
+                return MISSING
+            values.move_to_end(key)
+            return value
+
+    def set(self, namespace: str, key: str, value: Any, policy: CachePolicy) -> None:
+        expires_at = None if policy.ttl is None else time.time() + policy.ttl
+        with self._lock:
+            values = self._values.setdefault(namespace, OrderedDict())
+            values[key] = (value, expires_at)
+            values.move_to_end(key)
+            while policy.maxsize is not None and len(values) > policy.maxsize:
+                values.popitem(last=False)
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        with self._lock:
+            if namespace is None:
+                self._values.clear()
+            else:
+                self._values.pop(namespace, None)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Cache backend storing pickled values in a local SQLite file.
+
+    The file can be shared by several processes, so results are reused across
+    workers and restarts.
+
+    Args:
+        path: Path of the SQLite database file, or ":memory:".
+    """
+
+    def __init__(self, path: str) -> None:
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )"""
+        )
+
+    def get(self, namespace: str, key: str) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is None:
+                return MISSING
+            if row[1] is not None and row[1] <= now:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+                )
+                return MISSING
+            self._conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key),
+            )
+        return pickle.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, policy: CachePolicy) -> None:
+        now = time.time()
+        expires_at = None if policy.ttl is None else now + policy.ttl
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, data, expires_at, now),
+            )
+            if policy.maxsize is not None:
+                self._conn.execute(
+                    """DELETE FROM cache WHERE namespace = ? AND key NOT IN (
+                        SELECT key FROM cache WHERE namespace = ?
+                        ORDER BY accessed_at DESC LIMIT ?
+                    )""",
+                    (namespace, namespace, policy.maxsize),
+                )
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        with self._lock:
+            if namespace is None:
+                self._conn.execute("DELETE FROM cache")
+            else:
+                self._conn.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+
+
+def hash_arguments(*args: Any, **kwargs: Any) -> Optional[str]:
+    """Hash function arguments, or return None if they can't be pickled."""
+    try:
+        data = pickle.dumps((args, sorted(kwargs.items())), protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+    return hashlib.sha256(data).hexdigest()
+
+
+class ToolCache:
+    """Memoizes the results of tool calls made by generated code.
+
+    Pass it to `create_codeact` to wrap the functions injected into the sandbox.
+    Only tools with a policy are cached.
+
+    Tool calls with arguments or results that can't be pickled, and calls that raise,
+    are not cached. Results are stored pickled, so each caller gets its own copy. The wrapped functions are closures, which can't be pickled, so a tool cache
+    only works with sandboxes that run in the current process. `SandboxPool` refuses
+    to open sessions with them.
+
+    Args:
+        backend: Where results are stored. Defaults to an `InMemoryCacheBackend`.
+        policies: Cache policy of each tool, by tool name.
+        default_policy: Cache policy of tools without an entry in `policies`. If None,
+            only the tools in `policies` are cached.
+
+    Example:
+        cache = ToolCache(
+            SQLiteCacheBackend("tools.sqlite"),
+            policies={"search": CachePolicy(ttl=3600, maxsize=1000)},
+        )
+        code_act = create_codeact(model, tools, eval_fn, tool_cache=cache)
+        ...
+        cache.stats()["search"].hits
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        *,
+        policies: Optional[dict[str, CachePolicy]] = None,
+        default_policy: Optional[CachePolicy] = None,
+    ) -> None:
+        self.backend = backend or InMemoryCacheBackend()
+        self.policies = dict(policies or {})
+        self.default_policy = default_policy
+        self._stats: dict[str, CacheStats] = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        """Wrap a tool function so that its results are cached under the tool name."""
+        policy = self.policies.get(name, self.default_policy)
+        if policy is None:
+            return func
+        namespace = f"tool:{name}"
+
+        @functools.wraps(func)
+        def cached(*args: Any, **kwargs: Any) -> Any:
+            key = hash_arguments(*args, **kwargs)
+            if key is None:
+                return func(*args, **kwargs)
+            value = self.backend.get(namespace, key)
+            self._count(name, value is not MISSING)
+            if value is not MISSING:
+                result = pickle.loads(value)
+                return _resolved(result) if _returns_awaitable(func) else result
+            result = func(*args, **kwargs)
+            if inspect.isawaitable(result):
+                # Async tools called from a running event loop return an awaitable
+                return self._set_when_done(namespace, key, result, policy)
+            self._set(namespace, key, result, policy)
+            return result
+
+        return cached
+
+    async def _set_when_done(
+        self, namespace: str, key: str, awaitable: Any, policy: CachePolicy
+    ) -> Any:
+        result = await awaitable
+        self._set(namespace, key, result, policy)
+        return result
+
+    def _set(self, namespace: str, key: str, result: Any, policy: CachePolicy) -> None:
+        """Cache a pickled copy of a result, if it can be pickled."""
+        try:
+            value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        self.backend.set(namespace, key, value, policy)
+
+    def _count(self, name: str, hit: bool) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(name, CacheStats())
+            if hit:
+                stats.hits += 1
+            else:
+                stats.misses += 1
+
+    def stats(self) -> dict[str, CacheStats]:
+        """Get a snapshot of the hit and miss counters of each cached tool."""
+        with self._lock:
+            return {name: dataclasses.replace(stats) for name, stats in self._stats.items()}
+
+    def clear(self) -> None:
+        """Delete all cached results."""
+        self.backend.clear()
+
+
+class ExecutionCache:
+    """Memoizes whole sandbox executions, so repeated scripts don't run again.
+
+    Pass it to `create_codeact` to reuse the output and new variables of a script that
+    already ran with the same inputs, in any thread. The key is a hash of the script, of
+    the context values it references, and of the versions of the tools it references.
+    A tool's version is its entry in `tool_versions`, or else a hash of its code.
+
+    Scripts are not cached when they reference a name in `nondeterministic` (e.g. a tool
+    returning live data, or a module like `random` imported by the script), access
+    variables dynamically (`globals()`, `eval`, ...), reference values that can't be
+    pickled, create variables that can't be pickled, or fail. Results are stored pickled,
+    so each hit gets its own copy of the variables. Has no effect with a
+    `SessionEvaluator`, as the cached variables would be missing from the session.
+
+    Args:
+        backend: Where results are stored. Defaults to an `InMemoryCacheBackend`.
+        policy: How long, and how many, results are cached. Defaults to no limits.
+        tool_versions: Version of each tool, by tool name. Change it to invalidate the
+            results of scripts calling the tool.
+        nondeterministic: Names of tools (or other names) whose scripts are never cached.
+
+    Example:
+        cache = ExecutionCache(
+            policy=CachePolicy(ttl=600, maxsize=10_000), nondeterministic={"search"}
+        )
+        code_act = create_codeact(model, tools, eval_fn, execution_cache=cache)
+    """
+
+    namespace = "execution"
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        *,
+        policy: Optional[CachePolicy] = None,
+        tool_versions: Optional[dict[str, str]] = None,
+        nondeterministic: Collection[str] = (),
+    ) -> None:
+        self.backend = backend or InMemoryCacheBackend()
+        self.policy = policy or CachePolicy()
+        self.tool_versions = dict(tool_versions or {})
+        self.nondeterministic = frozenset(nondeterministic)
+        self._stats = CacheStats()
+        self._lock = threading.Lock()
+
+    def key(self, code: str, values: dict[str, Any], tools: dict[str, Callable]) -> Optional[str]:
+        """Get the key of a script, or None if it must not be cached.
+
+        Args:
+            code: The script.
+            values: The context values referenced by the script.
+            tools: The tools referenced by the script, by name.
+        """
+        names = get_referenced_names(code)
+        if names is None or not self.nondeterministic.isdisjoint(names):
+            return None
+        versions = {
+            name: self.tool_versions.get(name) or _code_version(func)
+            for name, func in tools.items()
+        }
+        return hash_arguments(code, sorted(values.items()), sorted(versions.items()))
+
+    def get(self, key: str) -> Optional[tuple[str, dict[str, Any]]]:
+        """Get the cached output and new variables of a script, or None."""
+        value = self.backend.get(self.namespace, key)
+        with self._lock:
+            if value is MISSING:
+                self._stats.misses += 1
+            else:
+                self._stats.hits += 1
+        return None if value is MISSING else pickle.loads(value)
+
+    def set(self, key: str, output: str, new_vars: dict[str, Any]) -> None:
+        """Cache the output and new variables of a script, if they can be pickled."""
+        try:
+            value = pickle.dumps((output, new_vars), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        self.backend.set(self.namespace, key, value, self.policy)
+
+    def stats(self) -> CacheStats:
+        """Get a snapshot of the hit and miss counters."""
+        with self._lock:
+            return dataclasses.replace(self._stats)
+
+    def clear(self) -> None:
+        """Delete all cached results."""
+        self.backend.clear(self.namespace)
+
+
+def _code_version(func: Callable) -> str:
+    """Hash the code of a function, or return its name if it has no code object."""
+    func = inspect.unwrap(func)
+    code = getattr(func, "__code__", None)
+    if code is None:
+        return getattr(func, "__qualname__", type(func).__qualname__)
+    return _hash_code(code)
+
+
+@functools.lru_cache(maxsize=256)
+def _hash_code(code: Any) -> str:
+    return hashlib.sha256(marshal.dumps(code)).hexdigest()
+
+
+def _returns_awaitable(func: Callable) -> bool:
+    """Check whether a bridged async tool returns an awaitable when called now."""
+    if not inspect.iscoroutinefunction(getattr(func, "__wrapped__", None)):
+        return False
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+async def _resolved(value: Any) -> Any:
+    return value
@@ -0,0 +1,64 @@
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, Mapping, Optional, Union
+
+DELETE_VARIABLE = "__codeact_delete__"
+"""Value an `eval_fn` can return for a variable name to delete it from the context."""
+
+
+def merge_context(
+    left: Optional[dict[str, Any]], right: Optional[dict[str, Any]]
+) -> dict[str, Any]:
+    """Merge a context update into the existing context.
+
+    The sandbox node only writes the variables that changed in a step, so the
+    update is a delta: names mapped to `DELETE_VARIABLE` are removed and every
+    other name is added or overwritten.
+
+    Args:
+        left: The existing context.
+        right: The context delta produced by a sandbox step.
+
+    Returns:
+        The new context.
+
+    Example:
+        merge_context({"x": 1, "y": 2}, {"x": 3, "y": DELETE_VARIABLE, "z": 4})
+
+        Result:
+
+        {"x": 3, "z": 4}
+    """
+    merged = dict(left or {})
+    for key, value in (right or {}).items():
+        if isinstance(value, str) and value == DELETE_VARIABLE:
+            merged.pop(key, None)
+        else:
+            merged[key] = value
+    return merged
+
+
+SharedContext = Union[Mapping[str, Any], Callable[[], Mapping[str, Any]]]
+"""A read-only namespace shared by all threads, or a function building it."""
+
+_shared_contexts: dict[Callable[[], Mapping[str, Any]], Mapping[str, Any]] = {}
+_shared_contexts_lock = threading.Lock()
+
+
+def get_shared_context(shared_context: SharedContext) -> Mapping[str, Any]:
+    """Get a shared context, building it on first use if given as a function.
+
+    A function is only called once per process, however many graphs or threads use
+    it, and the namespace it returns is wrapped in a read-only mapping.
+    """
+    if not callable(shared_context):
+        return shared_context
+    context = _shared_contexts.get(shared_context)
+    if context is None:
+        # Held while building, so that concurrent runs wait for one build
+        with _shared_contexts_lock:
+            context = _shared_contexts.get(shared_context)
+            if context is None:
+                context = MappingProxyType(dict(shared_context()))
+                _shared_contexts[shared_context] = context
+    return context
@@ -0,0 +1,205 @@
+import dataclasses
+import pickle
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+
+@dataclasses.dataclass
+class CodeActEvent:
+    """A measurement recorded while running a CodeAct graph.
+
+    The events recorded by `create_codeact(..., on_event=...)` are:
+
+    - `model`: a model call. Attributes: `time_to_first_token` (seconds, only when the
+      response is streamed with `stream_code`), `speculative` (with `speculative=True`, whether the
+      response of a speculative call was used, the duration is then the time left
+      waiting for it),
+      `input_tokens` and `output_tokens` (when the model reports usage).
+    - `extraction`: extracting and checking the code of a model response. Attributes:
+      `code_chars`.
+    - `sandbox`: a call to `eval_fn`. Attributes: `queue_seconds` (time waiting for an
+      executor thread or for the previous streamed blocks), `output_chars`, `cached` (with an
+      `execution_cache`, whether the result was reused instead of calling `eval_fn`).
+    - `sandbox_step`: a step of the sandbox node, which runs one or more scripts.
+      Attributes: `variables` and `context_bytes` (pickled size, not counting values
+      that can't be pickled) of the context after the step.
+
+    `InstrumentedCheckpointer` records `checkpoint` events, with attributes `kind`
+    (`checkpoint` or `writes`) and `bytes`.
+    """
+
+    name: str
+    """Name of the measured operation."""
+    start_time: float
+    """Unix time at which the operation started."""
+    duration: float
+    """Seconds the operation took."""
+    thread_id: Optional[str] = None
+    """Thread of the run, if it has one."""
+    step: Optional[int] = None
+    """Step of the graph the operation happened in."""
+    attributes: dict[str, Any] = dataclasses.field(default_factory=dict)
+    """Measurements specific to the operation."""
+
+
+EventHandler = Callable[[CodeActEvent], None]
+
+
+class EventRecorder:
+    """Event handler that keeps the events in a list, e.g. for tests or benchmarks."""
+
+    def __init__(self) -> None:
+        self.events: list[CodeActEvent] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event: CodeActEvent) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Get the count, total and maximum duration of the events with each name."""
+        summary: dict[str, dict[str, float]] = {}
+        for event in self.events:
+            stats = summary.setdefault(event.name, {"count": 0, "total": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["total"] += event.duration
+            stats["max"] = max(stats["max"], event.duration)
+        return summary
+
+
+class OpenTelemetryExporter:
+    """Event handler that exports each event as an OpenTelemetry span.
+
+    Spans are named `codeact.<event name>`, and have the thread, step and attributes of
+    the event as `codeact.*` attributes. Requires the `opentelemetry-api` package.
+    """
+
+    def __init__(self, tracer: Any = None) -> None:
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImportError(
+                "OpenTelemetryExporter requires opentelemetry-api, "
+                "install it with `pip install opentelemetry-api`"
+            ) from e
+        self.tracer = tracer if tracer is not None else trace.get_tracer("langgraph_codeact")
+
+    def __call__(self, event: CodeActEvent) -> None:
+        attributes = {
+            f"codeact.{key}": value
+            for key, value in {
+                "thread_id": event.thread_id,
+                "step": event.step,
+                **event.attributes,
+            }.items()
+            # Span attributes can't be None
+            if value is not None
+        }
+        start = int(event.start_time * 1e9)
+        span = self.tracer.start_span(
+            f"codeact.{event.name}", start_time=start, attributes=attributes
+        )
+        span.end(end_time=start + int(event.duration * 1e9))
+
+
+def context_size(context: dict[str, Any]) -> int:
+    """Get the pickled size in bytes of a context, skipping values that can't be pickled."""
+    size = 0
+    for value in context.values():
+        try:
+            size += len(pickle.dumps(value))
+        except Exception:
+            continue
+    return size
+
+
+class InstrumentedCheckpointer(BaseCheckpointSaver):
+    """Checkpointer wrapper that records the size of each checkpoint and of each set of writes.
+
+    Sizes are measured by serializing the written values a second time with the
+    checkpointer's serializer, so this adds some overhead to every step.
+
+    Example:
+        recorder = EventRecorder()
+        checkpointer = InstrumentedCheckpointer(InMemorySaver(), recorder)
+        agent = create_codeact(model, tools, eval_fn, on_event=recorder).compile(
+            checkpointer=checkpointer
+        )
+    """
+
+    def __init__(self, checkpointer: BaseCheckpointSaver, on_event: EventHandler) -> None:
+        super().__init__(serde=checkpointer.serde)
+        self.checkpointer = checkpointer
+        self.on_event = on_event
+
+    @property
+    def config_specs(self) -> list:
+        return self.checkpointer.config_specs
+
+    def _size(self, values: Any) -> int:
+        return sum(len(self.serde.dumps_typed(value)[1]) for value in values)
+
+    def _emit(self, config: Any, kind: str, start: float, size: int, step: Any = None) -> None:
+        self.on_event(
+            CodeActEvent(
+                name="checkpoint",
+                start_time=start,
+                duration=time.time() - start,
+                thread_id=config.get("configurable", {}).get("thread_id"),
+                step=step,
+                attributes={"kind": kind, "bytes": size},
+            )
+        )
+
+    def _checkpoint_size(self, checkpoint: Any, new_versions: Any) -> int:
+        values = checkpoint["channel_values"]
+        return self._size(values[channel] for channel in new_versions if channel in values)
+
+    def put(self, config: Any, checkpoint: Any, metadata: Any, new_versions: Any) -> Any:
+        start = time.time()
+        result = self.checkpointer.put(config, checkpoint, metadata, new_versions)
+        size = self._checkpoint_size(checkpoint, new_versions)
+        self._emit(config, "checkpoint", start, size, metadata.get("step"))
+        return result
+
+    async def aput(self, config: Any, checkpoint: Any, metadata: Any, new_versions: Any) -> Any:
+        start = time.time()
+        result = await self.checkpointer.aput(config, checkpoint, metadata, new_versions)
+        size = self._checkpoint_size(checkpoint, new_versions)
+        self._emit(config, "checkpoint", start, size, metadata.get("step"))
+        return result
+
+    def put_writes(self, config: Any, writes: Any, task_id: str, task_path: str = "") -> None:
+        start = time.time()
+        self.checkpointer.put_writes(config, writes, task_id, task_path)
+        self._emit(config, "writes", start, self._size(value for _, value in writes))
+
+    async def aput_writes(
+        self, config: Any, writes: Any, task_id: str, task_path: str = ""
+    ) -> None:
+        start = time.time()
+        await self.checkpointer.aput_writes(config, writes, task_id, task_path)
+        self._emit(config, "writes", start, self._size(value for _, value in writes))
+
+
+def _delegate(name: str) -> Callable:
+    def method(self: InstrumentedCheckpointer, *args: Any, **kwargs: Any) -> Any:
+        return getattr(self.checkpointer, name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+# Everything else, including methods added by newer versions of langgraph, is
+# passed through to the wrapped checkpointer
+for _name in dir(BaseCheckpointSaver):
+    if (
+        not _name.startswith("_")
+        and _name not in InstrumentedCheckpointer.__dict__
+        and _name not in ("serde", "with_allowlist")
+        and callable(getattr(BaseCheckpointSaver, _name))
+    ):
+        setattr(InstrumentedCheckpointer, _name, _delegate(_name))
@@ -0,0 +1,162 @@
+import os
+import pickle
+import sys
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Collection, Optional
+
+OBJECT_REF_PREFIX = "codeact-object:"
+
+# Values of these types are small and cheap to serialize, so they stay in the context
+_INLINE_TYPES = (bool, int, float, complex, type(None))
+_INLINE_MAX_LEN = 1024
+
+
+class ObjectStore(ABC):
+    """Store for context values that should be kept out of the checkpointed state.
+
+    When an object store is passed to `create_codeact`, variables created by the
+    sandbox are put in the store and the state only holds a small reference string
+    for each of them. References are resolved back to values before a script runs.
+    """
+
+    @abstractmethod
+    def put(self, value: Any) -> str:
+        """Store a value and return the key it can be fetched with."""
+
+    @abstractmethod
+    def get(self, key: str) -> Any:
+        """Fetch a stored value. Raises KeyError if the value is no longer available."""
+
+    def delete(self, key: str) -> None:
+        """Release a stored value that is no longer referenced. Does nothing by default."""
+        return None
+
+
+class InMemoryObjectStore(ObjectStore):
+    """In-process LRU object store with size-based eviction.
+
+    Args:
+        max_bytes: Approximate total size of the values kept in memory. Least recently
+            used values are evicted once it is exceeded. The size of a value is the
+            length of its pickle, or `sys.getsizeof` if it can't be pickled.
+        spill_dir: Optional directory that evicted values are pickled to, instead of
+            being dropped. Values that can't be pickled are always dropped on eviction.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, *, spill_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        self._values: OrderedDict[str, tuple[Any, int, Optional[bytes]]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.RLock()
+
+    def put(self, value: Any) -> str:
+        key = uuid.uuid4().hex
+        try:
+            data: Optional[bytes] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            size = len(data)
+        except Exception:
+            data = None
+            size = sys.getsizeof(value)
+        with self._lock:
+            self._insert(key, value, size, data if self.spill_dir is not None else None)
+        return key
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key][0]
+            path = self._spill_path(key)
+            if path is None or not os.path.exists(path):
+                raise KeyError(key)
+            with open(path, "rb") as f:
+                data = f.read()
+            os.remove(path)
+            value = pickle.loads(data)
+            self._insert(key, value, len(data), data)
+            return value
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            entry = self._values.pop(key, None)
+            if entry is not None:
+                self._size -= entry[1]
+            path = self._spill_path(key)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def _insert(self, key: str, value: Any, size: int, data: Optional[bytes]) -> None:
+        self._values[key] = (value, size, data)
+        self._size += size
+        # Always keep the most recent value, even if it is larger than max_bytes
+        while self._size > self.max_bytes and len(self._values) > 1:
+            evicted_key, (_, evicted_size, evicted_data) = self._values.popitem(last=False)
+            self._size -= evicted_size
+            path = self._spill_path(evicted_key)
+            if path is not None and evicted_data is not None:
+                with open(path, "wb") as f:
+                    f.write(evicted_data)
+
+    def _spill_path(self, key: str) -> Optional[str]:
+        if self.spill_dir is None:
+            return None
+        return os.path.join(self.spill_dir, f"{key}.pkl")
+
+
+def is_object_ref(value: Any) -> bool:
+    """Check whether a context value is a reference to a value in an object store."""
+    return isinstance(value, str) and value.startswith(OBJECT_REF_PREFIX)
+
+
+def offload_values(store: ObjectStore, values: dict[str, Any]) -> dict[str, Any]:
+    """Replace values that are not small scalars or strings with object store references."""
+    offloaded = {}
+    for name, value in values.items():
+        if isinstance(value, _INLINE_TYPES) or (
+            isinstance(value, (str, bytes)) and len(value) <= _INLINE_MAX_LEN
+        ):
+            offloaded[name] = value
+        else:
+            offloaded[name] = OBJECT_REF_PREFIX + store.put(value)
+    return offloaded
+
+
+def release_values(store: ObjectStore, context: dict[str, Any], delta: dict[str, Any]) -> None:
+    """Delete the stored values of the references that a context delta overwrites or deletes.
+
+    Older checkpoints of the thread still hold these references, so their values are
+    missing if the thread is replayed from one of them, as after an eviction.
+    """
+    for name, value in delta.items():
+        previous = context.get(name)
+        if is_object_ref(previous) and previous != value:
+            store.delete(previous[len(OBJECT_REF_PREFIX) :])
+
+
+def resolve_values(
+    store: ObjectStore, values: dict[str, Any], names: Optional[Collection[str]] = None
+) -> dict[str, Any]:
+    """Replace object store references with the stored values.
+
+    Variables whose value is no longer available in the store are left out, so the
+    script sees them as undefined. If `names` is given, only the references of those
+    variables are fetched, and the other references are left out.
+    """
+    resolved = {}
+    for name, value in values.items():
+        if is_object_ref(value):
+            if names is not None and name not in names:
+                continue
+            try:
+                resolved[name] = store.get(value[len(OBJECT_REF_PREFIX) :])
+            except KeyError:
+                continue
+        else:
+            resolved[name] = value
+    return resolved
@@ -0,0 +1,545 @@
+import asyncio
+import collections
+import contextlib
+import dataclasses
+import importlib
+import io
+import math
+import multiprocessing
+import pickle
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Connection
+from typing import Any, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+from langgraph_codeact.context import merge_context
+from langgraph_codeact.session import SessionEvaluator, _namespace_delta
+from langgraph_codeact.utils import run_code
+
+
+@dataclasses.dataclass
+class PoolMetrics:
+    """Counters collected by a `SandboxPool`."""
+
+    leases: int = 0
+    """Number of sessions that leased a worker."""
+    executions: int = 0
+    """Number of scripts executed."""
+    queue_wait_seconds: float = 0.0
+    """Total time sessions waited for an idle worker."""
+    max_queue_wait_seconds: float = 0.0
+    """Longest time a session waited for an idle worker."""
+    lease_seconds: float = 0.0
+    """Total time workers were leased to sessions, counted when a session is closed."""
+    recycles: int = 0
+    """Number of workers that were replaced with a fresh process."""
+    reclaims: int = 0
+    """Number of idle sessions that were closed to give their worker to a waiting session."""
+
+
+def _get_memory_usage() -> int:
+    """Peak resident memory of the current process in bytes."""
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def _set_cpu_time_limit(seconds: int) -> None:
+    """Limit the CPU time the current process can use from now on."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = math.ceil(usage.ru_utime + usage.ru_stime)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (used + seconds, hard))
+
+
+def _worker_main(
+    conn: Connection,
+    preload: Sequence[str],
+    memory_limit: Optional[int],
+    cpu_time_limit: Optional[int],
+) -> None:
+    """Entry point of a sandbox worker process."""
+    for module in preload:
+        importlib.import_module(module)
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    base = {"__builtins__": __builtins__}
+    namespace = dict(base)
+    conn.send(("ok", None))
+    while True:
+        try:
+            command, payload = conn.recv()
+        except EOFError:
+            return
+        if command == "open":
+            namespace = {**base, **payload}
+            conn.send(("ok", None))
+        elif command == "execute":
+            before = dict(namespace)
+            if cpu_time_limit is not None:
+                # The process is killed with SIGXCPU when the limit is exceeded
+                _set_cpu_time_limit(cpu_time_limit)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()) as f:
+                    run_code(payload, namespace)
+                output = f.getvalue()
+                if not output:
+                    output = "<code ran, no output printed to stdout>"
+            except Exception as e:
+                output = f"Error during execution: {repr(e)}"
+            delta = _namespace_delta(before, namespace)
+            conn.send(("ok", (output, _picklable(delta), _get_memory_usage())))
+        elif command == "reset":
+            namespace = dict(base)
+            conn.send(("ok", None))
+
+
+def _picklable(values: dict[str, Any]) -> dict[str, Any]:
+    """Drop the values that can't be sent back to the parent process."""
+    result = {}
+    for key, value in values.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        result[key] = value
+    return result
+
+
+def _check_picklable(values: dict[str, Any]) -> None:
+    """Check that values can be sent to a worker process.
+
+    Raises:
+        TypeError: If some of the values can't be pickled.
+    """
+    names = []
+    for key, value in values.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            names.append(key)
+    if names:
+        raise TypeError(
+            f"Can't send {', '.join(names)} to sandbox workers, as they can't be pickled. "
+            "Tools must be importable functions, defined at the top level of a module."
+        )
+
+
+# Seconds between checks for idle leases while waiting for a worker
+_RECLAIM_INTERVAL = 1.0
+
+
+class _Worker:
+    def __init__(
+        self,
+        mp_context: Any,
+        preload: Sequence[str],
+        memory_limit: Optional[int],
+        cpu_time_limit: Optional[int],
+        start_timeout: Optional[float],
+    ) -> None:
+        self.start_timeout = start_timeout
+        self.conn, child_conn = mp_context.Pipe()
+        self.process = mp_context.Process(
+            target=_worker_main,
+            args=(child_conn, tuple(preload), memory_limit, cpu_time_limit),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.executions = 0
+        self.memory = 0
+        self._ready = False
+
+    def request(self, command: str, payload: Any = None, timeout: Optional[float] = None) -> Any:
+        """Send a command to the worker and wait for its result.
+
+        Raises:
+            TimeoutError: If the worker didn't respond within `timeout` seconds, or didn't
+                start within `start_timeout` seconds.
+            EOFError: If the worker process exited.
+        """
+        if not self._ready:
+            # Wait for the worker to finish importing the preloaded modules
+            if self.start_timeout is not None and not self.conn.poll(self.start_timeout):
+                raise TimeoutError(f"Worker didn't start within {self.start_timeout} seconds")
+            self.conn.recv()
+            self._ready = True
+        self.conn.send((command, payload))
+        if timeout is not None and not self.conn.poll(timeout):
+            raise TimeoutError(f"Execution timed out after {timeout} seconds")
+        _, result = self.conn.recv()
+        return result
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+@dataclasses.dataclass
+class _Lease:
+    worker: _Worker
+    leased: float
+    last_used: float
+    busy: bool = False
+
+
+class SandboxPool(SessionEvaluator):
+    """Session evaluator backed by a pool of pre-started worker processes.
+
+    Workers are started when the pool is created and import the `preload` modules
+    up front, so sessions don't pay for interpreter start-up. Each session leases
+    a worker until it is closed (with `create_codeact` that is the end of a run),
+    after which the worker is reset, or replaced with a fresh process once it has
+    run `max_executions` scripts or its memory usage exceeds `max_memory`.
+
+    When all workers are leased, `open` waits for one to be released, for at most
+    `lease_timeout` seconds. Meanwhile, sessions that haven't executed anything for
+    `idle_timeout` seconds are closed and their worker is given to a waiting session,
+    so that sessions that are never closed (e.g. of runs that were interrupted and
+    never resumed) don't hold workers forever. `create_codeact` reopens a closed
+    session from the graph state on its next sandbox step. The async methods wait without holding a thread, and
+    run their requests on threads of the pool, so sessions waiting for a worker
+    can't keep leased sessions from running or closing.
+
+    Each execution can be limited in wall-clock time, CPU time and memory. A worker
+    that exceeds a limit is killed and replaced, and the session continues on the
+    new worker with the variables it had before the failed script.
+
+    Besides being passed to `create_codeact` as a session evaluator, the pool can run
+    independent snippets with `pool.evaluate`, which has the `eval_fn` signature:
+    `create_codeact(model, tools, pool.evaluate)`. Each call leases a worker for a
+    single execution, so CPU-bound snippets from concurrent runs use all cores
+    instead of blocking the event loop.
+
+    Tools and variables are sent to workers with pickle, so tools must be importable
+    functions (defined at the top level of a module), and `open` raises `TypeError` if
+    any of them can't be pickled. This includes the tools wrapped by a `ToolCache`.
+    Variables that can't be pickled are not sent back from workers.
+
+    > [!Warning]
+    > Workers are separate processes, but they are not a security sandbox.
+
+    Args:
+        size: Number of worker processes.
+        preload: Modules to import in every worker when it starts, e.g. the modules
+            that define your tools, or heavy libraries the generated code uses.
+        max_executions: Replace a worker after it has executed this many scripts.
+        max_memory: Replace a worker once its peak memory usage exceeds this many bytes.
+        timeout: Wall-clock limit in seconds for a single execution.
+        cpu_time_limit: CPU time limit in seconds for a single execution (`RLIMIT_CPU`).
+        memory_limit: Address space limit in bytes of each worker process (`RLIMIT_AS`).
+            Allocations above it raise `MemoryError` in the executed code.
+        mp_context: The multiprocessing start method to use, e.g. "spawn" or "fork".
+            Defaults to "forkserver" where it is available, and "spawn" elsewhere. Workers
+            are replaced from threads while the graph runs, and a process forked from a
+            multithreaded one can deadlock on a lock another thread held.
+        start_timeout: Seconds to wait for a new worker to be ready, including importing
+            the `preload` modules. A worker that doesn't start in time is replaced once
+            when opening a session, and `TimeoutError` is raised if that fails too.
+        lease_timeout: Seconds to wait for an idle worker when opening a session, after
+            which `TimeoutError` is raised. None waits forever.
+        idle_timeout: Seconds after its last execution that an open session can be
+            closed to free its worker for a waiting session. None never closes them.
+    """
+
+    def __init__(
+        self,
+        size: int = 4,
+        *,
+        preload: Sequence[str] = (),
+        max_executions: Optional[int] = None,
+        max_memory: Optional[int] = None,
+        timeout: Optional[float] = None,
+        cpu_time_limit: Optional[int] = None,
+        memory_limit: Optional[int] = None,
+        mp_context: Optional[str] = None,
+        start_timeout: Optional[float] = 60.0,
+        lease_timeout: Optional[float] = 300.0,
+        idle_timeout: Optional[float] = 60.0,
+    ) -> None:
+        if resource is None and (cpu_time_limit is not None or memory_limit is not None):
+            raise ValueError("cpu_time_limit and memory_limit are not supported on this platform")
+        self.preload = tuple(preload)
+        self.timeout = timeout
+        self.cpu_time_limit = cpu_time_limit
+        self.memory_limit = memory_limit
+        self.max_executions = max_executions
+        self.max_memory = max_memory
+        self.lease_timeout = lease_timeout
+        self.idle_timeout = idle_timeout
+        self.start_timeout = start_timeout
+        if mp_context is None:
+            mp_context = (
+                "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            )
+        self._mp_context = multiprocessing.get_context(mp_context)
+        self._idle: collections.deque[_Worker] = collections.deque()
+        # Sessions waiting for a worker, in order of arrival
+        self._waiters: collections.deque[Future] = collections.deque()
+        # At most one request per worker is in flight, so this never makes a leased
+        # session wait for a thread
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sandbox-pool")
+        self._leases: dict[str, _Lease] = {}
+        # Variables of each open session, to restore them if its worker is replaced
+        self._session_contexts: dict[str, dict[str, Any]] = {}
+        self._metrics = PoolMetrics()
+        self._lock = threading.Lock()
+        self._workers = [self._start_worker() for _ in range(size)]
+        self._idle.extend(self._workers)
+
+    def _start_worker(self) -> _Worker:
+        return _Worker(
+            self._mp_context,
+            self.preload,
+            self.memory_limit,
+            self.cpu_time_limit,
+            self.start_timeout,
+        )
+
+    def open(self, session_id: str, context: dict[str, Any]) -> None:
+        """Lease a worker for a session.
+
+        Raises:
+            TypeError: If some of the tools or variables in the context can't be pickled.
+            TimeoutError: If no worker became idle within `lease_timeout` seconds.
+        """
+        _check_picklable(context)
+        started = time.monotonic()
+        future = self._acquire()
+        while True:
+            try:
+                worker = future.result(self._wait_interval(started))
+                break
+            except FutureTimeoutError:
+                if self._wait_interval(started) == 0:
+                    self._abandon(future)
+                    raise self._lease_timeout_error() from None
+                self._reclaim_idle()
+        self._start_session(session_id, worker, started, context)
+
+    async def aopen(self, session_id: str, context: dict[str, Any]) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _check_picklable, context)
+        started = time.monotonic()
+        future = self._acquire()
+        waiter = asyncio.wrap_future(future)
+        try:
+            while not waiter.done():
+                await asyncio.wait({waiter}, timeout=self._wait_interval(started))
+                if waiter.done():
+                    break
+                if self._wait_interval(started) == 0:
+                    raise self._lease_timeout_error()
+                await loop.run_in_executor(self._executor, self._reclaim_idle)
+        except BaseException:
+            waiter.cancel()
+            self._abandon(future)
+            raise
+        worker = waiter.result()
+        start = loop.run_in_executor(
+            self._executor, self._start_session, session_id, worker, started, context
+        )
+        try:
+            await asyncio.shield(start)
+        except asyncio.CancelledError:
+            # The thread opens the session anyway, so it's closed once it is open
+            start.add_done_callback(lambda _: self._executor.submit(self.close, session_id))
+            raise
+
+    async def aexecute(self, session_id: str, code: str) -> tuple[str, dict[str, Any]]:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.execute, session_id, code
+        )
+
+    async def aclose(self, session_id: str) -> None:
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.close, session_id)
+
+    def _acquire(self) -> Future:
+        """Get a future resolved with an idle worker, now or when one is released."""
+        future: Future = Future()
+        with self._lock:
+            if self._idle:
+                future.set_result(self._idle.popleft())
+            else:
+                self._waiters.append(future)
+        return future
+
+    def _abandon(self, future: Future) -> None:
+        """Stop waiting for a worker, giving it back if it was already handed over."""
+        with self._lock:
+            with contextlib.suppress(ValueError):
+                self._waiters.remove(future)
+            # Workers are handed over while holding the lock, so this can't race with it
+            worker = future.result() if future.done() and not future.cancelled() else None
+        if worker is not None:
+            self._release(worker)
+
+    def _release(self, worker: _Worker) -> None:
+        """Hand a worker to the first session waiting for one, or make it idle."""
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                # False if the waiter was cancelled, e.g. by an async timeout
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_result(worker)
+                    return
+            self._idle.append(worker)
+
+    def _wait_interval(self, started: float) -> float:
+        """Seconds to wait for a worker before checking for idle sessions again."""
+        if self.lease_timeout is None:
+            return _RECLAIM_INTERVAL
+        return max(0.0, min(_RECLAIM_INTERVAL, started + self.lease_timeout - time.monotonic()))
+
+    def _reclaim_idle(self) -> None:
+        """Close the sessions that have been idle for `idle_timeout` seconds."""
+        if self.idle_timeout is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                session_id
+                for session_id, lease in self._leases.items()
+                if not lease.busy and now - lease.last_used >= self.idle_timeout
+            ]
+            leases = [self._end_lease(session_id) for session_id in idle]
+            self._metrics.reclaims += len(leases)
+        for lease in leases:
+            self._return_worker(lease.worker)
+
+    def _lease_timeout_error(self) -> TimeoutError:
+        return TimeoutError(f"No sandbox worker became idle within {self.lease_timeout} seconds")
+
+    def _start_session(
+        self, session_id: str, worker: _Worker, started: float, context: dict[str, Any]
+    ) -> None:
+        leased = time.monotonic()
+        with self._lock:
+            self._leases[session_id] = _Lease(worker, leased, leased)
+            self._metrics.leases += 1
+            self._metrics.queue_wait_seconds += leased - started
+            self._metrics.max_queue_wait_seconds = max(
+                self._metrics.max_queue_wait_seconds, leased - started
+            )
+        context = dict(context)
+        self._session_contexts[session_id] = context
+        try:
+            try:
+                worker.request("open", context)
+            except (TimeoutError, EOFError, OSError):
+                # The worker never started, e.g. it exited or hung while importing
+                worker = self._leases[session_id].worker = self._replace(worker)
+                worker.request("open", context)
+        except BaseException:
+            with self._lock:
+                self._end_lease(session_id)
+            self._release(self._replace(worker))
+            raise
+
+    def execute(self, session_id: str, code: str) -> tuple[str, dict[str, Any]]:
+        with self._lock:
+            lease = self._leases[session_id]
+            # Keeps the session from being reclaimed while it runs
+            lease.busy = True
+            self._metrics.executions += 1
+        try:
+            return self._execute(session_id, lease, code)
+        finally:
+            lease.last_used = time.monotonic()
+            lease.busy = False
+
+    def _execute(self, session_id: str, lease: _Lease, code: str) -> tuple[str, dict[str, Any]]:
+        worker = lease.worker
+        try:
+            output, new_vars, worker.memory = worker.request("execute", code, self.timeout)
+        except (TimeoutError, EOFError, OSError) as e:
+            if isinstance(e, TimeoutError):
+                output = f"Error during execution: {repr(e)}"
+            else:
+                worker.process.join(1)
+                output = (
+                    "Error during execution: the sandbox process exited "
+                    f"with code {worker.process.exitcode}"
+                )
+            worker = lease.worker = self._replace(worker)
+            worker.request("open", self._session_contexts[session_id])
+            return output, {}
+        worker.executions += 1
+        self._session_contexts[session_id] = merge_context(
+            self._session_contexts[session_id], new_vars
+        )
+        return output, new_vars
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            lease = self._end_lease(session_id)
+        if lease is not None:
+            self._return_worker(lease.worker)
+
+    def _end_lease(self, session_id: str) -> Optional[_Lease]:
+        """Remove the lease of a session. Must be called while holding the lock."""
+        lease = self._leases.pop(session_id, None)
+        self._session_contexts.pop(session_id, None)
+        if lease is not None:
+            self._metrics.lease_seconds += time.monotonic() - lease.leased
+        return lease
+
+    def _return_worker(self, worker: _Worker) -> None:
+        """Reset or replace the worker of a closed session, and release it."""
+        if (self.max_executions is not None and worker.executions >= self.max_executions) or (
+            self.max_memory is not None and worker.memory > self.max_memory
+        ):
+            worker = self._replace(worker)
+        else:
+            worker.request("reset")
+        self._release(worker)
+
+    def is_open(self, session_id: str) -> bool:
+        return session_id in self._leases
+
+    def evaluate(self, code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+        """Execute a snippet on an idle worker. Can be used as an `eval_fn`."""
+        session_id = f"evaluate-{uuid.uuid4()}"
+        self.open(session_id, _locals)
+        try:
+            return self.execute(session_id, code)
+        finally:
+            self.close(session_id)
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        new_worker = self._start_worker()
+        with self._lock:
+            self._workers[self._workers.index(worker)] = new_worker
+            self._metrics.recycles += 1
+        return new_worker
+
+    def metrics(self) -> PoolMetrics:
+        """Get a snapshot of the pool metrics."""
+        with self._lock:
+            return dataclasses.replace(self._metrics)
+
+    def shutdown(self) -> None:
+        """Stop all worker processes."""
+        self._executor.shutdown(wait=False)
+        for worker in self._workers:
+            worker.kill()
+
+    def __enter__(self) -> "SandboxPool":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.shutdown()
@@ -0,0 +1,214 @@
+import array
+import hashlib
+import struct
+import zlib
+from typing import Any, Optional
+
+import ormsgpack
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from langgraph_codeact.cache import MISSING, CacheBackend, CachePolicy
+
+CONTEXT_TYPE = "codeact-context"
+"""Type name of the values written by `ContextSerializer`."""
+
+_HEADER_LENGTH = struct.Struct("<I")
+# Containers with at least this many items are encoded on their own, and compressed
+# if large enough, instead of with the other values of the dict
+_LARGE_CONTAINER_LEN = 64
+_BLOB_NAMESPACE = "blob"
+# Bytes compressed to guess whether a value is worth compressing, e.g. random bytes aren't
+_COMPRESSION_SAMPLE = 4096
+
+
+class ContextSerializer(JsonPlusSerializer):
+    """Checkpoint serializer that writes context values as compact binary blobs.
+
+    Dicts with string keys, such as `CodeActState.context` and the context updates of
+    the sandbox node, are written in a binary format when they hold values that
+    benefit from it, and every other value is serialized like `JsonPlusSerializer`:
+
+    - `bytes`, `bytearray`, `array.array` and numpy arrays (with a plain dtype) are
+      written as raw binary blobs, taken from their buffer without conversion.
+    - Blobs, long strings and containers of many items that are larger than
+      `compress_threshold` bytes are compressed with zlib.
+    - With a `blob_store`, blobs of at least `dedupe_threshold` bytes are stored once
+      per content hash in the store, and the checkpoint only holds the hash. A value
+      that didn't change since the last checkpoint is then hashed, but not compressed
+      or written again.
+
+    The blob store must be kept as long as the checkpoints: use an
+    `InMemoryCacheBackend` with an in-memory checkpointer, and e.g. a
+    `SQLiteCacheBackend` with a persistent one. Stored blobs are never evicted.
+
+    Args:
+        compress_threshold: Minimum size in bytes of the values that are compressed.
+        compression_level: zlib compression level, from 1 (fastest) to 9 (smallest).
+        blob_store: Optional cache backend that blobs are deduplicated in.
+        dedupe_threshold: Minimum size in bytes of the blobs put in `blob_store`.
+        **kwargs: Passed to `JsonPlusSerializer`.
+
+    Example:
+        checkpointer = InMemorySaver(serde=ContextSerializer(blob_store=InMemoryCacheBackend()))
+        agent = create_codeact(model, tools, eval_fn).compile(checkpointer=checkpointer)
+    """
+
+    def __init__(
+        self,
+        *,
+        compress_threshold: int = 4096,
+        compression_level: int = 1,
+        blob_store: Optional[CacheBackend] = None,
+        dedupe_threshold: int = 64 * 1024,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.compress_threshold = compress_threshold
+        self.compression_level = compression_level
+        self.blob_store = blob_store
+        self.dedupe_threshold = dedupe_threshold
+        # Hashes of the blobs already put in the store by this serializer
+        self._stored: set[str] = set()
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        if not isinstance(obj, dict) or not any(_is_large(value) for value in obj.values()):
+            return super().dumps_typed(obj)
+        if not all(isinstance(key, str) for key in obj):
+            return super().dumps_typed(obj)
+        inline: dict[str, Any] = {}
+        entries: list[list[Any]] = []
+        payloads: list[Any] = []
+        for key, value in obj.items():
+            blob = _to_blob(value)
+            if blob is None and not _is_large(value):
+                inline[key] = value
+                continue
+            if blob is None:
+                type_, data = super().dumps_typed(value)
+                kind, meta = "typed", type_
+            else:
+                kind, meta, data = blob
+            codec, data = self._encode(data)
+            entries.append([key, kind, meta, codec, len(data)])
+            payloads.append(data)
+        if inline:
+            type_, data = super().dumps_typed(inline)
+            entries.append([None, "typed", type_, "raw", len(data)])
+            payloads.append(data)
+        header = ormsgpack.packb(entries)
+        return CONTEXT_TYPE, b"".join([_HEADER_LENGTH.pack(len(header)), header, *payloads])
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, data_ = data
+        if type_ != CONTEXT_TYPE:
+            return super().loads_typed(data)
+        view = memoryview(data_)
+        (header_length,) = _HEADER_LENGTH.unpack_from(view)
+        offset = _HEADER_LENGTH.size + header_length
+        result: dict[str, Any] = {}
+        for key, kind, meta, codec, length in ormsgpack.unpackb(view[_HEADER_LENGTH.size : offset]):
+            payload = self._decode(codec, view[offset : offset + length])
+            offset += length
+            if kind == "typed":
+                value = super().loads_typed((meta, payload))
+                if key is None:
+                    result.update(value)
+                    continue
+            else:
+                value = _from_blob(kind, meta, payload)
+            result[key] = value
+        return result
+
+    def _encode(self, data: Any) -> tuple[str, Any]:
+        """Compress, or put in the blob store, the payload of a value."""
+        size = memoryview(data).nbytes
+        if self.blob_store is not None and size >= self.dedupe_threshold:
+            digest = hashlib.sha256(data).hexdigest()
+            if digest not in self._stored:
+                codec, payload = self._compress(data)
+                self.blob_store.set(_BLOB_NAMESPACE, digest, (codec, bytes(payload)), CachePolicy())
+                self._stored.add(digest)
+            return "ref", digest.encode()
+        return self._compress(data)
+
+    def _compress(self, data: Any) -> tuple[str, Any]:
+        size = memoryview(data).nbytes
+        if size >= self.compress_threshold and _is_compressible(data):
+            compressed = zlib.compress(data, self.compression_level)
+            # Incompressible data, e.g. random bytes, is kept as is
+            if len(compressed) < size:
+                return "zlib", compressed
+        return "raw", data
+
+    def _decode(self, codec: str, payload: memoryview) -> bytes:
+        if codec == "ref":
+            digest = bytes(payload).decode()
+            stored = (
+                self.blob_store.get(_BLOB_NAMESPACE, digest)
+                if self.blob_store is not None
+                else MISSING
+            )
+            if stored is MISSING:
+                raise ValueError(f"Blob {digest} is missing from the blob store")
+            codec, payload = stored
+        if codec == "zlib":
+            return zlib.decompress(payload)
+        return bytes(payload)
+
+
+def _is_compressible(data: Any) -> bool:
+    """Check whether compressing the beginning of some data saves at least 10%."""
+    sample = memoryview(data).cast("B")[:_COMPRESSION_SAMPLE]
+    return len(zlib.compress(sample, 1)) < 0.9 * len(sample)
+
+
+def _is_large(value: Any) -> bool:
+    """Check whether a value is worth writing on its own."""
+    if isinstance(value, (bytes, bytearray, array.array)):
+        return True
+    if isinstance(value, str):
+        return len(value) >= _LARGE_CONTAINER_LEN * 16
+    if isinstance(value, (list, tuple, dict, set, frozenset)):
+        return len(value) >= _LARGE_CONTAINER_LEN
+    return _is_ndarray(value)
+
+
+def _is_ndarray(value: Any) -> bool:
+    cls = type(value)
+    if cls.__name__ != "ndarray" or cls.__module__ != "numpy":
+        return False
+    interface = value.__array_interface__
+    # Object and structured dtypes can't be rebuilt from the raw buffer
+    return interface["typestr"][1] != "O" and interface["descr"] == [("", interface["typestr"])]
+
+
+def _to_blob(value: Any) -> Optional[tuple[str, Any, Any]]:
+    """Get the kind, metadata and raw buffer of a value that is written as a blob."""
+    if isinstance(value, bytes):
+        return "bytes", None, value
+    if isinstance(value, bytearray):
+        return "bytearray", None, value
+    if isinstance(value, array.array):
+        return "array", value.typecode, memoryview(value).cast("B")
+    if _is_ndarray(value):
+        interface = value.__array_interface__
+        view = memoryview(value)
+        data = view.cast("B") if view.c_contiguous else view.tobytes()
+        return "ndarray", [interface["typestr"], list(interface["shape"])], data
+    return None
+
+
+def _from_blob(kind: str, meta: Any, data: bytes) -> Any:
+    if kind == "bytes":
+        return data
+    if kind == "bytearray":
+        return bytearray(data)
+    if kind == "array":
+        return array.array(meta, data)
+    if kind == "ndarray":
+        import numpy
+
+        typestr, shape = meta
+        # Copied to a bytearray, so that the array is writable
+        return numpy.frombuffer(bytearray(data), dtype=numpy.dtype(typestr)).reshape(shape)
+    raise ValueError(f"Unknown blob kind: {kind}")
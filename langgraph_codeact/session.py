@@ -0,0 +1,153 @@
+import asyncio
+import builtins
+import io
+import threading
+from abc import ABC, abstractmethod
+from typing import Any
+
+from langgraph_codeact.context import DELETE_VARIABLE
+from langgraph_codeact.utils import arun_code, compile_code, is_async_code, run_code
+
+
+class SessionEvaluator(ABC):
+    """Sandbox that keeps its namespace between executions.
+
+    A plain `eval_fn` receives the full context on every call. A session evaluator
+    is instead opened once with the context, and then only the new script is sent
+    to it on each turn. `create_codeact` opens one session per thread (keyed by
+    the `thread_id` in the config) and closes it when the run ends.
+    """
+
+    @abstractmethod
+    def open(self, session_id: str, context: dict[str, Any]) -> None:
+        """Start a session whose namespace contains the given tools and variables."""
+
+    @abstractmethod
+    def execute(self, session_id: str, code: str) -> tuple[str, dict[str, Any]]:
+        """Execute code in an open session.
+
+        Returns:
+            A tuple of (stdout output, variables created or changed by the code). Deleted
+            variables can be mapped to `DELETE_VARIABLE`.
+        """
+
+    @abstractmethod
+    def close(self, session_id: str) -> None:
+        """Close a session and release its resources. Does nothing if it isn't open."""
+
+    @abstractmethod
+    def is_open(self, session_id: str) -> bool:
+        """Check whether a session is open."""
+
+    async def aopen(self, session_id: str, context: dict[str, Any]) -> None:
+        """Async version of `open`. By default runs `open` in an executor."""
+        await asyncio.get_running_loop().run_in_executor(None, self.open, session_id, context)
+
+    async def aexecute(self, session_id: str, code: str) -> tuple[str, dict[str, Any]]:
+        """Async version of `execute`. By default runs `execute` in an executor."""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.execute, session_id, code
+        )
+
+    async def aclose(self, session_id: str) -> None:
+        """Async version of `close`. By default runs `close` in an executor."""
+        await asyncio.get_running_loop().run_in_executor(None, self.close, session_id)
+
+
+class InProcessSessionEvaluator(SessionEvaluator):
+    """Session evaluator that runs code with `exec` in the current process.
+
+    Scripts can use top-level `await`, e.g. to call async tools concurrently with
+    `asyncio.gather`. The output of `print` is captured per execution, so sessions can
+    run concurrently, but writes straight to `sys.stdout` are not captured.
+
+    > [!Warning]
+    > This is not a sandbox, code has full access to the host. Use it for
+    > development, or as a reference for implementing a session evaluator.
+    """
+
+    def __init__(self) -> None:
+        self._sessions: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def open(self, session_id: str, context: dict[str, Any]) -> None:
+        with self._lock:
+            # Each session gets its own builtins, whose print is replaced on every execution
+            self._sessions[session_id] = {"__builtins__": dict(vars(builtins)), **context}
+
+    def execute(self, session_id: str, code: str) -> tuple[str, dict[str, Any]]:
+        namespace = self._sessions[session_id]
+        before = dict(namespace)
+        f = _capture_print(namespace)
+        try:
+            run_code(code, namespace)
+            output = f.getvalue()
+            if not output:
+                output = "<code ran, no output printed to stdout>"
+        except Exception as e:
+            output = f"Error during execution: {repr(e)}"
+        return output, _namespace_delta(before, namespace)
+
+    async def aexecute(self, session_id: str, code: str) -> tuple[str, dict[str, Any]]:
+        try:
+            compiled = compile_code(code)
+        except SyntaxError:
+            compiled = None
+        if compiled is None or not is_async_code(compiled):
+            return await super().aexecute(session_id, code)
+        # Scripts using top-level await run on the event loop, so that they can
+        # await async tools bound to it
+        namespace = self._sessions[session_id]
+        before = dict(namespace)
+        # Other tasks print while this one is suspended at an await
+        f = _capture_print(namespace)
+        try:
+            await arun_code(code, namespace)
+            output = f.getvalue()
+            if not output:
+                output = "<code ran, no output printed to stdout>"
+        except Exception as e:
+            output = f"Error during execution: {repr(e)}"
+        return output, _namespace_delta(before, namespace)
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def is_open(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+
+def _capture_print(namespace: dict[str, Any]) -> io.StringIO:
+    """Make `print` write to a new buffer in the scripts run in a session namespace.
+
+    `contextlib.redirect_stdout` replaces `sys.stdout` for the whole process, so
+    concurrent executions would capture each other's output.
+    """
+    output = io.StringIO()
+
+    def print_(*args: Any, **kwargs: Any) -> None:
+        if kwargs.get("file") is None:
+            kwargs["file"] = output
+        print(*args, **kwargs)
+
+    # Updated in place, as functions defined by earlier scripts keep the builtins dict
+    # they were created with
+    namespace["__builtins__"]["print"] = print_
+    return output
+
+
+def _namespace_delta(before: dict[str, Any], namespace: dict[str, Any]) -> dict[str, Any]:
+    """Get the variables added, rebound or deleted since `before` was copied.
+
+    Changes are detected by identity, so mutating an object in place is not reported.
+    """
+    delta: dict[str, Any] = {
+        key: value
+        for key, value in namespace.items()
+        if not key.startswith("__") and (key not in before or before[key] is not value)
+    }
+    for key in before:
+        if key not in namespace and not key.startswith("__"):
+            delta[key] = DELETE_VARIABLE
+    return delta
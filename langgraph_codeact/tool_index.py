@@ -0,0 +1,63 @@
+import math
+import re
+from collections import Counter
+from typing import Sequence
+
+from langchain_core.tools import StructuredTool
+
+_TOKEN_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase words, also splitting snake_case and camelCase names."""
+    return [token.lower() for token in _TOKEN_PATTERN.findall(text)]
+
+
+class ToolIndex:
+    """Local BM25 index over tool names and descriptions.
+
+    Used by `create_codeact` to only describe the tools relevant to the
+    conversation in the prompt, when there are too many tools to list all of them.
+
+    Args:
+        tools: The tools to index.
+        k1: BM25 term frequency saturation.
+        b: BM25 document length normalization.
+    """
+
+    def __init__(self, tools: Sequence[StructuredTool], *, k1: float = 1.5, b: float = 0.75):
+        self.tools = list(tools)
+        self.k1 = k1
+        self.b = b
+        self._term_counts = [
+            Counter(tokenize(f"{tool.name} {tool.description}")) for tool in self.tools
+        ]
+        self._lengths = [sum(counts.values()) for counts in self._term_counts]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        document_frequency: Counter[str] = Counter()
+        for counts in self._term_counts:
+            document_frequency.update(counts.keys())
+        n = len(self.tools)
+        self._idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def search(self, query: str, k: int) -> list[StructuredTool]:
+        """Get the `k` tools most relevant to the query, in the order they were given.
+
+        If fewer than `k` tools match the query, the remaining slots are filled with
+        the first tools of the index.
+        """
+        terms = [term for term in set(tokenize(query)) if term in self._idf]
+        scores = []
+        for i, (counts, length) in enumerate(zip(self._term_counts, self._lengths, strict=True)):
+            score = 0.0
+            for term in terms:
+                tf = counts.get(term, 0)
+                if tf:
+                    norm = self.k1 * (1 - self.b + self.b * length / self._avg_length)
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append((-score, i))
+        selected = sorted(i for _, i in sorted(scores)[:k])
+        return [self.tools[i] for i in selected]
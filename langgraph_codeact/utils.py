@@ -1,6 +1,24 @@
-import re
+import ast
+import asyncio
+import functools
+import inspect
+from types import CodeType
+from typing import Any, Optional
 
-BACKTICK_PATTERN = r"(?:^|\n)```(.*?)(?:```(?:\n|$))"
+
+def extract_codeblocks(text: str) -> list[str]:
+    """
+    Extracts all codeblocks from a text string.
+
+    Args:
+        text: A string containing zero or more codeblocks, where each codeblock is
+            surrounded by fences of three or more backticks (```) or tildes (~~~).
+
+    Returns:
+        A list with the code of each codeblock, without the language identifier.
+    """
+    parser = CodeBlockParser()
+    return parser.feed(text) + parser.finish()
 
 
 def extract_and_combine_codeblocks(text: str) -> str:
@@ -9,7 +27,7 @@ def extract_and_combine_codeblocks(text: str) -> str:
 
     Args:
         text: A string containing zero or more codeblocks, where each codeblock is
-            surrounded by triple backticks (```).
+            surrounded by fences of three or more backticks (```) or tildes (~~~).
 
     Returns:
         A string containing the combined code from all codeblocks, with each codeblock
@@ -35,27 +53,157 @@ def extract_and_combine_codeblocks(text: str) -> str:
 
         print('world')
     """
-    # Find all code blocks in the text using regex
-    # Pattern matches anything between triple backticks, with or without a language identifier
-    code_blocks = re.findall(BACKTICK_PATTERN, text, re.DOTALL)
+    # Combine all codeblocks with newlines between them
+    return "\n\n".join(extract_codeblocks(text))
 
-    if not code_blocks:
-        return ""
 
-    # Process each codeblock
-    processed_blocks = []
-    for block in code_blocks:
-        # Strip leading and trailing whitespace
-        block = block.strip()
+class CodeBlockParser:
+    """Incrementally extracts codeblocks from text that arrives in chunks.
 
-        # If the first line looks like a language identifier, remove it
-        lines = block.split("\n")
-        if lines and (not lines[0].strip() or " " not in lines[0].strip()):
-            # First line is empty or likely a language identifier (no spaces)
-            block = "\n".join(lines[1:])
+    The text is read line by line in a single pass. A codeblock opens with a line
+    starting with three or more backticks or tildes, optionally indented and
+    followed by a language identifier, and is closed by a line with a fence of the
+    same character that is at least as long. A longer fence can therefore wrap
+    code that contains shorter fences. A backtick fence at the end of a line of
+    code also closes the block. Blocks that are never closed are ignored.
 
-        processed_blocks.append(block)
+    Each call to `feed` returns the codeblocks whose closing fence has been seen,
+    so callers can act on a block while the rest of the text is still being
+    generated. Call `finish` once the text is complete to flush a block that is
+    closed by the end of the text.
 
-    # Combine all codeblocks with newlines between them
-    combined_code = "\n\n".join(processed_blocks)
-    return combined_code
+    Example:
+        parser = CodeBlockParser()
+        for chunk in model.stream(messages):
+            for block in parser.feed(chunk.content):
+                ...
+        for block in parser.finish():
+            ...
+    """
+
+    def __init__(self) -> None:
+        # Parts of the current line, which hasn't been terminated by a newline yet
+        self._line: list[str] = []
+        # Opening fence of the codeblock being read, None when outside a block
+        self._fence: Optional[str] = None
+        self._indent = 0
+        self._info = ""
+        self._lines: list[str] = []
+
+    def feed(self, text: str) -> list[str]:
+        """Add a chunk of text and return the codeblocks completed by it."""
+        if "\n" not in text:
+            self._line.append(text)
+            return []
+        lines = text.split("\n")
+        self._line.append(lines[0])
+        lines[0] = "".join(self._line)
+        self._line = [lines.pop()]
+        blocks = []
+        for line in lines:
+            block = self._parse_line(line)
+            if block is not None:
+                blocks.append(block)
+        return blocks
+
+    def finish(self) -> list[str]:
+        """Signal the end of the text and return any remaining codeblocks."""
+        block = self._parse_line("".join(self._line)) if self._fence is not None else None
+        self._line = []
+        self._fence = None
+        self._lines = []
+        return [block] if block is not None else []
+
+    def _parse_line(self, line: str) -> Optional[str]:
+        """Process a complete line, returning the code of the block it closes, if any."""
+        if self._fence is None:
+            stripped = line.lstrip(" \t")
+            char = stripped[:1]
+            if char in ("`", "~") and stripped.startswith(char * 3):
+                info = stripped.lstrip(char)
+                # Backticks after the fence mean inline code, e.g. ```nested```
+                if char == "`" and "`" in info:
+                    return None
+                self._fence = stripped[: len(stripped) - len(info)]
+                self._indent = len(line) - len(stripped)
+                self._info = info.strip()
+                self._lines = []
+            return None
+
+        line = line.rstrip()
+        char = self._fence[0]
+        if not line.endswith(char):
+            self._lines.append(self._dedent(line))
+            return None
+        code = line.rstrip(char)
+        if len(line) - len(code) < len(self._fence):
+            self._lines.append(self._dedent(line))
+            return None
+        if code.strip():
+            if char != "`":
+                self._lines.append(self._dedent(line))
+                return None
+            # Closing fence at the end of the last line of code
+            self._lines.append(self._dedent(code))
+        self._fence = None
+        return self._code()
+
+    def _dedent(self, line: str) -> str:
+        """Remove up to the indentation of the opening fence from a line."""
+        if not self._indent:
+            return line
+        indent = len(line) - len(line.lstrip(" \t"))
+        return line[min(indent, self._indent) :]
+
+    def _code(self) -> Optional[str]:
+        lines = self._lines
+        # A language identifier has no spaces, otherwise the info string is
+        # likely code written on the same line as the fence
+        if " " in self._info:
+            lines.insert(0, self._info)
+        start, end = 0, len(lines)
+        while start < end and not lines[start].strip():
+            start += 1
+        while end > start and not lines[end - 1].strip():
+            end -= 1
+        self._lines = []
+        if start == end:
+            return None
+        return "\n".join(lines[start:end]).rstrip()
+
+
+@functools.lru_cache(maxsize=256)
+def compile_code(code: str) -> CodeType:
+    """Compile a script, allowing top-level `await` (e.g. to call async tools).
+
+    Compiled scripts are cached by their content, so a script that was already
+    checked by the graph, or that is retried, is not parsed again.
+    """
+    return compile(code, "<code>", "exec", flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
+
+
+def is_async_code(code: CodeType) -> bool:
+    """Check whether a compiled script uses top-level `await`."""
+    return bool(code.co_flags & inspect.CO_COROUTINE)
+
+
+def run_code(code: str, namespace: dict[str, Any]) -> None:
+    """Execute a script in a namespace, running it in a new event loop if it uses top-level `await`.
+
+    Must not be called from a thread with a running event loop if the script uses
+    top-level `await`, use `arun_code` there instead.
+    """
+    compiled = compile_code(code)
+    if is_async_code(compiled):
+        asyncio.run(eval(compiled, namespace))
+    else:
+        exec(compiled, namespace)
+
+
+async def arun_code(code: str, namespace: dict[str, Any]) -> None:
+    """Execute a script in a namespace, awaiting it if it uses top-level `await`."""
+    compiled = compile_code(code)
+    if is_async_code(compiled):
+        await eval(compiled, namespace)
+    else:
+        exec(compiled, namespace)
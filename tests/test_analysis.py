@@ -0,0 +1,48 @@
+from langgraph_codeact.analysis import get_names, get_referenced_names, plan_parallel_blocks
+
+
+def test_get_names():
+    """Test collecting the names a script reads and writes."""
+    code = """import math as m
+from os import path
+x = fetch(url)
+y += 1
+def f(a):
+    return a + z
+class C:
+    pass
+del w
+"""
+    reads, writes = get_names(code)
+    assert reads == {"fetch", "url", "y", "a", "z"}
+    assert writes == {"m", "path", "x", "y", "f", "C", "w"}
+
+
+def test_independent_blocks_share_a_wave():
+    """Test that blocks only sharing tools and builtins run together."""
+    blocks = ["a = fetch(1)\nprint(a)", "b = fetch(2)", "print(a, b)", "c = fetch(3)"]
+    assert plan_parallel_blocks(blocks, ["fetch"]) == [[0, 1, 3], [2]]
+
+
+def test_blocks_using_the_same_variable_are_ordered():
+    """Test that blocks that may mutate the same object run one after another."""
+    blocks = ["items.append(1)", "print(items)", "total = 1", "print(total)"]
+    assert plan_parallel_blocks(blocks) == [[0, 2], [1, 3]]
+
+
+def test_unparseable_block():
+    """Test that blocks with syntax errors can't be planned."""
+    assert plan_parallel_blocks(["x = 1", "def ("]) is None
+
+
+def test_writing_a_builtin_creates_a_dependency():
+    """Test that shadowing a builtin orders the blocks using it."""
+    assert plan_parallel_blocks(["print(1)", "print = log", "print(2)"]) == [[0], [1], [2]]
+
+
+def test_get_referenced_names():
+    """Test the names a script references, and scripts that may use any name."""
+    assert get_referenced_names("y = add(x, 1)\ndel z") == {"y", "add", "x", "z"}
+    assert get_referenced_names("print(globals()['x'])") is None
+    assert get_referenced_names("eval('x')") is None
+    assert get_referenced_names("x = (") is None
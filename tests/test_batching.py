@@ -0,0 +1,93 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from langgraph_codeact import MicroBatcher, create_codeact
+
+
+class EchoChatModel(BaseChatModel):
+    """Fake chat model answering with the content of the last message."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "echo"
+
+    def _generate(self, messages: list[BaseMessage], *args: Any, **kwargs: Any) -> ChatResult:
+        content = messages[-1].content
+        if content == "fail":
+            raise ValueError("failed")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def make_batcher(**kwargs: Any) -> tuple[MicroBatcher, list[int]]:
+    model = EchoChatModel()
+    sizes: list[int] = []
+
+    def batch_fn(inputs: list, configs: list) -> list:
+        sizes.append(len(inputs))
+        return model.batch(inputs, configs, return_exceptions=True)
+
+    async def abatch_fn(inputs: list, configs: list) -> list:
+        sizes.append(len(inputs))
+        return await model.abatch(inputs, configs, return_exceptions=True)
+
+    return MicroBatcher(model, batch_fn=batch_fn, abatch_fn=abatch_fn, **kwargs), sizes
+
+
+def test_async_calls_are_batched():
+    batcher, sizes = make_batcher(window=0.05, max_batch_size=2)
+
+    async def run() -> list:
+        return await asyncio.gather(
+            *(batcher.ainvoke(str(i)) for i in range(5)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert [r.content for r in results] == ["0", "1", "2", "3", "4"]
+    assert sizes == [2, 2, 1]
+
+    # errors are returned only to the call that caused them
+    sizes.clear()
+
+    async def run_with_error() -> list:
+        return await asyncio.gather(
+            batcher.ainvoke("ok"), batcher.ainvoke("fail"), return_exceptions=True
+        )
+
+    ok, error = asyncio.run(run_with_error())
+    assert ok.content == "ok"
+    assert isinstance(error, ValueError)
+    assert sizes == [2]
+
+
+def test_sync_calls_from_threads_are_batched():
+    batcher, sizes = make_batcher(window=0.1, max_batch_size=8)
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(batcher.invoke, ["a", "b", "c", "d"]))
+    assert [r.content for r in results] == ["a", "b", "c", "d"]
+    assert sizes == [4]
+    with pytest.raises(ValueError):
+        batcher.invoke("fail")
+
+
+def test_codeact_threads_share_model_batches():
+    batcher, sizes = make_batcher(window=0.05)
+    agent = create_codeact(batcher, [], lambda code, _locals: ("", {})).compile()
+
+    async def run() -> list:
+        return await asyncio.gather(
+            *(
+                agent.ainvoke({"messages": [{"role": "user", "content": f"hi {i}"}]})
+                for i in range(3)
+            )
+        )
+
+    results = asyncio.run(run())
+    assert [r["messages"][-1].content for r in results] == ["hi 0", "hi 1", "hi 2"]
+    assert sizes == [3]
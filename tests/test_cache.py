@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from langgraph_codeact.cache import (
+    MISSING,
+    CachePolicy,
+    ExecutionCache,
+    InMemoryCacheBackend,
+    SQLiteCacheBackend,
+    ToolCache,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryCacheBackend()
+    return SQLiteCacheBackend(str(tmp_path / "cache.sqlite"))
+
+
+def test_backend_lru_eviction(backend):
+    """Test that the least recently used values are evicted above maxsize."""
+    policy = CachePolicy(maxsize=2)
+    backend.set("ns", "a", 1, policy)
+    time.sleep(0.01)
+    backend.set("ns", "b", 2, policy)
+    time.sleep(0.01)
+    assert backend.get("ns", "a") == 1
+    time.sleep(0.01)
+    backend.set("ns", "c", 3, policy)
+    assert backend.get("ns", "a") == 1
+    assert backend.get("ns", "b") is MISSING
+    assert backend.get("ns", "c") == 3
+    # namespaces are independent
+    assert backend.get("other", "a") is MISSING
+
+
+def test_backend_ttl(backend):
+    """Test that values expire after their TTL."""
+    backend.set("ns", "a", [1, 2], CachePolicy(ttl=0.05))
+    assert backend.get("ns", "a") == [1, 2]
+    time.sleep(0.1)
+    assert backend.get("ns", "a") is MISSING
+
+
+def test_tool_cache_counts_hits_and_misses():
+    """Test that only tools with a policy are cached."""
+    calls = []
+
+    def add(a, b):
+        calls.append((a, b))
+        return a + b
+
+    cache = ToolCache(policies={"add": CachePolicy()})
+    cached_add = cache.wrap("add", add)
+    assert cached_add(2, 3) == 5
+    assert cached_add(2, 3) == 5
+    assert cached_add(a=2, b=4) == 6
+    assert calls == [(2, 3), (2, 4)]
+    assert cache.stats()["add"].hits == 1
+    assert cache.stats()["add"].misses == 2
+    assert cache.wrap("other", add) is add
+
+
+def test_tool_cache_async_tool():
+    """Test caching a bridged async tool called from an event loop."""
+
+    async def double(x):
+        return x * 2
+
+    def bridged(x):
+        return double(x)
+
+    bridged.__wrapped__ = double
+    cached = ToolCache(default_policy=CachePolicy()).wrap("double", bridged)
+
+    async def main():
+        return [await cached(2), await cached(2)]
+
+    assert asyncio.run(main()) == [4, 4]
+
+
+def test_tool_cache_results(backend):
+    """Test that unpicklable results aren't cached, and that callers get their own copy."""
+    calls = []
+
+    def lookup(key):
+        calls.append(key)
+        if key == "lock":
+            return threading.Lock()
+        return {"items": [1, 2]}
+
+    cached = ToolCache(backend, default_policy=CachePolicy()).wrap("lookup", lookup)
+    assert cached("lock") is not cached("lock")
+    cached("data")["items"].append(99)
+    assert cached("data") == {"items": [1, 2]}
+    assert calls == ["lock", "lock", "data"]
+
+
+def test_execution_cache_key():
+    """Test that the key depends on the script, the values and the tool versions."""
+
+    def add(a, b):
+        return a + b
+
+    def search(query):
+        return query
+
+    cache = ExecutionCache(tool_versions={"add": "1"}, nondeterministic={"search"})
+    key = cache.key("print(add(x, 1))", {"x": 1}, {"add": add})
+    assert key == cache.key("print(add(x, 1))", {"x": 1}, {"add": add})
+    assert key != cache.key("print(add(x, 2))", {"x": 1}, {"add": add})
+    assert key != cache.key("print(add(x, 1))", {"x": 2}, {"add": add})
+    assert key != ExecutionCache().key("print(add(x, 1))", {"x": 1}, {"add": add})
+    assert cache.key("print(search(x))", {"x": 1}, {"search": search}) is None
+    assert cache.key("print(x)", {"x": lambda: 1}, {}) is None
+
+
+def test_execution_cache_returns_copies():
+    """Test that each hit gets its own copy of the cached variables."""
+    cache = ExecutionCache(policy=CachePolicy(maxsize=1))
+    cache.set("a", "output", {"x": [1]})
+    first = cache.get("a")
+    first[1]["x"].append(2)
+    assert cache.get("a") == ("output", {"x": [1]})
+    cache.set("b", "output", {})
+    assert cache.get("a") is None
+    assert cache.stats().hits == 2
+    assert cache.stats().misses == 1
@@ -0,0 +1,851 @@
+import asyncio
+import builtins
+import contextlib
+import io
+import time
+from typing import Any
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.errors import GraphRecursionError
+from langgraph.types import Command
+
+import langgraph_codeact
+from langgraph_codeact import (
+    DELETE_VARIABLE,
+    CachePolicy,
+    ExecutionCache,
+    InMemoryObjectStore,
+    InProcessSessionEvaluator,
+    ToolCache,
+    create_codeact,
+    create_default_prompt,
+)
+from langgraph_codeact.context import get_shared_context
+
+
+class FakeChatModel(GenericFakeChatModel):
+    """Fake chat model that records whether the sync or async API was used."""
+
+    calls: list[str] = []
+    inputs: list[list[BaseMessage]] = []
+
+    def _generate(self, messages: list[BaseMessage], *args: Any, **kwargs: Any) -> Any:
+        self.calls.append("sync")
+        self.inputs.append(messages)
+        return super()._generate(messages, *args, **kwargs)
+
+    async def _agenerate(self, messages: list[BaseMessage], *args: Any, **kwargs: Any) -> Any:
+        self.calls.append("async")
+        self.inputs.append(messages)
+        return super()._generate(messages, *args, **kwargs)
+
+
+def make_model(*responses: str) -> FakeChatModel:
+    return FakeChatModel(
+        messages=iter([AIMessage(content=r) for r in responses]), calls=[], inputs=[]
+    )
+
+
+def eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+    original_keys = set(_locals.keys())
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as f:
+            exec(code, builtins.__dict__, _locals)
+        result = f.getvalue() or "<code ran, no output printed to stdout>"
+    except Exception as e:
+        result = f"Error during execution: {repr(e)}"
+    new_keys = set(_locals.keys()) - original_keys
+    return result, {key: _locals[key] for key in new_keys}
+
+
+async def aeval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+    return eval_fn(code, _locals)
+
+
+def add(a: float, b: float) -> float:
+    """Add two numbers together."""
+    return a + b
+
+
+def test_sync_graph_uses_invoke():
+    model = make_model("```python\nx = add(1, 2)\nprint(x)\n```", "The answer is 3.")
+    agent = create_codeact(model, [add], eval_fn).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "1 + 2?"}]})
+    assert model.calls == ["sync", "sync"]
+    assert result["messages"][2].content == "3\n"
+    assert result["context"] == {"x": 3}
+    assert result["messages"][-1].content == "The answer is 3."
+
+
+def test_async_graph_uses_ainvoke():
+    model = make_model("```python\nx = add(1, 2)\nprint(x)\n```", "The answer is 3.")
+    agent = create_codeact(model, [add], aeval_fn).compile()
+    result = asyncio.run(agent.ainvoke({"messages": [{"role": "user", "content": "1 + 2?"}]}))
+    assert model.calls == ["async", "async"]
+    assert result["messages"][2].content == "3\n"
+    assert result["context"] == {"x": 3}
+
+
+def test_async_graph_with_sync_eval_fn():
+    model = make_model("```python\nprint(add(2, 2))\n```", "4")
+    agent = create_codeact(model, [add], eval_fn).compile()
+    result = asyncio.run(agent.ainvoke({"messages": [{"role": "user", "content": "2 + 2?"}]}))
+    assert model.calls == ["async", "async"]
+    assert result["messages"][2].content == "4\n"
+
+
+class SlowStreamingChatModel(FakeChatModel):
+    """Fake chat model that yields control to the event loop between chunks."""
+
+    log: list[str] = []
+
+    async def _astream(self, *args: Any, **kwargs: Any) -> Any:
+        async for chunk in super()._astream(*args, **kwargs):
+            await asyncio.sleep(0.01)
+            self.log.append(chunk.message.content)
+            yield chunk
+
+
+def test_stream_code_dispatches_blocks_early():
+    response = "```python\nx = add(1, 2)\nprint(x)\n```\nand then\n```\nprint(x * 2)\n```\nsome trailing prose"
+    model = SlowStreamingChatModel(
+        messages=iter([AIMessage(content=response), AIMessage(content="Done.")]),
+        calls=[],
+        inputs=[],
+        log=[],
+    )
+
+    async def logging_eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+        model.log.append(f"eval:{code}")
+        return eval_fn(code, _locals)
+
+    agent = create_codeact(model, [add], logging_eval_fn, stream_code=True).compile()
+    result = asyncio.run(agent.ainvoke({"messages": [{"role": "user", "content": "1 + 2?"}]}))
+
+    assert result["messages"][1].content == response
+    assert result["messages"][2].content == "3\n\n6\n"
+    assert result["context"] == {"x": 3}
+    # the first block ran before the model finished streaming
+    first_eval = model.log.index("eval:x = add(1, 2)\nprint(x)")
+    assert first_eval < model.log.index("prose")
+
+
+def test_stream_code_stops_at_failing_block():
+    response = "```python\nx = 1 / 0\n```\n```python\nprint('deleting everything')\n```"
+    model = SlowStreamingChatModel(
+        messages=iter([AIMessage(content=response), AIMessage(content="Done.")]),
+        calls=[],
+        inputs=[],
+        log=[],
+    )
+    agent = create_codeact(model, [], aeval_fn, stream_code=True).compile()
+    result = asyncio.run(agent.ainvoke({"messages": [{"role": "user", "content": "go"}]}))
+    assert result["messages"][2].content == (
+        "Error during execution: ZeroDivisionError('division by zero')"
+    )
+
+
+def test_sandbox_writes_only_context_delta():
+    model = make_model(
+        "```python\nx = 1\ny = 2\n```",
+        "```python\nprint(x)\n```",
+        "```python\nx = 3\n```",
+        "Done.",
+    )
+
+    def delta_eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+        output, new_vars = eval_fn(code, _locals)
+        if "x = 3" in code:
+            new_vars = {"x": 3, "y": DELETE_VARIABLE}
+        return output, new_vars
+
+    agent = create_codeact(model, [add], delta_eval_fn).compile(checkpointer=InMemorySaver())
+    config = {"configurable": {"thread_id": "1"}}
+    updates = list(
+        agent.stream(
+            {"messages": [{"role": "user", "content": "go"}]}, config, stream_mode="updates"
+        )
+    )
+    sandbox_updates = [u["sandbox"] for u in updates if "sandbox" in u]
+    assert [u.get("context") for u in sandbox_updates] == [
+        {"x": 1, "y": 2},
+        None,
+        {"x": 3, "y": DELETE_VARIABLE},
+    ]
+    assert agent.get_state(config).values["context"] == {"x": 3}
+
+
+def test_object_store_keeps_values_out_of_state():
+    model = make_model(
+        "```python\ndata = [add(1, 0), add(1, 1), add(1, 2)]\nn = 1\n```",
+        "```python\nprint(data, n)\n```",
+        "```python\ndata = data + [4]\n```",
+        "Done.",
+    )
+    store = InMemoryObjectStore()
+    agent = create_codeact(model, [add], eval_fn, object_store=store).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    assert result["context"]["n"] == 1
+    assert result["context"]["data"].startswith("codeact-object:")
+    assert result["messages"][4].content == "[1, 2, 3] 1\n"
+    # the overwritten list was released, only the new one is stored
+    assert list(store._values) == [result["context"]["data"].removeprefix("codeact-object:")]
+
+
+class CountingObjectStore(InMemoryObjectStore):
+    def __init__(self) -> None:
+        super().__init__()
+        self.gets: list[str] = []
+
+    def get(self, key: str) -> Any:
+        self.gets.append(key)
+        return super().get(key)
+
+
+def test_object_store_fetches_only_referenced_values():
+    model = make_model(
+        "```python\ndata = list(range(10))\n```",
+        "```python\nprint(1)\n```",
+        "```python\nprint(2)\n```",
+        "```python\nprint(len(data))\n```",
+        "Done.",
+    )
+    store = CountingObjectStore()
+    agent = create_codeact(model, [], eval_fn, object_store=store).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    assert result["messages"][-2].content == "10\n"
+    assert len(store.gets) == 1
+
+
+class RecordingSessionEvaluator(InProcessSessionEvaluator):
+    """Session evaluator that records the calls made to it."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls: list[tuple[str, ...]] = []
+
+    def open(self, session_id: str, context: dict[str, Any]) -> None:
+        self.calls.append(("open", session_id, *sorted(context)))
+        super().open(session_id, context)
+
+    def execute(self, session_id: str, code: str) -> tuple[str, dict[str, Any]]:
+        self.calls.append(("execute", session_id, code))
+        return super().execute(session_id, code)
+
+    def close(self, session_id: str) -> None:
+        self.calls.append(("close", session_id))
+        super().close(session_id)
+
+
+def test_session_evaluator_is_opened_once_per_run():
+    model = make_model(
+        "```python\nx = add(1, 2)\n```",
+        "```python\nprint(x)\n```",
+        "Done.",
+        "```python\nprint(x + 1)\n```",
+        "Done again.",
+    )
+    evaluator = RecordingSessionEvaluator()
+    agent = create_codeact(model, [add], evaluator).compile(checkpointer=InMemorySaver())
+    config = {"configurable": {"thread_id": "1"}}
+    agent.invoke({"messages": [{"role": "user", "content": "go"}]}, config)
+    result = asyncio.run(agent.ainvoke({"messages": [{"role": "user", "content": "more"}]}, config))
+    assert evaluator.calls == [
+        ("open", "1", "add"),
+        ("execute", "1", "x = add(1, 2)"),
+        ("execute", "1", "print(x)"),
+        ("close", "1"),
+        ("open", "1", "add", "x"),
+        ("execute", "1", "print(x + 1)"),
+        ("close", "1"),
+    ]
+    assert result["messages"][-2].content == "4\n"
+
+
+def test_session_of_aborted_run_is_closed_by_next_run():
+    model = make_model(
+        "```python\nx = 1\n```",
+        "```python\nx = 2\n```",
+        "```python\nprint(x)\n```",
+        "Done.",
+    )
+    evaluator = RecordingSessionEvaluator()
+    agent = create_codeact(model, [], evaluator).compile(checkpointer=InMemorySaver())
+    config = {"configurable": {"thread_id": "1"}, "recursion_limit": 3}
+    with pytest.raises(GraphRecursionError):
+        agent.invoke({"messages": [{"role": "user", "content": "go"}]}, config)
+    assert evaluator.is_open("1")
+    config["recursion_limit"] = 25
+    result = agent.invoke({"messages": [{"role": "user", "content": "more"}]}, config)
+    assert result["messages"][-2].content == "1\n"
+    assert evaluator.calls == [
+        ("open", "1"),
+        ("execute", "1", "x = 1"),
+        ("close", "1"),
+        ("open", "1", "x"),
+        ("execute", "1", "print(x)"),
+        ("close", "1"),
+    ]
+
+
+def test_parallel_blocks_run_concurrently():
+    response = """Fetching both:
+```python
+a = add(1, 1)
+print(a)
+```
+And:
+```python
+b = add(2, 2)
+print(b)
+```
+Then:
+```python
+print(a + b)
+```"""
+    model = make_model(response, "Done.")
+    running = 0
+    max_running = 0
+
+    async def slow_eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return eval_fn(code, _locals)
+
+    agent = create_codeact(model, [add], slow_eval_fn, parallel_blocks=True).compile()
+    result = asyncio.run(agent.ainvoke({"messages": [{"role": "user", "content": "go"}]}))
+    assert max_running == 2
+    assert result["messages"][2].content == "2\n\n4\n\n6\n"
+    assert result["context"] == {"a": 2, "b": 4}
+
+
+async def fetch(key: str) -> str:
+    """Fetch a value by key."""
+    await asyncio.sleep(0.05)
+    return key.upper()
+
+
+def test_async_tools_in_prompt():
+    prompt = create_default_prompt([add, fetch])
+    assert "\ndef add(a: float, b: float) -> float:" in prompt
+    assert "\nasync def fetch(key: str) -> str:" in prompt
+    assert "asyncio.gather" in prompt
+    assert "asyncio.gather" not in create_default_prompt([add])
+
+
+def test_async_tools_can_be_awaited_concurrently():
+    code = "import asyncio\nvalues = await asyncio.gather(fetch('a'), fetch('b'), fetch('c'))"
+    model = make_model(f"```python\n{code}\n```", "Done.")
+    agent = create_codeact(model, [fetch], InProcessSessionEvaluator()).compile()
+    started = time.monotonic()
+    result = asyncio.run(agent.ainvoke({"messages": [{"role": "user", "content": "go"}]}))
+    assert time.monotonic() - started < 0.15
+    assert result["context"]["values"] == ["A", "B", "C"]
+
+
+def test_async_tools_can_be_called_without_await():
+    model = make_model("```python\nprint(fetch('a'))\n```", "Done.")
+    agent = create_codeact(model, [fetch], eval_fn).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    assert result["messages"][2].content == "A\n"
+
+
+def test_tool_cache_is_shared_across_threads():
+    cache = ToolCache(default_policy=CachePolicy(maxsize=100))
+    model = make_model(
+        "```python\nprint(add(2, 3))\n```", "Done.", "```python\nprint(add(2, 3))\n```", "Done."
+    )
+    agent = create_codeact(model, [add], eval_fn, tool_cache=cache).compile()
+    for _ in range(2):
+        result = agent.invoke({"messages": [{"role": "user", "content": "2 + 3?"}]})
+        assert result["messages"][2].content == "5\n"
+    assert cache.stats()["add"].hits == 1
+    assert cache.stats()["add"].misses == 1
+
+
+def test_prompt_caching_moves_breakpoint_forward():
+    model = make_model("```python\nprint(add(1, 2))\n```", "The answer is 3.")
+    agent = create_codeact(model, [add], eval_fn, prompt_caching=True).compile()
+    agent.invoke({"messages": [{"role": "user", "content": "1 + 2?"}]})
+    cache_control = {"type": "ephemeral"}
+    for inputs in model.inputs:
+        assert inputs[0].content[0]["cache_control"] == cache_control
+        assert inputs[-1].content[-1]["cache_control"] == cache_control
+        assert all(not isinstance(m.content, list) for m in inputs[1:-1])
+    assert model.inputs[0][-1].content[-1]["text"] == "1 + 2?"
+    assert model.inputs[1][-1].content[-1]["text"] == "3\n"
+    # the stored messages are not modified
+    assert model.inputs[1][1].content == "1 + 2?"
+
+
+def test_tool_retrieval_selects_tools_for_prompt():
+    def get_weather(city: str) -> str:
+        """Get the current weather forecast for a city."""
+        return "sunny"
+
+    model = make_model("```python\nprint(get_weather('Paris'), add(1, 2))\n```", "Sunny.")
+    agent = create_codeact(model, [add, get_weather], eval_fn, tool_retrieval_k=1).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "Weather in Paris?"}]})
+    system_prompt = model.inputs[0][0].content
+    assert "def get_weather(city: str) -> str:" in system_prompt
+    assert "def add(" not in system_prompt
+    # tools left out of the prompt can still be called
+    assert result["messages"][2].content == "sunny 3\n"
+
+
+def test_tool_retrieval_keeps_task_across_turns():
+    def convert_currency(amount: float, currency: str) -> float:
+        """Convert an amount of money to another currency."""
+        return amount
+
+    def lookup_user_email(name: str) -> str:
+        """Look up the email address of a user."""
+        return ""
+
+    def get_weather(city: str) -> str:
+        """Get the weather forecast for a city."""
+        return "sunny"
+
+    model = make_model(
+        "```python\nx = 1\n```",
+        "```python\ny = x + 1\n```",
+        "```python\nprint(y)\n```",
+        "Sunny.",
+    )
+    tools = [convert_currency, lookup_user_email, get_weather]
+    agent = create_codeact(model, tools, eval_fn, tool_retrieval_k=1).compile()
+    agent.invoke({"messages": [{"role": "user", "content": "weather forecast in Paris?"}]})
+    assert len(model.inputs) == 4
+    for messages in model.inputs:
+        assert "def get_weather(" in messages[0].content
+        assert "def convert_currency(" not in messages[0].content
+
+
+def test_long_outputs_are_truncated():
+    model = make_model("```python\nprint('a' * 50 + 'b' * 50)\n```", "Done.")
+    agent = create_codeact(model, [], eval_fn, max_output_chars=20).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    assert result["messages"][2].content == "a" * 10 + "\n... [81 characters truncated] ...\n" + (
+        "b" * 9 + "\n"
+    )
+
+
+def test_history_window_and_compaction():
+    responses = [f"```python\nx{i} = {i}\n```" for i in range(4)] + ["Done."]
+    model = make_model(*responses)
+    agent = create_codeact(model, [], eval_fn, history_window=3, compact_history=True).compile(
+        checkpointer=InMemorySaver()
+    )
+    config = {"configurable": {"thread_id": "1"}}
+    result = agent.invoke({"messages": [{"role": "user", "content": "Define variables"}]}, config)
+
+    # the model never sees more than the window, plus the summary
+    assert [len(inputs) for inputs in model.inputs] == [2, 4, 4, 5, 5]
+    for inputs in model.inputs:
+        assert inputs[1].type == "human"
+    # the history was compacted into a summary once it reached twice the window
+    messages = result["messages"]
+    assert messages[0].content.startswith("Summary of earlier messages:\n- user: Define variables")
+    assert len(messages) == 7
+    assert messages[-1].content == "Done."
+
+
+def test_syntax_errors_are_returned_without_running_the_sandbox():
+    scripts = []
+
+    def recording_eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+        scripts.append(code)
+        return eval_fn(code, _locals)
+
+    model = make_model("```python\nx = = 1\n```", "```python\nx = 1\n```", "Done.")
+    agent = create_codeact(model, [], recording_eval_fn).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    assert scripts == ["x = 1"]
+    assert result["messages"][2].content.startswith("The code was not run, it has a syntax error:")
+    assert "x = = 1" in result["messages"][2].content
+    assert result["context"] == {"x": 1}
+
+    # with stream_code, the blocks before the error still run
+    scripts.clear()
+    response = "```python\nx = 2\n```\n```python\ny = (\n```\n```python\nz = 3\n```"
+    model = SlowStreamingChatModel(
+        messages=iter([AIMessage(content=response), AIMessage(content="Done.")]),
+        calls=[],
+        inputs=[],
+        log=[],
+    )
+    agent = create_codeact(model, [], recording_eval_fn, stream_code=True).compile()
+    result = asyncio.run(agent.ainvoke({"messages": [{"role": "user", "content": "go"}]}))
+    assert scripts == ["x = 2"]
+    assert "SyntaxError" in result["messages"][2].content
+    assert result["context"] == {"x": 2}
+
+
+def test_prune_context_sends_only_referenced_names():
+    received = []
+
+    def recording_eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+        received.append(set(_locals))
+        return eval_fn(code, _locals)
+
+    model = make_model(
+        "```python\nbig = list(range(1000))\nsmall = 1\n```",
+        "```python\nprint(add(small, 1))\n```",
+        "```python\nprint(len(globals()))\n```",
+        "Done.",
+    )
+    agent = create_codeact(model, [add], recording_eval_fn, prune_context=True).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    assert received == [set(), {"small", "add"}, {"big", "small", "add"}]
+    assert result["messages"][4].content == "2\n"
+    assert result["context"] == {"big": list(range(1000)), "small": 1}
+
+
+class ReplyingChatModel(FakeChatModel):
+    """Fake chat model whose response depends on the last message, and that logs its calls."""
+
+    replies: dict[str, str] = {}
+    log: list[str] = []
+
+    async def _agenerate(self, messages: list[BaseMessage], *args: Any, **kwargs: Any) -> Any:
+        self.log.append("model")
+        content = messages[-1].content
+        reply = self.replies.get(content, "Done.")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))])
+
+
+def test_speculative_model_call_starts_after_sandbox():
+    model = ReplyingChatModel(
+        messages=iter([]),
+        calls=[],
+        inputs=[],
+        replies={"go": "```python\nx = add(1, 2)\n```", "changed": "Saw the change."},
+        log=[],
+    )
+    log = model.log
+    evaluator = RecordingSessionEvaluator()
+    agent = create_codeact(model, [add], evaluator, speculative=True).compile(
+        checkpointer=InMemorySaver(), interrupt_before=["call_model"]
+    )
+    config = {"configurable": {"thread_id": "1"}}
+
+    async def run() -> Any:
+        await agent.ainvoke({"messages": [{"role": "user", "content": "go"}]}, config)
+        log.clear()
+        await agent.ainvoke(None, config)
+        # the next model call started right after the sandbox step, before the interrupt
+        assert log == ["model", "model"]
+        result = await agent.ainvoke(None, config)
+        # and its response was used when resuming
+        assert log == ["model", "model"]
+        assert result["messages"][-1].content == "Done."
+
+        # a speculative response is discarded if the state changed
+        await agent.ainvoke({"messages": [{"role": "user", "content": "go"}]}, config)
+        await agent.ainvoke(None, config)
+        await agent.aupdate_state(config, {"messages": [{"role": "user", "content": "changed"}]})
+        return await agent.ainvoke(None, config)
+
+    result = asyncio.run(run())
+    assert result["messages"][-1].content == "Saw the change."
+    assert result["context"] == {"x": 3}
+    # the new message starts a new run, which reopens the session while the model generates
+    assert [call[0] for call in evaluator.calls] == ["open", "execute", "close"] * 2 + [
+        "open",
+        "close",
+    ]
+
+
+class SlowFailingSessionEvaluator(RecordingSessionEvaluator):
+    """Session evaluator whose async open takes a while and then fails."""
+
+    async def aopen(self, session_id: str, context: dict[str, Any]) -> None:
+        await asyncio.sleep(1)
+        raise TimeoutError("no sandbox available")
+
+
+def test_text_reply_doesnt_wait_for_speculative_open():
+    model = make_model("Hello!")
+    evaluator = SlowFailingSessionEvaluator()
+    agent = create_codeact(model, [], evaluator, speculative=True).compile(
+        checkpointer=InMemorySaver()
+    )
+    config = {"configurable": {"thread_id": "1"}}
+    started = time.perf_counter()
+    result = asyncio.run(agent.ainvoke({"messages": [{"role": "user", "content": "hi"}]}, config))
+    assert time.perf_counter() - started < 0.5
+    assert result["messages"][-1].content == "Hello!"
+    assert evaluator.calls == []
+
+
+def test_speculative_model_call_is_attributed_to_call_model():
+    model = ReplyingChatModel(
+        messages=iter([]),
+        calls=[],
+        inputs=[],
+        replies={"go": "```python\nx = add(1, 2)\n```"},
+        log=[],
+        disable_streaming=True,
+    )
+    agent = create_codeact(model, [add], eval_fn, speculative=True).compile(
+        checkpointer=InMemorySaver()
+    )
+    config = {"configurable": {"thread_id": "1"}}
+
+    async def run() -> list[tuple[str, str]]:
+        return [
+            (message.content, metadata["langgraph_node"])
+            async for message, metadata in agent.astream(
+                {"messages": [{"role": "user", "content": "go"}]}, config, stream_mode="messages"
+            )
+            if isinstance(message, AIMessage)
+        ]
+
+    assert asyncio.run(run()) == [
+        ("```python\nx = add(1, 2)\n```", "call_model"),
+        ("Done.", "call_model"),
+    ]
+    assert model.log == ["model", "model"]
+
+
+def test_speculative_model_call_expires(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(langgraph_codeact, "_SPECULATION_TTL", 0.0)
+    model = ReplyingChatModel(
+        messages=iter([]),
+        calls=[],
+        inputs=[],
+        replies={"go": "```python\nx = add(1, 2)\n```"},
+        log=[],
+    )
+    agent = create_codeact(model, [add], eval_fn, speculative=True).compile(
+        checkpointer=InMemorySaver(), interrupt_before=["call_model"]
+    )
+    config = {"configurable": {"thread_id": "1"}}
+
+    async def run() -> Any:
+        await agent.ainvoke({"messages": [{"role": "user", "content": "go"}]}, config)
+        await agent.ainvoke(None, config)
+        await asyncio.sleep(0.01)
+        model.log.clear()
+        return await agent.ainvoke(None, config)
+
+    result = asyncio.run(run())
+    assert result["messages"][-1].content == "Done."
+    # the speculative call was dropped, so the model was called again when resuming
+    assert model.log == ["model"]
+
+
+def test_iteration_and_error_budgets():
+    model = make_model(*["```python\nx = 1\n```"] * 3, "Done.")
+    agent = create_codeact(model, [], eval_fn, max_iterations=2).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    assert len(model.calls) == 3
+    assert result["messages"][-2].content == "```python\nx = 1\n```"
+    assert result["messages"][-1].content == (
+        "Stopped before finishing the task: the run reached its limit of 2 iterations."
+    )
+    assert result["iterations"] == 0
+
+    # scripts with syntax errors count as iterations
+    model = make_model(*["```python\nx = (\n```"] * 5, "Done.")
+    agent = create_codeact(model, [], eval_fn, max_iterations=2).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    assert len(model.calls) == 3
+    assert "limit of 2 iterations" in result["messages"][-1].content
+
+    # a syntax error counts as a failed script
+    model = make_model("```python\n1 / 0\n```", "```python\nx = (\n```", "Done.")
+    agent = create_codeact(model, [], eval_fn, max_consecutive_errors=2).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    assert len(model.calls) == 2
+    assert result["messages"][-1].content == (
+        "Stopped before finishing the task: 2 scripts in a row failed."
+    )
+
+    model = make_model("```python\nx = 1\n```", "Done.")
+    agent = create_codeact(model, [], eval_fn, deadline=0).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    assert len(model.calls) == 1
+    assert "deadline" in result["messages"][-1].content
+
+
+def test_budget_counters_of_aborted_run_are_reset():
+    model = make_model("```python\n1 / 0\n```", "```python\nx = 1\n```", "Done.")
+    agent = create_codeact(model, [], eval_fn, max_consecutive_errors=1).compile(
+        checkpointer=InMemorySaver()
+    )
+    config = {"configurable": {"thread_id": "1"}, "recursion_limit": 2}
+    with pytest.raises(GraphRecursionError):
+        agent.invoke({"messages": [{"role": "user", "content": "go"}]}, config)
+    assert agent.get_state(config).values["consecutive_errors"] == 1
+    config["recursion_limit"] = 25
+    result = agent.invoke({"messages": [{"role": "user", "content": "retry"}]}, config)
+    assert result["messages"][-1].content == "Done."
+    assert len(model.calls) == 3
+
+
+def test_compact_error_repair():
+    model = make_model(
+        "```python\nx = 1\n```",
+        "Let me divide:\n```python\ny = x / 0\n```",
+        "```python\ny = x / 1\n```",
+        "Done.",
+    )
+    agent = create_codeact(model, [], eval_fn, compact_error_repair=True).compile()
+    result = agent.invoke({"messages": [{"role": "user", "content": "go"}]})
+    # the repair only gets the request, the failing script and its error
+    repair_input = model.inputs[2]
+    assert [m.content for m in repair_input[1:]] == [
+        "go",
+        "```python\ny = x / 0\n```",
+        "Error during execution: ZeroDivisionError('division by zero')",
+    ]
+    assert len(model.inputs[3]) == 8
+    assert result["context"] == {"x": 1, "y": 1.0}
+
+
+def test_shared_context_is_not_copied_per_thread():
+    builds = []
+
+    def build_shared() -> dict[str, Any]:
+        builds.append(1)
+        return {"table": {"a": 1, "b": 2}}
+
+    model = ReplyingChatModel(
+        messages=iter([]),
+        calls=[],
+        inputs=[],
+        replies={"go": "```python\nx = table['b']\ntable = {'a': x}\n```"},
+        log=[],
+    )
+    evaluator = InProcessSessionEvaluator()
+    agent = create_codeact(model, [], evaluator, shared_context=build_shared).compile(
+        checkpointer=InMemorySaver()
+    )
+
+    async def run(thread_id: str) -> Any:
+        config = {"configurable": {"thread_id": thread_id}}
+        return await agent.ainvoke({"messages": [{"role": "user", "content": "go"}]}, config)
+
+    async def run_threads() -> list:
+        return await asyncio.gather(run("1"), run("2"))
+
+    for result in asyncio.run(run_threads()):
+        # the rebound name is stored in the thread's context, the shared one is untouched
+        assert result["context"] == {"x": 2, "table": {"a": 2}}
+    assert builds == [1]
+    assert get_shared_context(build_shared) == {"table": {"a": 1, "b": 2}}
+
+
+def test_streaming_eval_fn_writes_output_chunks():
+    model = make_model("```python\nx = add(1, 2)\nprint(x)\n```", "The answer is 3.")
+
+    async def stream_eval_fn(code: str, _locals: dict[str, Any]) -> Any:
+        yield "running\n"
+        output, new_vars = eval_fn(code, _locals)
+        yield output
+        yield new_vars
+
+    agent = create_codeact(model, [add], stream_eval_fn).compile()
+
+    async def run() -> tuple[list, dict]:
+        chunks, values = [], {}
+        async for mode, chunk in agent.astream(
+            {"messages": [{"role": "user", "content": "1 + 2?"}]},
+            stream_mode=["custom", "values"],
+        ):
+            if mode == "custom":
+                chunks.append(chunk)
+            else:
+                values = chunk
+        return chunks, values
+
+    chunks, result = asyncio.run(run())
+    assert chunks == [{"sandbox_output": "running\n"}, {"sandbox_output": "3\n"}]
+    assert result["messages"][2].content == "running\n3\n"
+    assert result["context"] == {"x": 3}
+
+
+def test_execution_cache_reuses_results_across_threads():
+    calls = []
+
+    def counting_eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+        calls.append(code)
+        return eval_fn(code, _locals)
+
+    def now() -> float:
+        """Get the current time."""
+        return time.time()
+
+    model = ReplyingChatModel(
+        messages=iter([]),
+        calls=[],
+        inputs=[],
+        replies={
+            "add": "```python\nx = add(1, 2)\nprint(x)\n```",
+            "time": "```python\nt = now()\n```",
+            "error": "```python\nprint(1 / 0)\n```",
+        },
+        log=[],
+    )
+    cache = ExecutionCache(nondeterministic={"now"})
+    agent = create_codeact(model, [add, now], counting_eval_fn, execution_cache=cache).compile(
+        checkpointer=InMemorySaver()
+    )
+
+    async def run(thread_id: str, request: str) -> Any:
+        config = {"configurable": {"thread_id": thread_id}}
+        return await agent.ainvoke({"messages": [{"role": "user", "content": request}]}, config)
+
+    for thread_id in ("1", "2"):
+        assert asyncio.run(run(thread_id, "add"))["context"] == {"x": 3}
+        asyncio.run(run(thread_id, "time"))
+        result = asyncio.run(run(thread_id, "error"))
+    # the second add script was reused, scripts calling `now` and failing ones were not
+    assert calls.count("x = add(1, 2)\nprint(x)") == 1
+    assert calls.count("t = now()") == 2
+    assert calls.count("print(1 / 0)") == 2
+    assert result["messages"][-2].content.startswith("Error during execution")
+    assert cache.stats().hits == 1
+
+
+def test_stream_code_runs_edited_script():
+    model = SlowStreamingChatModel(
+        messages=iter([AIMessage(content="```python\nx = add(1, 2)\nprint(x)\n```")]),
+        calls=[],
+        inputs=[],
+        log=[],
+    )
+
+    async def logging_eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+        model.log.append(f"eval:{code}")
+        return eval_fn(code, _locals)
+
+    agent = create_codeact(model, [add], logging_eval_fn, stream_code=True).compile(
+        checkpointer=InMemorySaver(), interrupt_before=["sandbox"]
+    )
+    config = {"configurable": {"thread_id": "1"}}
+
+    async def run() -> Any:
+        await agent.ainvoke({"messages": [{"role": "user", "content": "1 + 2?"}]}, config)
+        await agent.aupdate_state(
+            config, Command(goto="sandbox", update={"script": "x = 10\nprint(x)"})
+        )
+        model.messages = iter([AIMessage(content="Done.")])
+        return await agent.ainvoke(None, config)
+
+    result = asyncio.run(run())
+    # the streamed script ran before the interrupt, and the edited one replaced its result
+    assert [entry for entry in model.log if entry.startswith("eval:")] == [
+        "eval:x = add(1, 2)\nprint(x)",
+        "eval:x = 10\nprint(x)",
+    ]
+    assert result["messages"][2].content == "10\n"
+    assert result["context"] == {"x": 10}
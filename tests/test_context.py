@@ -0,0 +1,34 @@
+import pytest
+
+from langgraph_codeact.context import DELETE_VARIABLE, get_shared_context, merge_context
+
+
+def test_merge_context_applies_delta():
+    """Test that a delta adds, overwrites and deletes variables."""
+    left = {"x": 1, "y": 2}
+    result = merge_context(left, {"x": 3, "y": DELETE_VARIABLE, "z": 4})
+    assert result == {"x": 3, "z": 4}
+    # the existing context is not modified
+    assert left == {"x": 1, "y": 2}
+
+
+def test_merge_context_empty():
+    """Test merging with missing context on either side."""
+    assert merge_context(None, {"x": 1}) == {"x": 1}
+    assert merge_context({"x": 1}, None) == {"x": 1}
+    assert merge_context({"x": 1}, {"missing": DELETE_VARIABLE}) == {"x": 1}
+
+
+def test_shared_context_is_built_once():
+    """Test that a shared context function is called once, and its result is read-only."""
+    calls = []
+
+    def build() -> dict:
+        calls.append(1)
+        return {"table": [1, 2, 3]}
+
+    assert get_shared_context(build) is get_shared_context(build)
+    assert calls == [1]
+    with pytest.raises(TypeError):
+        get_shared_context(build)["table"] = []
+    assert get_shared_context({"x": 1}) == {"x": 1}
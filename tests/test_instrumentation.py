@@ -0,0 +1,74 @@
+import asyncio
+from typing import Any
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+from langgraph_codeact import EventRecorder, InstrumentedCheckpointer, create_codeact
+from langgraph_codeact.instrumentation import CodeActEvent, context_size
+
+
+def eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+    before = set(_locals)
+    exec(code, {}, _locals)
+    return "ok", {key: _locals[key] for key in set(_locals) - before}
+
+
+def make_agent(recorder: EventRecorder, **kwargs: Any) -> Any:
+    model = GenericFakeChatModel(
+        messages=iter(
+            [
+                AIMessage(
+                    content="```python\nx = list(range(100))\n```",
+                    usage_metadata={"input_tokens": 10, "output_tokens": 5, "total_tokens": 15},
+                ),
+                AIMessage(content="Done."),
+            ]
+        )
+    )
+    return create_codeact(model, [], eval_fn, on_event=recorder, **kwargs).compile(
+        checkpointer=InstrumentedCheckpointer(InMemorySaver(), recorder)
+    )
+
+
+def test_events_are_recorded_per_step():
+    recorder = EventRecorder()
+    agent = make_agent(recorder)
+    config = {"configurable": {"thread_id": "1"}}
+    agent.invoke({"messages": [{"role": "user", "content": "go"}]}, config)
+
+    by_name: dict[str, list[CodeActEvent]] = {}
+    for event in recorder.events:
+        by_name.setdefault(event.name, []).append(event)
+    assert [e.step for e in by_name["model"]] == [1, 3]
+    assert by_name["model"][0].attributes == {"input_tokens": 10, "output_tokens": 5}
+    assert by_name["model"][0].thread_id == "1"
+    assert [e.attributes["code_chars"] for e in by_name["extraction"]] == [20, 0]
+    (sandbox,) = by_name["sandbox"]
+    assert sandbox.step == 2
+    assert sandbox.attributes["output_chars"] == 2
+    (step,) = by_name["sandbox_step"]
+    assert step.attributes["variables"] == 1
+    assert step.attributes["context_bytes"] == context_size({"x": list(range(100))})
+    assert all(e.attributes["bytes"] > 0 for e in by_name["checkpoint"])
+    assert recorder.summary()["model"]["count"] == 2
+
+    # the wrapped checkpointer still serves reads
+    state = agent.get_state(config)
+    assert state.values["context"] == {"x": list(range(100))}
+
+
+def test_stream_code_records_time_to_first_token():
+    recorder = EventRecorder()
+    agent = make_agent(recorder, stream_code=True)
+    asyncio.run(
+        agent.ainvoke(
+            {"messages": [{"role": "user", "content": "go"}]},
+            {"configurable": {"thread_id": "1"}},
+        )
+    )
+    model_events = [e for e in recorder.events if e.name == "model"]
+    assert all(e.attributes["time_to_first_token"] is not None for e in model_events)
+    assert all(e.attributes["time_to_first_token"] <= e.duration for e in model_events)
+    assert len([e for e in recorder.events if e.name == "sandbox"]) == 1
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from langgraph_codeact.object_store import (
+    InMemoryObjectStore,
+    is_object_ref,
+    offload_values,
+    release_values,
+    resolve_values,
+)
+
+
+def test_offload_and_resolve_values():
+    """Test that only large or complex values are replaced with references."""
+    store = InMemoryObjectStore()
+    values = {"n": 1, "s": "short", "data": list(range(100)), "long": "x" * 2000}
+    offloaded = offload_values(store, values)
+    assert offloaded["n"] == 1
+    assert offloaded["s"] == "short"
+    assert is_object_ref(offloaded["data"])
+    assert is_object_ref(offloaded["long"])
+    assert resolve_values(store, offloaded) == values
+
+
+def test_lru_eviction_drops_values():
+    """Test that least recently used values are dropped once max_bytes is exceeded."""
+    store = InMemoryObjectStore(max_bytes=3000)
+    first = store.put(b"a" * 1000)
+    second = store.put(b"b" * 1000)
+    # touch the first value so that the second one is evicted next
+    store.get(first)
+    store.put(b"c" * 1000)
+    assert store.get(first) == b"a" * 1000
+    with pytest.raises(KeyError):
+        store.get(second)
+    # missing values are left out of the context
+    assert resolve_values(store, {"x": f"codeact-object:{second}"}) == {}
+
+
+def test_eviction_spills_to_disk(tmp_path):
+    """Test that evicted values are pickled to disk and loaded back on access."""
+    store = InMemoryObjectStore(max_bytes=1500, spill_dir=str(tmp_path))
+    first = store.put(b"a" * 1000)
+    store.put(b"b" * 1000)
+    assert len(list(tmp_path.iterdir())) == 1
+    assert store.get(first) == b"a" * 1000
+
+
+def test_released_values_are_deleted(tmp_path):
+    """Test that values overwritten or deleted in the context are removed, even if spilled."""
+    store = InMemoryObjectStore(max_bytes=1500, spill_dir=str(tmp_path))
+    context = offload_values(store, {"a": b"a" * 2000, "b": b"b" * 2000, "n": 1})
+    assert len(list(tmp_path.iterdir())) == 1
+    release_values(store, context, {"a": "__codeact_delete__", "b": context["b"], "n": 2})
+    assert list(tmp_path.iterdir()) == []
+    assert resolve_values(store, context) == {"b": b"b" * 2000, "n": 1}
+
+
+def test_unpicklable_values_are_kept_in_memory():
+    """Test that values that can't be pickled can still be stored."""
+    store = InMemoryObjectStore()
+    lock = threading.Lock()
+    assert store.get(store.put(lock)) is lock
@@ -0,0 +1,185 @@
+import asyncio
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from langgraph_codeact import DELETE_VARIABLE
+from langgraph_codeact.cache import CachePolicy, ToolCache
+from langgraph_codeact.pool import SandboxPool
+
+
+def test_pool_sessions_keep_namespace():
+    """Test that a leased worker keeps its namespace until the session is closed."""
+    with SandboxPool(size=1, preload=["math"]) as pool:
+        pool.open("1", {"sqrt": math.sqrt, "x": 16})
+        assert pool.is_open("1")
+        assert pool.execute("1", "y = sqrt(x)\nprint(y)") == ("4.0\n", {"y": 4.0})
+        assert pool.execute("1", "del x\nprint(y)") == ("4.0\n", {"x": DELETE_VARIABLE})
+        pool.close("1")
+        assert not pool.is_open("1")
+
+        # the worker is reset before it is leased again
+        pool.open("2", {})
+        output, _ = pool.execute("2", "print(y)")
+        assert output == "Error during execution: NameError(\"name 'y' is not defined\")"
+        pool.close("2")
+
+        metrics = pool.metrics()
+        assert metrics.leases == 2
+        assert metrics.executions == 3
+        assert metrics.recycles == 0
+        assert metrics.lease_seconds > 0
+
+
+def test_pool_recycles_workers():
+    """Test that workers are replaced after max_executions scripts."""
+    with SandboxPool(size=1, max_executions=2) as pool:
+        pool.open("1", {})
+        pool.execute("1", "import os\npid = os.getpid()")
+        output, _ = pool.execute("1", "print(pid)")
+        pool.close("1")
+        assert pool.metrics().recycles == 1
+
+        pool.open("2", {})
+        new_output, _ = pool.execute("2", "import os\nprint(os.getpid())")
+        pool.close("2")
+        assert new_output != output
+
+
+def test_pool_skips_unpicklable_variables():
+    """Test that variables that can't be sent back from a worker are left out."""
+    with SandboxPool(size=1) as pool:
+        pool.open("1", {})
+        output, new_vars = pool.execute("1", "gen = (i for i in range(3))\nn = 1")
+        pool.close("1")
+        assert new_vars == {"n": 1}
+
+
+def test_pool_refuses_unpicklable_tools():
+    """Test that opening a session fails if a tool can't be sent to the workers."""
+    cache = ToolCache(default_policy=CachePolicy())
+    with SandboxPool(size=1, lease_timeout=0.2) as pool:
+        with pytest.raises(TypeError, match="math_sqrt"):
+            pool.open("1", {"math_sqrt": cache.wrap("math_sqrt", math.sqrt), "n": 1})
+        with pytest.raises(TypeError, match="gen"):
+            asyncio.run(pool.aopen("2", {"gen": (i for i in range(3))}))
+        # the worker wasn't leased
+        pool.open("3", {})
+        pool.close("3")
+
+
+def test_pool_evaluate():
+    """Test running independent snippets with the eval_fn interface."""
+    with SandboxPool(size=2) as pool:
+        assert pool.evaluate("y = sqrt(x)", {"sqrt": math.sqrt, "x": 9}) == (
+            "<code ran, no output printed to stdout>",
+            {"y": 3.0},
+        )
+        assert pool.metrics().leases == 1
+
+
+def test_pool_timeout_replaces_worker():
+    """Test that a hanging worker is killed and the session continues on a new one."""
+    with SandboxPool(size=1, timeout=0.5) as pool:
+        pool.open("1", {"x": 1})
+        pool.execute("1", "y = 2")
+        output, new_vars = pool.execute("1", "while True: pass")
+        assert (
+            output
+            == "Error during execution: TimeoutError('Execution timed out after 0.5 seconds')"
+        )
+        assert new_vars == {}
+        assert pool.metrics().recycles == 1
+        # variables from before the failed script are restored
+        assert pool.execute("1", "print(x + y)") == ("3\n", {})
+        pool.close("1")
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires resource limits")
+def test_pool_cpu_time_limit():
+    """Test that a worker exceeding its CPU time limit is replaced."""
+    with SandboxPool(size=1, cpu_time_limit=1) as pool:
+        output, _ = pool.evaluate("while True: pass", {})
+        assert output.startswith("Error during execution: the sandbox process exited")
+        assert pool.evaluate("print(1)", {}) == ("1\n", {})
+        assert pool.metrics().recycles == 1
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires resource limits")
+def test_pool_memory_limit():
+    """Test that allocations above the memory limit fail in the executed code."""
+    with SandboxPool(size=1, memory_limit=1024**3) as pool:
+        output, _ = pool.evaluate("x = bytearray(2 * 1024**3)", {})
+        assert output == "Error during execution: MemoryError()"
+
+
+def test_pool_async_sessions_wait_for_workers():
+    """Test that async sessions waiting for a worker don't block the leased ones."""
+
+    async def run_session(pool: SandboxPool, i: int) -> tuple[str, dict]:
+        await pool.aopen(str(i), {"x": i})
+        try:
+            return await pool.aexecute(str(i), "print(x * 2)")
+        finally:
+            await pool.aclose(str(i))
+
+    async def run_sessions(pool: SandboxPool) -> list:
+        # Waiting sessions must not hold threads of the default executor
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        sessions = asyncio.gather(*(run_session(pool, i) for i in range(16)))
+        return await asyncio.wait_for(sessions, 20)
+
+    with SandboxPool(size=2) as pool:
+        results = asyncio.run(run_sessions(pool))
+        assert [output for output, _ in results] == [f"{i * 2}\n" for i in range(16)]
+        assert pool.metrics().leases == 16
+
+
+def test_pool_lease_timeout():
+    """Test that opening a session fails when no worker becomes idle in time."""
+    with SandboxPool(size=1, lease_timeout=0.2) as pool:
+        pool.open("1", {})
+        with pytest.raises(TimeoutError):
+            pool.open("2", {})
+
+        async def aopen() -> None:
+            await pool.aopen("3", {})
+
+        with pytest.raises(TimeoutError):
+            asyncio.run(aopen())
+        # the abandoned waits don't take the worker once it is released
+        pool.close("1")
+        pool.open("4", {})
+        assert pool.execute("4", "print(1)") == ("1\n", {})
+        pool.close("4")
+
+
+def test_pool_reclaims_idle_sessions():
+    """Test that a session left open gives its worker to a waiting session once idle."""
+    with SandboxPool(size=1, idle_timeout=0.1) as pool:
+        pool.open("1", {})
+        pool.execute("1", "x = 1")
+        pool.open("2", {})
+        assert not pool.is_open("1")
+        assert pool.execute("2", "print('x' in globals())") == ("False\n", {})
+
+        async def aopen() -> None:
+            await pool.aopen("3", {})
+
+        asyncio.run(aopen())
+        assert not pool.is_open("2")
+        assert pool.metrics().reclaims == 2
+        pool.close("3")
+
+
+def test_pool_start_timeout(tmp_path, monkeypatch):
+    """Test that a worker that doesn't start in time is replaced, and then fails the open."""
+    (tmp_path / "slow_module.py").write_text("import time\ntime.sleep(5)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    with SandboxPool(size=1, preload=["slow_module"], start_timeout=0.5) as pool:
+        with pytest.raises(TimeoutError, match="didn't start"):
+            pool.open("1", {})
+        assert not pool.is_open("1")
+        assert pool.metrics().recycles == 2
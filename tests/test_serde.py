@@ -0,0 +1,89 @@
+import array
+import os
+from typing import Any
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from langgraph_codeact import create_codeact
+from langgraph_codeact.cache import CachePolicy, InMemoryCacheBackend
+from langgraph_codeact.serde import CONTEXT_TYPE, ContextSerializer
+
+
+def test_round_trip():
+    """Test that blobs, large values and small values are restored."""
+    serde = ContextSerializer()
+    context = {
+        "data": b"abc" * 10_000,
+        "buffer": bytearray(os.urandom(100)),
+        "values": array.array("d", range(10_000)),
+        "items": list(range(1_000)),
+        "text": "word " * 1_000,
+        "x": 1,
+        "name": "small",
+    }
+    type_, data = serde.dumps_typed(context)
+    assert type_ == CONTEXT_TYPE
+    # the repeated bytes and the array are compressed
+    assert len(data) < len(JsonPlusSerializer().dumps_typed({"data": context["data"]})[1])
+    restored = serde.loads_typed((type_, data))
+    assert restored == context
+    assert type(restored["buffer"]) is bytearray
+    # dicts of small values, and other values, are serialized as before
+    assert serde.dumps_typed({"x": 1}) == JsonPlusSerializer().dumps_typed({"x": 1})
+    assert serde.dumps_typed([b"abc"]) == JsonPlusSerializer().dumps_typed([b"abc"])
+
+
+class CountingCacheBackend(InMemoryCacheBackend):
+    def __init__(self) -> None:
+        super().__init__()
+        self.keys: list[str] = []
+
+    def set(self, namespace: str, key: str, value: Any, policy: CachePolicy) -> None:
+        self.keys.append(key)
+        super().set(namespace, key, value, policy)
+
+
+def test_unchanged_blobs_are_stored_once():
+    """Test that blobs in the blob store are only referenced by the checkpoints."""
+    store = CountingCacheBackend()
+    serde = ContextSerializer(blob_store=store, dedupe_threshold=1024)
+    blob = os.urandom(10_000)
+    first = serde.dumps_typed({"blob": blob, "x": 1})
+    second = serde.dumps_typed({"blob": blob, "x": 2})
+    assert len(first[1]) < 200
+    assert len(second[1]) < 200
+    assert len(store.keys) == 1
+    assert serde.loads_typed(second) == {"blob": blob, "x": 2}
+    # a serializer with another store can't load the references
+    with pytest.raises(ValueError, match="missing from the blob store"):
+        ContextSerializer(blob_store=InMemoryCacheBackend()).loads_typed(second)
+
+
+def test_checkpointed_context():
+    def eval_fn(code: str, _locals: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+        original_keys = set(_locals.keys())
+        exec(code, {}, _locals)
+        new_keys = set(_locals.keys()) - original_keys
+        return "<code ran, no output printed to stdout>", {key: _locals[key] for key in new_keys}
+
+    model = GenericFakeChatModel(
+        messages=iter(
+            [
+                AIMessage(content="```python\ndata = bytes(range(256)) * 100\n```"),
+                AIMessage(content="```python\nsize = len(data)\n```"),
+                AIMessage(content="Done."),
+            ]
+        )
+    )
+    serde = ContextSerializer(blob_store=InMemoryCacheBackend(), dedupe_threshold=1024)
+    checkpointer = InMemorySaver(serde=serde)
+    agent = create_codeact(model, [], eval_fn).compile(checkpointer=checkpointer)
+    config = {"configurable": {"thread_id": "1"}}
+    agent.invoke({"messages": [{"role": "user", "content": "go"}]}, config)
+    assert any(type_ == CONTEXT_TYPE for type_, _ in checkpointer.blobs.values())
+    context = agent.get_state(config).values["context"]
+    assert context == {"data": bytes(range(256)) * 100, "size": 25_600}
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langgraph_codeact import DELETE_VARIABLE
+from langgraph_codeact.session import InProcessSessionEvaluator
+
+
+def add(a: float, b: float) -> float:
+    """Add two numbers together."""
+    return a + b
+
+
+def test_session_keeps_namespace_between_executions():
+    """Test that variables persist in a session and only changes are reported."""
+    evaluator = InProcessSessionEvaluator()
+    evaluator.open("1", {"add": add, "x": 1, "y": 2})
+    assert evaluator.is_open("1")
+
+    output, new_vars = evaluator.execute("1", "z = add(x, y)\nprint(z)")
+    assert output == "3\n"
+    assert new_vars == {"z": 3}
+
+    output, new_vars = evaluator.execute("1", "x = 10\ndel y")
+    assert output == "<code ran, no output printed to stdout>"
+    assert new_vars == {"x": 10, "y": DELETE_VARIABLE}
+
+    evaluator.close("1")
+    assert not evaluator.is_open("1")
+
+
+def test_session_reports_errors():
+    """Test that exceptions are returned as output."""
+    evaluator = InProcessSessionEvaluator()
+    evaluator.open("1", {})
+    output, new_vars = evaluator.execute("1", "1 / 0")
+    assert output == "Error during execution: ZeroDivisionError('division by zero')"
+    assert new_vars == {}
+
+
+def test_concurrent_sessions_capture_their_own_output():
+    """Test that sessions executing at the same time don't capture each other's prints."""
+    evaluator = InProcessSessionEvaluator()
+    barrier = threading.Barrier(4)
+    for i in range(4):
+        evaluator.open(str(i), {"wait": barrier.wait})
+    # a function defined by an earlier script prints to the current output
+    evaluator.execute("0", "def show(value):\n    print(value)")
+
+    def run(i: int) -> str:
+        show = "show" if i == 0 else "print"
+        code = f"for _ in range(3):\n    wait()\n    {show}({i})"
+        return evaluator.execute(str(i), code)[0]
+
+    with ThreadPoolExecutor(4) as executor:
+        outputs = list(executor.map(run, range(4)))
+    assert outputs == [f"{i}\n" * 3 for i in range(4)]
+
+
+def test_async_sessions_capture_their_own_output():
+    """Test that scripts awaiting on the event loop at the same time capture their own prints."""
+    evaluator = InProcessSessionEvaluator()
+    for i in range(4):
+        evaluator.open(str(i), {"asyncio": asyncio})
+
+    async def run() -> list[tuple[str, dict]]:
+        return await asyncio.gather(
+            *(
+                evaluator.aexecute(
+                    str(i), f"for _ in range(3):\n    await asyncio.sleep(0)\n    print({i})"
+                )
+                for i in range(4)
+            )
+        )
+
+    outputs = [output for output, _ in asyncio.run(run())]
+    assert outputs == [f"{i}\n" * 3 for i in range(4)]
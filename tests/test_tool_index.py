@@ -0,0 +1,44 @@
+from langchain_core.tools import tool as create_tool
+
+from langgraph_codeact.tool_index import ToolIndex, tokenize
+
+
+def get_weather(city: str) -> str:
+    """Get the current weather forecast for a city."""
+    return "sunny"
+
+
+def convert_currency(amount: float, currency: str) -> float:
+    """Convert an amount of money to another currency."""
+    return amount
+
+
+def lookupUserEmail(user_id: int) -> str:
+    """Find the email address of a user."""
+    return ""
+
+
+def test_tokenize():
+    """Test splitting snake_case and camelCase names into words."""
+    assert tokenize("lookupUserEmail get_HTTP_status v2") == [
+        "lookup",
+        "user",
+        "email",
+        "get",
+        "http",
+        "status",
+        "v",
+        "2",
+    ]
+
+
+def test_search_ranks_relevant_tools():
+    """Test that the most relevant tools are returned, in their original order."""
+    index = ToolIndex([create_tool(f) for f in (get_weather, convert_currency, lookupUserEmail)])
+    assert [t.name for t in index.search("What's the weather in Paris?", 1)] == ["get_weather"]
+    assert [t.name for t in index.search("email of user 3, and 5 USD in EUR currency", 2)] == [
+        "convert_currency",
+        "lookupUserEmail",
+    ]
+    # unmatched queries fall back to the first tools
+    assert [t.name for t in index.search("hello", 2)] == ["get_weather", "convert_currency"]
@@ -1,4 +1,12 @@
-from langgraph_codeact.utils import extract_and_combine_codeblocks
+import asyncio
+
+from langgraph_codeact.utils import (
+    CodeBlockParser,
+    arun_code,
+    compile_code,
+    extract_and_combine_codeblocks,
+    run_code,
+)
 
 
 def test_empty_text():
@@ -173,3 +181,115 @@ print(f"Final position: {distance_2:.2f} meters")\
 """
     result = extract_and_combine_codeblocks(text)
     assert result == expected
+
+
+def test_tilde_and_nested_fences():
+    """Test tilde fences, and longer fences wrapping code that contains fences."""
+    text = """Tildes:
+~~~python
+x=1
+~~~
+A longer fence:
+````python
+doc = \"\"\"
+```
+inner
+```
+\"\"\"
+````
+~~~
+y = 2
+```"""
+
+    expected = '''\
+x=1
+
+doc = """
+```
+inner
+```
+"""'''
+    result = extract_and_combine_codeblocks(text)
+    assert result == expected
+
+
+def test_consecutive_and_indented_codeblocks():
+    """Test blocks on consecutive lines, indented fences, and unclosed blocks."""
+    text = """1. First step:
+   ```python
+   for i in range(2):
+       print(i)
+   ```
+```
+a=1
+```
+```
+b = 2
+```
+```python
+unclosed = True"""
+
+    expected = """\
+for i in range(2):
+    print(i)
+
+a=1
+
+b = 2\
+"""
+    result = extract_and_combine_codeblocks(text)
+    assert result == expected
+
+
+def test_parser_yields_blocks_as_they_close():
+    """Test that the incremental parser returns each block once its fence is closed."""
+    parser = CodeBlockParser()
+    assert parser.feed("Here is some code:\n``") == []
+    assert parser.feed("`python\nx = 10\n") == []
+    assert parser.feed("```\nAnd more:\n```\ny = ") == ["x = 10"]
+    assert parser.feed('"```nested```"\n```') == []
+    assert parser.finish() == ['y = "```nested```"']
+
+
+def test_parser_matches_extract_on_chunked_input():
+    """Test that feeding text in small chunks gives the same blocks as the full text."""
+    text = """First:
+```python
+def hello():
+    print("Hello!")
+```
+
+Second:
+```
+result = 42
+```
+Trailing text."""
+    parser = CodeBlockParser()
+    blocks = []
+    for i in range(0, len(text), 3):
+        blocks.extend(parser.feed(text[i : i + 3]))
+    blocks.extend(parser.finish())
+    assert "\n\n".join(blocks) == extract_and_combine_codeblocks(text)
+
+
+def test_run_code_with_top_level_await():
+    """Test running scripts that use top-level await, with and without a running loop."""
+
+    async def double(x):
+        return x * 2
+
+    namespace = {"double": double}
+    run_code("import asyncio\nresult = await asyncio.gather(double(1), double(2))", namespace)
+    assert namespace["result"] == [2, 4]
+
+    asyncio.run(arun_code("y = await double(3)", namespace))
+    assert namespace["y"] == 6
+
+    run_code("z = 1 + 1", namespace)
+    assert namespace["z"] == 2
+
+
+def test_compile_code_is_cached():
+    """Test that compiling the same script twice returns the cached code object."""
+    code = "total = sum(range(10))"
+    assert compile_code(code) is compile_code(code)